@@ -8,6 +8,7 @@ from flask import Flask, render_template  # 匯入 Flask 類別與模板函式
 from config import Config                 # 匯入設定檔 (包含資料庫與信箱設定)
 from models import db                     # 匯入資料庫物件 (SQLAlchemy)
 from index import register_all_features   # 從 index.c 匯入功能註冊函式
+from app_metrics import init_app_metrics  # 請求量測（/metrics）與記錄設定
 
 # ------------------------------------------
 # 函式名稱：create_app()
@@ -21,6 +22,8 @@ def create_app():
     with app.app_context():               # 啟動應用程式上下文
         db.create_all()                   # 建立所有模型對應的資料表 (若不存在)
 
+    init_app_metrics(app)                 # 各端點回應時間、SQL 數量、回應大小 → GET /metrics
+
     register_all_features(app)            # 呼叫 index.c 中的函式來註冊所有功能模組
 
     # UI 路由：呈現剛建立的前端模板（與 API 分離）
@@ -0,0 +1,281 @@
+# app_metrics.py
+# ==========================================
+# 請求量測與記錄（由 app.py 的 create_app() 呼叫 init_app_metrics(app) 啟用）
+# - 每個端點（blueprint、endpoint、HTTP 方法）的回應時間、回應大小直方圖與請求數（依狀態碼）
+# - 以 SQLAlchemy 的 before/after_cursor_execute 事件計算每個請求執行的 SQL 語句數與耗時，
+#   依端點累積「每個請求的 SQL 語句數」直方圖：語句數隨資料量成長的端點就是 N+1
+#   不在請求中執行的 SQL（背景寫入、背景清除等執行緒）另外累計；執行失敗的語句由 handle_error 事件清掉計時
+# - GET /metrics 以 Prometheus 文字格式輸出
+# - 記錄器 smart_energy.*（get_logger()）：依 LOG_LEVEL 分級，低於 WARNING 的紀錄依
+#   LOG_SAMPLE_RATE 抽樣輸出；超過 SLOW_REQUEST_MS 或 SQL 語句數超過 SQL_WARN_COUNT 的請求
+#   一律以 WARNING 記錄
+#
+# 注意：
+# - 統計在行程記憶體中，多個 worker 行程各自統計（由 Prometheus 分別抓取後加總）
+# - 串流回應（/events SSE）的時間只計算到回應開始，大小不列入統計
+# ==========================================
+
+from flask import Response, g, has_request_context, request
+from models import db
+from sqlalchemy import event
+from bisect import bisect_left
+import logging
+import random
+import threading
+import time
+
+LOGGER_NAME = "smart_energy"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)       # 秒
+SQL_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200, 500)                   # 每個請求的語句數
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)                       # bytes
+
+UNMATCHED_ENDPOINT = "<unmatched>"     # 沒有對應路由的請求（404）合併為一組，避免標籤數量無限增加
+
+
+def get_logger(name):
+    """取得 smart_energy.<name> 記錄器（輸出格式、等級與抽樣由 init_app_metrics 設定）"""
+    return logging.getLogger(f"{LOGGER_NAME}.{name}")
+
+
+log = get_logger("request")
+
+
+class SamplingFilter(logging.Filter):
+    """WARNING 以上一律輸出，較低等級的紀錄依 rate 機率抽樣"""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or random.random() < self.rate
+
+
+class Histogram:
+    """累積式直方圖（Prometheus histogram 格式）"""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)   # 最後一格為 +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, name, labels):
+        """產生 _bucket / _sum / _count 各行"""
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else _format_number(bound)
+            lines.append(f"{name}_bucket{_format_labels(dict(labels, le=le))} {cumulative}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {_format_number(self.sum)}")
+        lines.append(f"{name}_count{_format_labels(labels)} {self.count}")
+        return lines
+
+
+def _format_number(value):
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+class RequestMetrics:
+    """各端點的請求統計（執行緒安全）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}       # {(blueprint, endpoint, method): 統計}
+        self.background_sql_count = 0
+        self.background_sql_seconds = 0.0
+        self.started_at = time.time()
+
+    def observe_request(self, blueprint, endpoint, method, status, seconds, sql_count, sql_seconds, size):
+        key = (blueprint, endpoint, method)
+        with self._lock:
+            stats = self._endpoints.get(key)
+            if stats is None:
+                stats = self._endpoints[key] = {
+                    "latency": Histogram(LATENCY_BUCKETS),
+                    "sql_count": Histogram(SQL_COUNT_BUCKETS),
+                    "size": Histogram(SIZE_BUCKETS),
+                    "sql_seconds": 0.0,
+                    "status": {}
+                }
+            stats["latency"].observe(seconds)
+            stats["sql_count"].observe(sql_count)
+            stats["sql_seconds"] += sql_seconds
+            if size is not None:
+                stats["size"].observe(size)
+            stats["status"][status] = stats["status"].get(status, 0) + 1
+
+    def observe_background_sql(self, seconds):
+        with self._lock:
+            self.background_sql_count += 1
+            self.background_sql_seconds += seconds
+
+    def render(self):
+        """Prometheus 文字格式"""
+        with self._lock:
+            endpoints = sorted(self._endpoints.items())
+            sections = {
+                "requests": ["# HELP smart_energy_requests_total Requests by endpoint and status code",
+                             "# TYPE smart_energy_requests_total counter"],
+                "latency": ["# HELP smart_energy_request_duration_seconds Request latency",
+                            "# TYPE smart_energy_request_duration_seconds histogram"],
+                "sql_count": ["# HELP smart_energy_request_sql_statements SQL statements executed per request",
+                              "# TYPE smart_energy_request_sql_statements histogram"],
+                "sql_seconds": ["# HELP smart_energy_request_sql_seconds_total Time spent executing SQL in requests",
+                                "# TYPE smart_energy_request_sql_seconds_total counter"],
+                "size": ["# HELP smart_energy_response_size_bytes Response body size (streamed responses excluded)",
+                         "# TYPE smart_energy_response_size_bytes histogram"]
+            }
+            for (blueprint, endpoint, method), stats in endpoints:
+                labels = {"blueprint": blueprint, "endpoint": endpoint, "method": method}
+                for status, count in sorted(stats["status"].items()):
+                    sections["requests"].append(
+                        f"smart_energy_requests_total{_format_labels(dict(labels, status=status))} {count}"
+                    )
+                sections["latency"] += stats["latency"].samples("smart_energy_request_duration_seconds", labels)
+                sections["sql_count"] += stats["sql_count"].samples("smart_energy_request_sql_statements", labels)
+                sections["sql_seconds"].append(
+                    f"smart_energy_request_sql_seconds_total{_format_labels(labels)} "
+                    f"{_format_number(stats['sql_seconds'])}"
+                )
+                sections["size"] += stats["size"].samples("smart_energy_response_size_bytes", labels)
+
+            lines = [line for section in sections.values() for line in section]
+            lines += [
+                "# HELP smart_energy_background_sql_statements_total SQL statements executed outside requests",
+                "# TYPE smart_energy_background_sql_statements_total counter",
+                f"smart_energy_background_sql_statements_total {self.background_sql_count}",
+                "# HELP smart_energy_background_sql_seconds_total Time spent executing SQL outside requests",
+                "# TYPE smart_energy_background_sql_seconds_total counter",
+                f"smart_energy_background_sql_seconds_total {_format_number(self.background_sql_seconds)}",
+                "# HELP smart_energy_process_start_time_seconds Process start time (unix seconds)",
+                "# TYPE smart_energy_process_start_time_seconds gauge",
+                f"smart_energy_process_start_time_seconds {_format_number(self.started_at)}"
+            ]
+        return "\n".join(lines) + "\n"
+
+
+REQUEST_METRICS = RequestMetrics()
+
+
+# ------------------------------------------
+# SQL 計數（SQLAlchemy 事件）
+# ------------------------------------------
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("metrics_query_start", []).append((context, time.perf_counter()))
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get("metrics_query_start")
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()[1]
+    if has_request_context() and "metrics_start" in g:
+        g.metrics_sql_count += 1
+        g.metrics_sql_seconds += elapsed
+    else:
+        REQUEST_METRICS.observe_background_sql(elapsed)
+
+
+def _handle_error(exception_context):
+    # 語句執行失敗時不會觸發 after_cursor_execute：取出這個語句的開始時間，避免堆疊越積越多
+    # （只取出同一個 execution context 的紀錄；讀取結果時才失敗的語句已在 after_cursor_execute 取出）
+    conn = exception_context.connection
+    starts = conn.info.get("metrics_query_start") if conn is not None else None
+    if starts and starts[-1][0] is exception_context.execution_context:
+        starts.pop()
+
+
+# ------------------------------------------
+# 請求量測
+# ------------------------------------------
+
+def _before_request():
+    g.metrics_start = time.perf_counter()
+    g.metrics_sql_count = 0
+    g.metrics_sql_seconds = 0.0
+
+
+def _make_after_request(app):
+    def _after_request(response):
+        start = g.pop("metrics_start", None)
+        if start is None:
+            return response
+        seconds = time.perf_counter() - start
+        sql_count = g.get("metrics_sql_count", 0)
+        sql_seconds = g.get("metrics_sql_seconds", 0.0)
+        size = None if response.is_streamed else response.calculate_content_length()
+        endpoint = request.endpoint or UNMATCHED_ENDPOINT
+        REQUEST_METRICS.observe_request(
+            request.blueprint or "", endpoint, request.method, response.status_code,
+            seconds, sql_count, sql_seconds, size
+        )
+
+        slow = seconds * 1000 >= app.config.get("SLOW_REQUEST_MS", 1000)
+        level = logging.WARNING if slow or sql_count >= app.config.get("SQL_WARN_COUNT", 50) else logging.DEBUG
+        log.log(level, "%s %s -> %s %.1fms sql=%d (%.1fms) size=%s",
+                request.method, endpoint, response.status_code, seconds * 1000,
+                sql_count, sql_seconds * 1000, size if size is not None else "-")
+        return response
+
+    return _after_request
+
+
+def _metrics_view():
+    return Response(REQUEST_METRICS.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+def _configure_logging(app):
+    """設定 smart_energy.* 記錄器的等級、格式與抽樣（重複呼叫只更新設定）"""
+    logger = logging.getLogger(LOGGER_NAME)
+    logger.setLevel(app.config.get("LOG_LEVEL", "INFO"))
+    logger.propagate = False
+    rate = app.config.get("LOG_SAMPLE_RATE", 1.0)
+
+    handler = next((h for h in logger.handlers if getattr(h, "smart_energy_handler", False)), None)
+    if handler is None:
+        handler = logging.StreamHandler()
+        handler.smart_energy_handler = True
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+        handler.addFilter(SamplingFilter(rate))
+        logger.addHandler(handler)
+    else:
+        for f in handler.filters:
+            if isinstance(f, SamplingFilter):
+                f.rate = rate
+
+
+def init_app_metrics(app):
+    """在 app 上啟用請求量測、SQL 計數、/metrics 與記錄設定（需在 db.init_app 之後呼叫）"""
+    _configure_logging(app)
+    if not app.config.get("METRICS_ENABLED", True):
+        return
+
+    with app.app_context():
+        engine = db.engine
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(engine, "handle_error", _handle_error)
+
+    app.before_request(_before_request)
+    app.after_request(_make_after_request(app))
+    app.add_url_rule("/metrics", "metrics", _metrics_view, methods=["GET"])
@@ -23,4 +23,27 @@ class Config:
     # 如果環境變數有設定，優先使用環境變數
     SQLALCHEMY_DATABASE_URI = os.environ.get("DATABASE_URL") or DEFAULT_DB_URI
     
-    SQLALCHEMY_TRACK_MODIFICATIONS = False
\ No newline at end of file
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    
+    # /usage/add 非同步寫入佇列設定（請求帶 "async": true 時使用）
+    USAGE_INGEST_QUEUE_SIZE = 10000       # 佇列上限（滿了回傳 503）
+    USAGE_INGEST_FLUSH_MS = 200           # 最長每隔多少毫秒寫入一次
+    USAGE_INGEST_FLUSH_RECORDS = 500      # 累積多少筆就立即寫入
+    
+    # idempotency_key 保留時數（超過後視為新請求，並可由 flask usage purge-idempotency 清除）
+    USAGE_IDEMPOTENCY_TTL_HOURS = 24
+    
+    # /events 即時事件推送（SSE）
+    EVENTS_HEARTBEAT_SECONDS = 15         # 沒有事件時每隔多少秒送出 heartbeat
+    EVENTS_CLIENT_BUFFER = 256            # 每個連線最多累積幾個未送出的事件（超過時送 reset 並斷線）
+    
+    # DELETE /device/remove 背景清除歷史資料（見 device_purge.py）
+    DEVICE_PURGE_CHUNK_SIZE = 5000        # 每個交易最多刪除幾筆 power_logs / power_intervals
+    DEVICE_PURGE_PAUSE_MS = 50            # 每個交易之間停頓多久（毫秒），讓其他寫入取得鎖
+    
+    # 請求量測（GET /metrics，Prometheus 格式）與記錄（見 app_metrics.py）
+    METRICS_ENABLED = True
+    LOG_LEVEL = "INFO"                    # smart_energy.* 記錄器等級（DEBUG 時每個請求記錄一行）
+    LOG_SAMPLE_RATE = 1.0                 # 低於 WARNING 的紀錄輸出比例（0~1，流量大時調低）
+    SLOW_REQUEST_MS = 1000                # 超過此時間的請求以 WARNING 記錄
+    SQL_WARN_COUNT = 50                   # 單一請求 SQL 語句數超過此值時以 WARNING 記錄（疑似 N+1）
@@ -0,0 +1,557 @@
+# data_import.py
+# ==========================================
+# 大量匯入 CSV / SQL 匯出檔（flask import-data）
+# - 支援 users / devices / device_status / power_logs 四個資料表
+# - CSV：第一列為欄位名稱，資料表由檔名判斷（power_logs.csv → power_logs），或以 --table 指定
+# - SQL：串流解析 INSERT INTO ... VALUES (...), (...); 其他敘述（DELETE、CREATE...）略過
+# - 逐列依模型欄位型別驗證（整數、小數、日期、列舉、必填、長度），不合格的列略過並回報
+# - 每 chunk_size 筆以一個多列 INSERT（executemany；PyMySQL 會改寫成多列 VALUES）寫入並 commit，
+#   之後更新 checkpoint 檔；中斷後重新執行同一個指令會從上次 commit 的位置繼續
+# - 重新計價 / 重建彙總表完成並 commit 後才移除 checkpoint；這一步失敗時重新執行會補做
+# - 匯入 power_logs 後重新產生彙總表（可加 --reprice 依累進費率重新計價）
+#
+# 用法：
+#   flask import-data power_logs.csv devices.csv
+#   flask import-data database_backup            （匯入資料夾中檔名對應資料表的檔案）
+#   flask import-data big_dump.sql --skip-existing --chunk-size 10000
+# ==========================================
+
+from models import db, User, Device, DeviceStatus, PowerLog
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+from flask.cli import with_appcontext
+from sqlalchemy import Boolean, Date, DateTime, Enum, Integer, Numeric, String
+from sqlalchemy.exc import DBAPIError
+from usage_rollup import rebuild_rollups
+from usage_reprice import reprice_all
+import click
+import csv
+import json
+import os
+import re
+import time
+
+# 可匯入的資料表（依此順序匯入，確保外鍵參照的資料先存在）
+IMPORT_TABLES = {
+    "users": User,
+    "devices": Device,
+    "device_status": DeviceStatus,
+    "power_logs": PowerLog
+}
+
+# 匯出檔與模型欄位名稱不同時的對應
+COLUMN_ALIASES = {
+    "device_status": {"current_temp": "current_temperature", "target_temp": "target_temperature"}
+}
+
+DEFAULT_CHUNK_SIZE = 5000
+DEFAULT_CHECKPOINT = "import_checkpoint.json"
+MAX_REPORTED_ERRORS = 20
+
+_INSERT_RE = re.compile(r"INSERT\s+(?:IGNORE\s+)?INTO\s+`?(\w+)`?\s*\(([^)]*)\)\s*VALUES\s*", re.IGNORECASE)
+_SQL_TOKEN_RE = re.compile(
+    r"'((?:[^'\\]|\\.|'')*)'"       # 字串
+    r"|(--\s|--$|#)"                # 註解（到行尾）
+    r"|([(),;])"                    # 符號
+    r"|([^\s(),;']+)"               # 數字、NULL、TRUE 等
+    r"|(')",                        # 未結束的字串（延續到下一行）
+    re.DOTALL
+)
+_SQL_UNESCAPE_RE = re.compile(r"\\(.)|''", re.DOTALL)
+_SQL_ESCAPES = {"n": "\n", "r": "\r", "t": "\t", "0": "\0", "Z": "\x1a"}
+_TRUE_VALUES = {"1", "true", "t", "yes", "y"}
+_FALSE_VALUES = {"0", "false", "f", "no", "n"}
+
+
+# ------------------------------------------
+# 讀取來源檔（串流，不一次載入整個檔案）
+# ------------------------------------------
+
+def table_for_path(path):
+    """由檔名判斷資料表（power_logs.csv、power_logs_data.sql → power_logs），無法判斷回傳 None"""
+    name = os.path.basename(path).lower()
+    # 較長的名稱先比對（device_status 不會被判斷成 devices）
+    for table in sorted(IMPORT_TABLES, key=len, reverse=True):
+        if name.startswith(table):
+            return table
+    return None
+
+
+def iter_csv_rows(path, table):
+    """
+    逐列讀取 CSV
+
+    Yields:
+        (table, columns, values)：空字串視為 NULL
+    """
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        reader = csv.reader(f)
+        columns = next(reader, None)
+        if columns is None:
+            return
+        columns = [c.strip() for c in columns]
+        for row in reader:
+            if not row:
+                continue
+            yield table, columns, [value if value != "" else None for value in row]
+
+
+def _unescape_sql_string(text):
+    """還原 SQL 字串中的 \\ 跳脫與 '' 重複"""
+    if "\\" not in text and "''" not in text:
+        return text
+    return _SQL_UNESCAPE_RE.sub(lambda m: "'" if m.group(1) is None else _SQL_ESCAPES.get(m.group(1), m.group(1)), text)
+
+
+def iter_sql_rows(path):
+    """
+    逐行串流解析 SQL 匯出檔中的 INSERT INTO ... VALUES
+
+    以正規表示式切出 token（字串、符號、數字等），支援反引號欄位名稱、
+    單引號字串（\\ 跳脫與 '' 重複）、跨行字串、VALUES 之間的 -- 註解，
+    以及一行多個 INSERT（mysqldump 格式）
+
+    Yields:
+        (table, columns, values)：未加引號的 NULL 為 None，其餘（數字、TRUE）為字串
+    """
+    table = columns = None
+    values = []
+    token = None        # 目前欄位值（函式呼叫等含括號的值會串接起來）
+    depth = 0           # 0 = VALUES 之間，1 = 一筆資料內，>1 = 欄位值內的括號
+    pending = ""        # 尚未結束的跨行字串
+
+    with open(path, encoding="utf-8-sig") as f:
+        for line in f:
+            if pending:
+                line, pending = pending + line, ""
+            pos = 0
+            while True:
+                if table is None:
+                    # 尋找下一個 INSERT 敘述
+                    match = _INSERT_RE.search(line, pos)
+                    if not match:
+                        break
+                    table = match.group(1).lower()
+                    columns = [c.strip(" `\t\r\n") for c in match.group(2).split(",")]
+                    pos = match.end()
+
+                match = _SQL_TOKEN_RE.search(line, pos)
+                if match is None:
+                    break
+                string, comment, symbol, bare, unterminated = match.groups()
+                if unterminated is not None:
+                    # 字串延續到下一行
+                    pending = line[match.start():]
+                    break
+                if comment is not None:
+                    break
+                pos = match.end()
+
+                if string is not None:
+                    token = (token or "") + _unescape_sql_string(string) if depth > 1 else _unescape_sql_string(string)
+                elif bare is not None:
+                    if depth > 1:
+                        token = (token or "") + bare
+                    else:
+                        token = None if bare.upper() == "NULL" else bare
+                elif symbol == "(":
+                    if depth >= 1:
+                        token = (token or "") + "("
+                    depth += 1
+                elif symbol == ")":
+                    depth -= 1
+                    if depth >= 1:
+                        token = (token or "") + ")"
+                    else:
+                        values.append(token)
+                        token = None
+                        yield table, columns, values
+                        values = []
+                elif symbol == ",":
+                    if depth > 1:
+                        token = (token or "") + ","
+                    elif depth == 1:
+                        values.append(token)
+                        token = None
+                elif symbol == ";" and depth == 0:
+                    table = columns = None
+
+
+def iter_source_rows(path, table=None):
+    """依副檔名選擇讀取方式"""
+    if path.lower().endswith(".sql"):
+        for row in iter_sql_rows(path):
+            yield row
+        return
+    table = table or table_for_path(path)
+    if table is None:
+        raise click.ClickException(f"無法由檔名判斷 {path} 對應的資料表，請以 --table 指定")
+    for row in iter_csv_rows(path, table):
+        yield row
+
+
+# ------------------------------------------
+# 驗證與型別轉換
+# ------------------------------------------
+
+def _column_converter(column):
+    """依欄位型別產生轉換函式（值為 None 時回傳 None；格式錯誤丟出 ValueError）"""
+    column_type = column.type
+    name = column.name
+
+    if isinstance(column_type, Enum):
+        allowed = set(column_type.enums)
+
+        def convert(raw):
+            if raw not in allowed:
+                raise ValueError(f"{name} 必須是 {', '.join(sorted(allowed))} 之一: {raw}")
+            return raw
+    elif isinstance(column_type, Boolean):
+        def convert(raw):
+            text = str(raw).strip().lower()
+            if text in _TRUE_VALUES:
+                return True
+            if text in _FALSE_VALUES:
+                return False
+            raise ValueError(f"{name} 不是布林值: {raw}")
+    elif isinstance(column_type, Integer):
+        def convert(raw):
+            try:
+                return int(raw)
+            except ValueError:
+                raise ValueError(f"{name} 不是整數: {raw}")
+    elif isinstance(column_type, Numeric):
+        precision, scale = column_type.precision, column_type.scale
+
+        def convert(raw):
+            try:
+                value = Decimal(str(raw).strip())
+            except InvalidOperation:
+                raise ValueError(f"{name} 不是數字: {raw}")
+            if not value.is_finite():
+                raise ValueError(f"{name} 不是有限的數字: {raw}")
+            if precision is not None and scale is not None and abs(value) >= Decimal(10) ** (precision - scale):
+                raise ValueError(f"{name} 超出欄位範圍 DECIMAL({precision},{scale}): {raw}")
+            return value
+    elif isinstance(column_type, DateTime):
+        def convert(raw):
+            try:
+                return datetime.fromisoformat(str(raw).strip())
+            except ValueError:
+                raise ValueError(f"{name} 時間格式錯誤: {raw}，應為 YYYY-MM-DD HH:MM:SS")
+    elif isinstance(column_type, Date):
+        def convert(raw):
+            try:
+                return date.fromisoformat(str(raw).strip())
+            except ValueError:
+                raise ValueError(f"{name} 日期格式錯誤: {raw}，應為 YYYY-MM-DD")
+    elif isinstance(column_type, String) and column_type.length:
+        length = column_type.length
+
+        def convert(raw):
+            if len(raw) > length:
+                raise ValueError(f"{name} 超過 {length} 個字元")
+            return raw
+    else:
+        def convert(raw):
+            return raw
+
+    is_text = isinstance(column_type, String) and not isinstance(column_type, Enum)
+
+    def convert_or_none(raw):
+        # 非字串欄位的空字串視為 NULL
+        if raw is None or (raw == "" and not is_text):
+            return None
+        return convert(raw)
+
+    return convert_or_none
+
+
+def _column_default(column):
+    """欄位的 Python 端預設值（沒有時回傳 None）"""
+    default = column.default
+    if default is None or not default.is_scalar and not default.is_callable:
+        return None
+    return default.arg(None) if default.is_callable else default.arg
+
+
+class _RowValidator:
+    """將來源欄位對應到模型欄位，並逐列轉換與驗證"""
+
+    def __init__(self, table, columns):
+        model_table = IMPORT_TABLES[table].__table__
+        aliases = COLUMN_ALIASES.get(table, {})
+        self.table = model_table
+        self.source_width = len(columns)
+        self.targets = []
+        self.ignored = []
+        for index, source_name in enumerate(columns):
+            name = aliases.get(source_name, source_name)
+            if name not in model_table.columns:
+                self.ignored.append(source_name)
+                continue
+            column = model_table.columns[name]
+            required = not column.nullable and not (column.primary_key and column.autoincrement)
+            self.targets.append((index, name, _column_converter(column), required, column))
+
+        present = {name for _, name, _, _, _ in self.targets}
+        missing = [
+            c.name for c in model_table.columns
+            if not c.nullable and c.name not in present and c.default is None
+            and not (c.primary_key and c.autoincrement)
+        ]
+        if missing:
+            raise click.ClickException(f"{table} 缺少必要欄位: {', '.join(missing)}")
+
+    def convert(self, values):
+        """
+        Returns:
+            dict: 可直接 INSERT 的欄位值
+        Raises:
+            ValueError: 驗證失敗
+        """
+        if len(values) != self.source_width:
+            raise ValueError(f"欄位數量不符（應為 {self.source_width}，實際 {len(values)}）")
+        record = {}
+        for index, name, convert, required, column in self.targets:
+            value = convert(values[index])
+            if value is None:
+                if required:
+                    raise ValueError(f"{name} 不可為空")
+                if not column.primary_key:
+                    value = _column_default(column)
+            record[name] = value
+        return record
+
+
+# ------------------------------------------
+# checkpoint
+# ------------------------------------------
+
+def _file_signature(path):
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def load_checkpoint(path):
+    if not os.path.exists(path):
+        return {"files": {}}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_checkpoint(path, checkpoint):
+    """先寫入暫存檔再取代，避免中斷時留下寫一半的 checkpoint"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+# ------------------------------------------
+# 匯入
+# ------------------------------------------
+
+class ImportStats:
+    """各資料表的匯入筆數、錯誤與速度統計"""
+
+    def __init__(self):
+        self.started_at = time.monotonic()
+        self.tables = {}
+        self.errors = []
+        self.error_count = 0
+
+    def table(self, table):
+        return self.tables.setdefault(table, {"inserted": 0, "invalid": 0})
+
+    def add_error(self, source, row_number, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(f"{os.path.basename(source)} 第 {row_number} 筆: {message}")
+
+    @property
+    def inserted(self):
+        return sum(t["inserted"] for t in self.tables.values())
+
+    def rate(self):
+        elapsed = time.monotonic() - self.started_at
+        return self.inserted / elapsed if elapsed > 0 else 0.0
+
+
+def _insert_statement(table, skip_existing):
+    """多列 INSERT；skip_existing 時重複的主鍵 / 唯一鍵略過"""
+    statement = table.insert()
+    if skip_existing:
+        statement = statement.prefix_with("IGNORE", dialect="mysql").prefix_with("OR IGNORE", dialect="sqlite")
+    return statement
+
+
+def import_file(path, stats, table=None, chunk_size=DEFAULT_CHUNK_SIZE, skip_rows=0,
+                skip_existing=False, on_commit=None):
+    """
+    匯入單一檔案，每 chunk_size 筆 commit 一次
+
+    Args:
+        path: CSV 或 SQL 檔
+        stats: ImportStats
+        table: CSV 對應的資料表（預設由檔名判斷）
+        skip_rows: 從 checkpoint 繼續時略過的來源筆數
+        skip_existing: 重複的主鍵 / 唯一鍵略過
+        on_commit: 每次 commit 後呼叫 on_commit(已處理的來源筆數)
+
+    Returns:
+        int: 已處理的來源筆數
+    """
+    validators = {}
+    batch = []
+    batch_table = None
+    row_number = 0
+
+    def flush(consumed):
+        """寫入目前的批次；consumed 為此批次（含）之前已處理的來源筆數"""
+        nonlocal batch
+        if not batch:
+            return
+        try:
+            result = db.session.execute(_insert_statement(batch_table, skip_existing), batch)
+            db.session.commit()
+        except DBAPIError as e:
+            db.session.rollback()
+            raise click.ClickException(
+                f"{os.path.basename(path)} 第 {consumed - len(batch) + 1} 筆之後的批次寫入失敗: "
+                f"{e.orig}（已 commit 的資料保留，修正後重新執行即可繼續）"
+            )
+        written = result.rowcount if result.rowcount is not None and result.rowcount >= 0 else len(batch)
+        table_stats = stats.table(batch_table.name)
+        table_stats["inserted"] += written
+        batch = []
+        if on_commit:
+            on_commit(consumed)
+        print(f"  {batch_table.name}: {table_stats['inserted']} rows ({stats.rate():.0f} rows/s)")
+
+    for source_table, columns, values in iter_source_rows(path, table):
+        row_number += 1
+        if row_number <= skip_rows:
+            continue
+        if source_table not in IMPORT_TABLES:
+            stats.add_error(path, row_number, f"不支援的資料表 {source_table}")
+            continue
+
+        key = (source_table, tuple(columns))
+        validator = validators.get(key)
+        if validator is None:
+            validator = validators[key] = _RowValidator(source_table, columns)
+            if validator.ignored:
+                print(f"  {source_table}: 略過不在資料表中的欄位 {', '.join(validator.ignored)}")
+
+        # 換資料表或欄位組合時先寫入目前的批次（同一批次的欄位必須一致）
+        if batch and (validator.table is not batch_table or set(batch[0]) != {t[1] for t in validator.targets}):
+            flush(row_number - 1)
+        batch_table = validator.table
+
+        try:
+            batch.append(validator.convert(values))
+        except ValueError as ve:
+            stats.table(source_table)["invalid"] += 1
+            stats.add_error(path, row_number, str(ve))
+            continue
+
+        if len(batch) >= chunk_size:
+            flush(row_number)
+
+    flush(row_number)
+    if on_commit:
+        on_commit(row_number)
+    return row_number
+
+
+def _collect_files(paths):
+    """展開資料夾（只取檔名對應資料表的 .csv / .sql），並依資料表的匯入順序排序"""
+    order = list(IMPORT_TABLES)
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                full_path = os.path.join(path, name)
+                if not name.lower().endswith((".csv", ".sql")):
+                    continue
+                if table_for_path(full_path) is None:
+                    print(f"略過 {full_path}（無法由檔名判斷資料表）")
+                    continue
+                files.append(full_path)
+        else:
+            files.append(path)
+    return sorted(
+        files,
+        key=lambda p: order.index(table_for_path(p)) if table_for_path(p) else len(order)
+    )
+
+
+@click.command("import-data")
+@click.argument("paths", nargs=-1, required=True, type=click.Path(exists=True))
+@click.option("--table", type=click.Choice(list(IMPORT_TABLES)), help="CSV 對應的資料表（預設由檔名判斷）")
+@click.option("--chunk-size", default=DEFAULT_CHUNK_SIZE, show_default=True, type=click.IntRange(1, 100000),
+              help="每次寫入並 commit 的筆數")
+@click.option("--checkpoint", default=DEFAULT_CHECKPOINT, show_default=True, help="checkpoint 檔路徑")
+@click.option("--restart", is_flag=True, help="忽略既有的 checkpoint，從頭匯入")
+@click.option("--skip-existing", is_flag=True, help="主鍵 / 唯一鍵重複的資料略過（INSERT IGNORE）")
+@click.option("--reprice", is_flag=True, help="匯入 power_logs 後依累進費率重新計價")
+@with_appcontext
+def import_data_command(paths, table, chunk_size, checkpoint, restart, skip_existing, reprice):
+    """匯入 CSV / SQL 匯出檔（flask import-data）"""
+    files = _collect_files(paths)
+    state = {"files": {}} if restart else load_checkpoint(checkpoint)
+    stats = ImportStats()
+
+    for path in files:
+        key = os.path.abspath(path)
+        signature = _file_signature(path)
+        entry = state["files"].get(key)
+        skip_rows = 0
+        if entry is not None:
+            if {k: entry.get(k) for k in signature} != signature:
+                raise click.ClickException(
+                    f"{path} 在上次匯入後已變更，無法從 checkpoint 繼續（確認後加 --restart 從頭匯入）"
+                )
+            if entry.get("done"):
+                print(f"{path}: 已匯入，略過")
+                continue
+            skip_rows = entry["rows"]
+
+        print(f"{path}: 開始匯入" + (f"（從第 {skip_rows + 1} 筆繼續）" if skip_rows else ""))
+
+        def on_commit(rows, key=key, signature=signature):
+            state["files"][key] = dict(signature, rows=rows, done=False)
+            save_checkpoint(checkpoint, state)
+
+        rows = import_file(path, stats, table, chunk_size, skip_rows, skip_existing, on_commit)
+        state["files"][key] = dict(signature, rows=rows, done=True)
+        save_checkpoint(checkpoint, state)
+
+    # 重新計價與重建彙總表先記入 checkpoint；中途失敗時重新執行會補做，即使這次沒有新寫入的 power_logs
+    if stats.tables.get("power_logs", {}).get("inserted"):
+        state["rollups_pending"] = True
+        state["reprice_pending"] = state.get("reprice_pending", False) or reprice
+        save_checkpoint(checkpoint, state)
+
+    if state.get("rollups_pending"):
+        if state.get("reprice_pending"):
+            repriced = reprice_all()
+            db.session.commit()
+            print(f"Repriced {repriced['months']} months, {repriced['updated']} logs updated")
+        rollups = rebuild_rollups()
+        db.session.commit()
+        print(f"Rebuilt rollups: {rollups['daily_rows']} daily rows, {rollups['monthly_rows']} monthly rows")
+
+    # 全部完成（含彙總表）後才移除 checkpoint
+    if os.path.exists(checkpoint):
+        os.remove(checkpoint)
+
+    elapsed = time.monotonic() - stats.started_at
+    for name, table_stats in stats.tables.items():
+        print(f"{name}: {table_stats['inserted']} inserted, {table_stats['invalid']} invalid")
+    for error in stats.errors:
+        print(f"  ! {error}")
+    if stats.error_count > len(stats.errors):
+        print(f"  ! ...另有 {stats.error_count - len(stats.errors)} 筆錯誤")
+    print(f"Imported {stats.inserted} rows in {elapsed:.1f}s ({stats.rate():.0f} rows/s)")
@@ -24,6 +24,11 @@ CREATE TABLE `users` (
 -- ============================================
 -- 資料表 2: devices (設備資料表)
 -- 用途: 儲存所有智慧家電設備資訊
+-- 既有資料庫升級（加入軟刪除欄位）:
+--   ALTER TABLE `devices` ADD COLUMN `deleted_at` TIMESTAMP NULL DEFAULT NULL AFTER `is_active`,
+--                         ADD INDEX idx_devices_deleted_at (`deleted_at`);
+-- 既有資料庫升級（依位置 / 類型群組控制）:
+--   ALTER TABLE `devices` ADD INDEX idx_location_type_active (`location`, `device_type`, `is_active`);
 -- ============================================
 CREATE TABLE `devices` (
   `device_id` INT AUTO_INCREMENT PRIMARY KEY COMMENT '設備ID',
@@ -34,10 +39,13 @@ CREATE TABLE `devices` (
   `location` VARCHAR(100) COMMENT '安裝位置',
   `rated_power` DECIMAL(6,2) COMMENT '額定功率(kW)',
   `is_active` BOOLEAN DEFAULT TRUE COMMENT '設備是否啟用',
+  `deleted_at` TIMESTAMP NULL DEFAULT NULL COMMENT '軟刪除時間（等待背景清除）',
   `created_at` TIMESTAMP DEFAULT CURRENT_TIMESTAMP COMMENT '建立時間',
   `updated_at` TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP COMMENT '更新時間',
   FOREIGN KEY (`user_id`) REFERENCES `users`(`user_id`) ON DELETE CASCADE,
-  INDEX idx_user_device (`user_id`, `device_type`)
+  INDEX idx_user_device (`user_id`, `device_type`),
+  INDEX idx_devices_deleted_at (`deleted_at`),
+  INDEX idx_location_type_active (`location`, `device_type`, `is_active`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='設備資料表';
 
 -- ============================================
@@ -75,6 +83,68 @@ CREATE TABLE `power_logs` (
   INDEX idx_log_date (`log_date`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='電力使用記錄表';
 
+-- ============================================
+-- 資料表 4-1: power_intervals (區間用電記錄表)
+-- 用途: 儲存 15 分鐘 / 1 小時的電錶讀數，有區間讀數的日期，power_logs 的度數由當日區間加總產生
+-- ============================================
+CREATE TABLE `power_intervals` (
+  `interval_id` INT AUTO_INCREMENT PRIMARY KEY COMMENT '區間記錄ID',
+  `device_id` INT NOT NULL COMMENT '設備ID',
+  `interval_start` DATETIME NOT NULL COMMENT '區間開始時間',
+  `interval_minutes` SMALLINT NOT NULL COMMENT '區間長度(分鐘，15 或 60)',
+  `energy_consumed` DECIMAL(10,4) NOT NULL COMMENT '用電量(kWh)',
+  FOREIGN KEY (`device_id`) REFERENCES `devices`(`device_id`) ON DELETE CASCADE,
+  UNIQUE KEY uk_device_interval (`device_id`, `interval_start`),
+  INDEX idx_interval_start (`interval_start`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='區間用電記錄表';
+
+-- ============================================
+-- 資料表 5: usage_daily_rollup (每日用電彙總表)
+-- 用途: 每設備每日的用電量、電費與筆數，device_id = 0 代表全戶合計
+--       由寫入 power_logs 的交易同步更新；既有資料庫可執行 flask usage rebuild-rollups 重建
+-- ============================================
+CREATE TABLE `usage_daily_rollup` (
+  `rollup_id` INT AUTO_INCREMENT PRIMARY KEY COMMENT '彙總ID',
+  `device_id` INT NOT NULL COMMENT '設備ID（0 = 全戶）',
+  `log_date` DATE NOT NULL COMMENT '日期',
+  `energy_consumed` DECIMAL(14,4) NOT NULL DEFAULT 0 COMMENT '用電量(kWh)',
+  `cost` DECIMAL(14,2) NOT NULL DEFAULT 0 COMMENT '電費(元)',
+  `record_count` INT NOT NULL DEFAULT 0 COMMENT '紀錄筆數',
+  UNIQUE KEY uk_daily_rollup_device_date (`device_id`, `log_date`),
+  INDEX idx_daily_rollup_date (`log_date`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='每日用電彙總表';
+
+-- ============================================
+-- 資料表 6: usage_monthly_rollup (每月用電彙總表)
+-- 用途: 每設備每月的用電量、電費與筆數，month_start 為該月 1 日，device_id = 0 代表全戶合計
+--       全戶列同時作為月帳本（寫入用電紀錄時以 SELECT ... FOR UPDATE 鎖定）
+-- ============================================
+CREATE TABLE `usage_monthly_rollup` (
+  `rollup_id` INT AUTO_INCREMENT PRIMARY KEY COMMENT '彙總ID',
+  `device_id` INT NOT NULL COMMENT '設備ID（0 = 全戶）',
+  `month_start` DATE NOT NULL COMMENT '月份（該月 1 日）',
+  `energy_consumed` DECIMAL(14,4) NOT NULL DEFAULT 0 COMMENT '用電量(kWh)',
+  `cost` DECIMAL(14,2) NOT NULL DEFAULT 0 COMMENT '電費(元)',
+  `record_count` INT NOT NULL DEFAULT 0 COMMENT '紀錄筆數',
+  UNIQUE KEY uk_monthly_rollup_device_month (`device_id`, `month_start`),
+  INDEX idx_monthly_rollup_month (`month_start`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='每月用電彙總表';
+
+-- ============================================
+-- 資料表 7: usage_idempotency_keys (用電寫入去重表)
+-- 用途: 記錄 idempotency_key 對應的原始處理結果，客戶端重送時直接回傳
+--       超過保留期限的紀錄由 flask usage purge-idempotency 清除（依 created_at）
+-- ============================================
+CREATE TABLE `usage_idempotency_keys` (
+  `key_id` INT AUTO_INCREMENT PRIMARY KEY COMMENT '去重紀錄ID',
+  `idempotency_key` VARCHAR(128) NOT NULL COMMENT '客戶端提供的 idempotency key',
+  `log_id` INT COMMENT '對應的用電記錄ID',
+  `result` TEXT NOT NULL COMMENT '原始回傳結果(JSON)',
+  `created_at` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP COMMENT '建立時間',
+  UNIQUE KEY uk_idempotency_key (`idempotency_key`),
+  INDEX idx_idempotency_created (`created_at`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='用電寫入去重表';
+
 -- ============================================
 -- 插入測試資料
 -- ============================================
@@ -107,6 +177,16 @@ INSERT INTO `power_logs` (`device_id`, `log_date`, `energy_consumed`, `cost`, `e
 (1, '2025-11-14', 5.1000, 16.32, 3.20),
 (2, '2025-11-14', 1.5000, 4.80, 3.20);
 
+-- 5. 由電力使用記錄產生彙總（每設備 + 全戶）
+INSERT INTO `usage_daily_rollup` (`device_id`, `log_date`, `energy_consumed`, `cost`, `record_count`)
+SELECT `device_id`, `log_date`, SUM(`energy_consumed`), SUM(`cost`), COUNT(*) FROM `power_logs` GROUP BY `device_id`, `log_date`
+UNION ALL
+SELECT 0, `log_date`, SUM(`energy_consumed`), SUM(`cost`), COUNT(*) FROM `power_logs` GROUP BY `log_date`;
+
+INSERT INTO `usage_monthly_rollup` (`device_id`, `month_start`, `energy_consumed`, `cost`, `record_count`)
+SELECT `device_id`, DATE_FORMAT(`log_date`, '%Y-%m-01'), SUM(`energy_consumed`), SUM(`cost`), SUM(`record_count`)
+FROM `usage_daily_rollup` GROUP BY `device_id`, DATE_FORMAT(`log_date`, '%Y-%m-01');
+
 -- ============================================
 -- 實用查詢範例
 -- ============================================
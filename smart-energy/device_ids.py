@@ -0,0 +1,128 @@
+# device_ids.py
+# ==========================================
+# 設備 ID 配置：使用最小可用的正整數（填補被刪除的 ID）
+# - 由資料庫找出空號區間，不把所有 device_id 讀進 Python：
+#   devices d LEFT JOIN devices x ON x.device_id = d.device_id + 1 WHERE x.device_id IS NULL
+#   找出「下一號沒人用」的位置，再以 MIN(device_id) > d.device_id 取得區間結尾；
+#   依主鍵順序掃描，找到足夠的空號就停止（LIMIT），每個空號區間一列
+# - insert_devices() 一次配置多個 ID 並以一個多列 INSERT 寫入；
+#   同時有其他請求搶到相同 ID（主鍵衝突）時，在 SAVEPOINT 中重試並避開已衝突的 ID；
+#   其他完整性錯誤（例如 user_id 不存在）不重試，直接丟出
+# ==========================================
+
+from models import db, Device
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import aliased
+
+MAX_INSERT_ATTEMPTS = 5     # 主鍵衝突時最多重試幾次
+GAP_PAGE_SIZE = 100         # 每次查詢幾個空號區間
+MYSQL_DUP_ENTRY = 1062      # MySQL ER_DUP_ENTRY
+
+
+def _is_device_id_conflict(error):
+    """IntegrityError 是否為 device_id（主鍵）重複，而不是外鍵或其他約束錯誤"""
+    orig = getattr(error, "orig", None)
+    message = str(orig if orig is not None else error)
+    code = orig.args[0] if orig is not None and orig.args else None
+    if code == MYSQL_DUP_ENTRY:
+        # Duplicate entry '5' for key 'PRIMARY'（MySQL 8 為 'devices.PRIMARY'）
+        return "PRIMARY" in message
+    # SQLite: UNIQUE constraint failed: devices.device_id
+    return "devices.device_id" in message
+
+
+def _gap_page(after_id):
+    """
+    查詢 after_id 之後的空號區間
+
+    Returns:
+        list: [(區間第一個 ID, 區間之後第一個已使用的 ID 或 None)]
+    """
+    current = aliased(Device)
+    following = aliased(Device)
+    next_used = select(func.min(following.device_id)).where(
+        following.device_id > current.device_id
+    ).scalar_subquery()
+    neighbour = aliased(Device)
+    return db.session.query(current.device_id + 1, next_used).outerjoin(
+        neighbour, neighbour.device_id == current.device_id + 1
+    ).filter(
+        neighbour.device_id.is_(None),
+        current.device_id >= after_id
+    ).order_by(current.device_id).limit(GAP_PAGE_SIZE).all()
+
+
+def allocate_device_ids(count=1, exclude=()):
+    """
+    依序取得 count 個最小的可用 device_id（只查詢，不保留）
+
+    Args:
+        count: 需要幾個 ID
+        exclude: 不使用的 ID（例如剛才衝突的 ID）
+
+    Returns:
+        list: device_id 列表（遞增）
+    """
+    exclude = set(exclude)
+    ids = []
+
+    def take(start, stop=None):
+        """從 [start, stop) 取 ID，stop 為 None 表示無上限；取滿時回傳 True"""
+        candidate = start
+        while len(ids) < count and (stop is None or candidate < stop):
+            if candidate not in exclude:
+                ids.append(candidate)
+            candidate += 1
+        return len(ids) >= count
+
+    # 最小的 device_id 之前的空號
+    min_id = db.session.query(func.min(Device.device_id)).scalar()
+    if min_id is None:
+        take(1)
+        return ids
+    if take(1, min_id):
+        return ids
+
+    after_id = min_id
+    while True:
+        gaps = _gap_page(after_id)
+        for gap_start, next_used in gaps:
+            if take(gap_start, next_used):
+                return ids
+        # 最後一個已使用的 ID 之後一定有一個無上限的區間，因此 gaps 不會是空的
+        after_id = gaps[-1][1]
+
+
+def insert_devices(rows):
+    """
+    配置 device_id 並以一個多列 INSERT 寫入設備（不 commit）
+
+    Args:
+        rows: 設備欄位 dict 列表（不含 device_id，欄位必須一致）
+
+    Returns:
+        list: 依 rows 順序配置到的 device_id
+    Raises:
+        IntegrityError: 重試 MAX_INSERT_ATTEMPTS 次仍然衝突，或不是 device_id 衝突的完整性錯誤
+    """
+    if not rows:
+        return []
+    conflicted = set()
+    for attempt in range(1, MAX_INSERT_ATTEMPTS + 1):
+        ids = allocate_device_ids(len(rows), exclude=conflicted)
+        try:
+            # SAVEPOINT：衝突時只回滾這次 INSERT，不影響同一交易中的其他寫入
+            with db.session.begin_nested():
+                db.session.execute(
+                    Device.__table__.insert(),
+                    [dict(row, device_id=device_id) for row, device_id in zip(rows, ids)]
+                )
+            return ids
+        except IntegrityError as e:
+            # 其他交易搶先使用了其中的 ID；在 REPEATABLE READ 下重新查詢可能看不到對方的資料，
+            # 因此下次配置時避開這次嘗試的所有 ID
+            if attempt == MAX_INSERT_ATTEMPTS or not _is_device_id_conflict(e):
+                raise
+            conflicted.update(ids)
+    return []
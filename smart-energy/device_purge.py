@@ -0,0 +1,256 @@
+# device_purge.py
+# ==========================================
+# 設備刪除：先軟刪除，再由背景執行緒分批清除歷史資料
+# - soft_delete_device()：在請求中設定 devices.deleted_at 並停用設備、從全戶彙總扣除該設備用量，
+#   之後 /device/list、/device/state、用電查詢、模擬器與自動控制都看不到這個設備
+#   （power_logs 的查詢以 models.not_deleted_device() 排除）
+# - DevicePurger：背景執行緒依序處理刪除工作
+#   1. 逐月重新計價其他設備的紀錄（每月一個交易，先鎖定該月的月帳本）
+#   2. 每個交易最多刪除 chunk_size 筆 power_logs / power_intervals，交易之間稍作停頓，
+#      不長時間持有鎖、不阻擋其他設備的寫入
+#   3. 刪除 device_status 與設備本身
+# - 每個工作的進度可由 job_id 查詢（GET /device/remove/jobs/<job_id>）
+#
+# 注意：工作進度保存在行程記憶體；行程重新啟動後，start() 會把仍有 deleted_at 的設備重新排入佇列
+# ==========================================
+
+from collections import OrderedDict
+from datetime import date, datetime
+from models import db, Device, DeviceStatus, PowerLog, PowerInterval, UsageMonthlyRollup
+from usage_rollup import lock_month_ledgers, remove_device_rollups
+from usage_reprice import reprice_from
+from sqlalchemy import func
+from app_metrics import get_logger
+import queue
+import threading
+import time
+import uuid
+
+log = get_logger("device_purge")
+
+PURGE_CHUNK_SIZE = 5000     # 每個交易最多刪除幾筆
+PURGE_PAUSE_MS = 50         # 每個交易之間停頓多久，讓其他寫入取得鎖
+JOB_CACHE_SIZE = 1000       # 保留多少個工作的進度供查詢
+
+
+def soft_delete_device(device_id):
+    """
+    軟刪除設備並從全戶彙總扣除該設備用量（不 commit）
+
+    Returns:
+        str: 設備名稱；設備不存在或已刪除時回傳 None
+    """
+    device = db.session.query(Device).filter(
+        Device.device_id == device_id,
+        Device.deleted_at.is_(None)
+    ).with_for_update().first()
+    if device is None:
+        return None
+
+    # 與寫入用電紀錄的交易依月份順序加鎖（見 usage_rollup.lock_month_ledgers）
+    lock_month_ledgers(
+        month_start for (month_start,) in db.session.query(UsageMonthlyRollup.month_start).filter(
+            UsageMonthlyRollup.device_id == device_id
+        )
+    )
+    remove_device_rollups(device_id)
+    device.deleted_at = datetime.now()
+    device.is_active = False
+    return device.device_name
+
+
+def _delete_chunk(model, key_column, device_id, chunk_size):
+    """刪除某設備最多 chunk_size 筆資料並 commit，回傳刪除筆數"""
+    keys = [
+        row[0] for row in db.session.query(key_column).filter(
+            model.device_id == device_id
+        ).order_by(key_column).limit(chunk_size)
+    ]
+    if keys:
+        db.session.execute(model.__table__.delete().where(key_column.in_(keys)))
+    db.session.commit()
+    return len(keys)
+
+
+class DevicePurger:
+    """
+    背景清除已軟刪除設備的執行緒
+
+    Args:
+        chunk_size: 每個交易最多刪除幾筆
+        pause_ms: 每個交易之間停頓多久
+    """
+
+    def __init__(self, chunk_size=PURGE_CHUNK_SIZE, pause_ms=PURGE_PAUSE_MS, job_cache_size=JOB_CACHE_SIZE):
+        self.chunk_size = chunk_size
+        self.pause_ms = pause_ms
+        self._job_cache_size = job_cache_size
+        self._queue = queue.Queue()
+        self._jobs = OrderedDict()
+        self._pending_devices = {}     # {device_id: job_id}，避免同一設備重複排入
+        self._lock = threading.Lock()
+        self._thread = None
+        self._app = None
+
+    # ------------------------------------------
+    # 對外介面
+    # ------------------------------------------
+
+    def start(self, app):
+        """啟動背景執行緒，並把之前未清除完的設備排入佇列（重複呼叫不會重複啟動）"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._app = app
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        with app.app_context():
+            for device_id, device_name in db.session.query(Device.device_id, Device.device_name).filter(
+                Device.deleted_at.isnot(None)
+            ):
+                self.submit(device_id, device_name)
+
+    def submit(self, device_id, device_name=None):
+        """
+        排入一個清除工作（請在軟刪除 commit 之後呼叫）
+
+        Returns:
+            str: job_id（該設備已在佇列中時回傳既有的 job_id）
+        """
+        with self._lock:
+            if device_id in self._pending_devices:
+                return self._pending_devices[device_id]
+            job_id = uuid.uuid4().hex
+            self._pending_devices[device_id] = job_id
+            self._remember(job_id, {
+                "job_id": job_id,
+                "device_id": device_id,
+                "device_name": device_name,
+                "status": "queued",
+                "total_logs": None,
+                "deleted_logs": 0,
+                "deleted_intervals": 0,
+                "months_total": None,
+                "months_repriced": 0,
+                "error": None,
+                "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                "started_at": None,
+                "finished_at": None
+            })
+        self._queue.put(job_id)
+        return job_id
+
+    def get_job(self, job_id):
+        """取得工作進度（不存在回傳 None）"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def jobs(self):
+        """所有保留中的工作（新的在前）"""
+        with self._lock:
+            return [dict(job) for job in reversed(self._jobs.values())]
+
+    def wait_until_empty(self):
+        """阻塞直到目前佇列中的工作都處理完成"""
+        self._queue.join()
+
+    # ------------------------------------------
+    # 背景執行緒
+    # ------------------------------------------
+
+    def _remember(self, job_id, job):
+        """記錄工作（超過上限時丟掉最舊且已結束的工作，需持有 _lock）"""
+        self._jobs[job_id] = job
+        while len(self._jobs) > self._job_cache_size:
+            oldest = next(iter(self._jobs.values()))
+            if oldest["status"] not in ("done", "failed"):
+                break
+            self._jobs.popitem(last=False)
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            self._jobs[job_id].update(fields)
+
+    def _pause(self):
+        if self.pause_ms:
+            time.sleep(self.pause_ms / 1000)
+
+    def _run(self):
+        while True:
+            job_id = self._queue.get()
+            job = self.get_job(job_id)
+            try:
+                with self._app.app_context():
+                    self.purge(job_id, job["device_id"])
+            except Exception as e:
+                log.exception("Purging device %s failed", job["device_id"])
+                self._update(job_id, status="failed", error=str(e),
+                             finished_at=datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+            finally:
+                with self._lock:
+                    self._pending_devices.pop(job["device_id"], None)
+                self._queue.task_done()
+
+    def purge(self, job_id, device_id):
+        """清除一個已軟刪除的設備（需在 app context 中呼叫；每個步驟各自 commit）"""
+        try:
+            device = db.session.get(Device, device_id)
+            if device is None or device.deleted_at is None:
+                # 已清除完畢
+                self._update(job_id, status="done", finished_at=datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+                return
+
+            # 受影響的月份：其他設備在這些月份中、該設備最早紀錄之後的紀錄需要重新計價
+            first_dates = {}
+            for (log_date,) in db.session.query(PowerLog.log_date).filter(
+                PowerLog.device_id == device_id
+            ).distinct():
+                month_start = date(log_date.year, log_date.month, 1)
+                if month_start not in first_dates or log_date < first_dates[month_start]:
+                    first_dates[month_start] = log_date
+            total_logs = db.session.query(func.count(PowerLog.log_id)).filter(
+                PowerLog.device_id == device_id
+            ).scalar()
+            db.session.commit()
+
+            # 1. 逐月重新計價其他設備的紀錄（重新計價已排除軟刪除設備的紀錄，因此可在刪除前進行；
+            #    中途失敗重新執行時，受影響的月份仍能由尚未刪除的紀錄找出）
+            self._update(job_id, status="repricing", total_logs=total_logs, months_total=len(first_dates),
+                         started_at=datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+            for month_start, first_date in sorted(first_dates.items()):
+                lock_month_ledgers([month_start])
+                reprice_from([first_date])
+                db.session.commit()
+                with self._lock:
+                    self._jobs[job_id]["months_repriced"] += 1
+
+            # 2. 分批刪除 power_logs / power_intervals
+            self._update(job_id, status="purging")
+            for model, key_column, counter in (
+                (PowerLog, PowerLog.log_id, "deleted_logs"),
+                (PowerInterval, PowerInterval.interval_id, "deleted_intervals")
+            ):
+                while True:
+                    deleted = _delete_chunk(model, key_column, device_id, self.chunk_size)
+                    if not deleted:
+                        break
+                    with self._lock:
+                        self._jobs[job_id][counter] += deleted
+                    self._pause()
+
+            # 3. 刪除設備（軟刪除後仍寫入的少量紀錄一併刪除並從彙總扣除）
+            remove_device_rollups(device_id)
+            PowerLog.query.filter_by(device_id=device_id).delete(synchronize_session=False)
+            PowerInterval.query.filter_by(device_id=device_id).delete(synchronize_session=False)
+            DeviceStatus.query.filter_by(device_id=device_id).delete(synchronize_session=False)
+            Device.query.filter_by(device_id=device_id).delete(synchronize_session=False)
+            db.session.commit()
+            self._update(job_id, status="done", finished_at=datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+            log.info("Purged device %s", device_id)
+        except Exception:
+            db.session.rollback()
+            raise
+
+
+DEVICE_PURGER = DevicePurger()
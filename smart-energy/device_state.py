@@ -0,0 +1,257 @@
+# device_state.py
+# ==========================================
+# 設備狀態（device_status）的讀取、快取與寫入工具
+# - load_device_rows()：以一個 LEFT JOIN 查詢讀取所有設備與狀態（取代逐一 lazy load d.status）
+# - DEVICE_STATE_CACHE：行程內的設備狀態快取，/device/state 直接由記憶體回答
+#   寫入狀態時以 mark_status_changed() 記下變更，交易 commit 後寫入快取（write-through）；
+#   新增 / 刪除設備時以 mark_devices_changed() 讓快取在 commit 後整個重新載入；rollback 時丟棄
+#   commit 後的狀態變更同時以 device_state 事件發布（見 event_bus.py、feature_events.py）
+# - upsert_device_status()：以一個 INSERT ... ON DUPLICATE KEY UPDATE（MySQL）/
+#   INSERT ... ON CONFLICT DO UPDATE（SQLite）同時更新既有狀態與補建缺少的狀態列
+#   device_status.device_id 有唯一索引，因此不需要先 SELECT 判斷是否存在
+# - find_group_devices()：依位置 / 類型找出一組設備（idx_location_type_active），
+#   搭配 upsert_device_status() 以一個語句控制整組設備（/device/group、自動溫度控制）
+#
+# 注意：快取在行程記憶體中，多個 worker 行程之間不會互相通知
+# ==========================================
+
+from models import db, Device, DeviceStatus
+from event_bus import EVENT_BUS
+from app_metrics import get_logger
+from sqlalchemy import event, exc as sa_exc
+from sqlalchemy.dialects import mysql, sqlite
+from sqlalchemy.orm import Session
+import threading
+
+log = get_logger("device_state")
+
+UPSERT_CHUNK_SIZE = 1000    # 每個 INSERT 最多幾列（避免超過 max_allowed_packet）
+
+_PENDING_KEY = "device_state_pending"
+
+# 沒有狀態紀錄時的預設值
+DEFAULT_STATUS = {"is_on": False, "current_temperature": None, "target_temperature": None, "mode": None}
+
+
+def _to_float(value):
+    return float(value) if value else None
+
+
+def load_device_rows(active_only=False):
+    """
+    以一個 LEFT JOIN 查詢讀取設備與狀態（不含已軟刪除的設備）
+
+    Returns:
+        (rows, status_load_error)：rows 為 dict 列表；device_status 讀取失敗
+        （資料表結構不符）時改為只讀設備、狀態用預設值，status_load_error 為 True
+    """
+    device_columns = (
+        Device.device_id, Device.device_name, Device.device_type, Device.model_number,
+        Device.location, Device.rated_power, Device.is_active, Device.user_id
+    )
+    status_columns = (
+        DeviceStatus.device_id.label("status_device_id"), DeviceStatus.is_on,
+        DeviceStatus.current_temperature, DeviceStatus.target_temperature, DeviceStatus.mode
+    )
+    try:
+        query = db.session.query(*device_columns, *status_columns).outerjoin(
+            DeviceStatus, DeviceStatus.device_id == Device.device_id
+        ).filter(Device.deleted_at.is_(None))
+        if active_only:
+            query = query.filter(Device.is_active.is_(True))
+        records = query.order_by(Device.device_id).all()
+        status_load_error = False
+    except sa_exc.OperationalError as oe:
+        log.warning("OperationalError when loading device_status: %s", oe)
+        db.session.rollback()
+        query = db.session.query(*device_columns).filter(Device.deleted_at.is_(None))
+        if active_only:
+            query = query.filter(Device.is_active.is_(True))
+        records = query.order_by(Device.device_id).all()
+        status_load_error = True
+
+    rows = []
+    for r in records:
+        row = {
+            "device_id": r.device_id,
+            "device_name": r.device_name,
+            "device_type": r.device_type,
+            "model_number": r.model_number,
+            "location": r.location,
+            "rated_power": _to_float(r.rated_power),
+            "is_active": r.is_active,
+            "user_id": r.user_id
+        }
+        if status_load_error or r.status_device_id is None:
+            row.update(DEFAULT_STATUS)
+        else:
+            row.update({
+                "is_on": bool(r.is_on),
+                "current_temperature": _to_float(r.current_temperature),
+                "target_temperature": _to_float(r.target_temperature),
+                "mode": r.mode
+            })
+        rows.append(row)
+    return rows, status_load_error
+
+
+class DeviceStateCache:
+    """所有設備狀態的行程內快取（執行緒安全，第一次讀取時載入）"""
+
+    def __init__(self):
+        self._rows = None        # {device_id: row}
+        self._lock = threading.Lock()
+        self._generation = 0     # 每次變更 +1，避免載入期間的變更被舊資料覆蓋
+
+    def _loaded_rows(self):
+        with self._lock:
+            if self._rows is not None:
+                return self._rows
+            generation = self._generation
+
+        rows, status_load_error = load_device_rows()
+        rows = {row["device_id"]: row for row in rows}
+        with self._lock:
+            # 載入期間有變更、或狀態讀取失敗時不存入，下次重新載入
+            if generation == self._generation and not status_load_error:
+                self._rows = rows
+        return rows
+
+    def states(self):
+        """啟用中設備的開關狀態 {設備名稱: True/False}"""
+        rows = self._loaded_rows()
+        with self._lock:
+            return {row["device_name"]: row["is_on"] for row in rows.values() if row["is_active"]}
+
+    def apply(self, changes):
+        """寫入已 commit 的狀態變更 {device_id: {欄位: 值}}；快取中沒有的設備讓快取重新載入"""
+        with self._lock:
+            self._generation += 1
+            if self._rows is None:
+                return
+            if any(device_id not in self._rows for device_id in changes):
+                self._rows = None
+                return
+            for device_id, fields in changes.items():
+                self._rows[device_id] = dict(self._rows[device_id], **fields)
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._rows = None
+
+
+DEVICE_STATE_CACHE = DeviceStateCache()
+
+
+def mark_status_changed(session, changes):
+    """
+    記錄本交易中的狀態變更，commit 後寫入快取
+
+    Args:
+        changes: {device_id: {"is_on": True, ...}}
+    """
+    if changes:
+        session.info.setdefault(_PENDING_KEY, []).append(changes)
+
+
+def mark_devices_changed(session):
+    """新增 / 刪除設備：commit 後讓快取整個重新載入"""
+    session.info.setdefault(_PENDING_KEY, []).append(None)
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_after_commit(session):
+    changed = {}
+    for changes in session.info.pop(_PENDING_KEY, None) or []:
+        if changes is None:
+            DEVICE_STATE_CACHE.invalidate()
+        else:
+            DEVICE_STATE_CACHE.apply(changes)
+            for device_id, fields in changes.items():
+                changed.setdefault(device_id, {}).update(fields)
+    if changed:
+        EVENT_BUS.publish("device_state", {
+            "devices": [dict(fields, device_id=device_id) for device_id, fields in changed.items()]
+        })
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_after_rollback(session):
+    session.info.pop(_PENDING_KEY, None)
+
+
+def find_group_devices(location=None, device_types=None):
+    """
+    找出啟用中、未刪除且符合位置 / 類型的設備
+
+    Args:
+        location: 安裝位置（None 表示不限）
+        device_types: 設備類型列表（None 或空表示不限）
+
+    Returns:
+        list: [(device_id, device_name)]，依 device_id 排序
+    """
+    # is_active 以等號比較（IS TRUE 在 MySQL 無法使用 idx_location_type_active）
+    query = db.session.query(Device.device_id, Device.device_name).filter_by(is_active=True, deleted_at=None)
+    if location is not None:
+        query = query.filter(Device.location == location)
+    if device_types:
+        query = query.filter(Device.device_type.in_(device_types))
+    return [tuple(row) for row in query.order_by(Device.device_id)]
+
+
+def _upsert_statement(dialect, rows, columns):
+    """產生多列 upsert：衝突時只更新 columns 中的欄位"""
+    table = DeviceStatus.__table__
+    if dialect == "mysql":
+        statement = mysql.insert(table).values(rows)
+        return statement.on_duplicate_key_update({c: statement.inserted[c] for c in columns})
+    if dialect == "sqlite":
+        statement = sqlite.insert(table).values(rows)
+        return statement.on_conflict_do_update(
+            index_elements=[table.c.device_id],
+            set_={c: statement.excluded[c] for c in columns}
+        )
+    return None
+
+
+def upsert_device_status(rows):
+    """
+    寫入多個設備的狀態（不 commit；commit 後同步更新 DEVICE_STATE_CACHE）
+
+    Args:
+        rows: [{"device_id": 1, "is_on": True, ...}]，每列的欄位必須相同；
+              已有狀態列的設備只更新這些欄位，沒有的設備新增一列
+
+    Returns:
+        int: 寫入的設備數
+    """
+    if not rows:
+        return 0
+    columns = [c for c in rows[0] if c != "device_id"]
+    mark_status_changed(db.session, {row["device_id"]: {c: row[c] for c in columns} for row in rows})
+    dialect = db.session.get_bind().dialect.name
+
+    for i in range(0, len(rows), UPSERT_CHUNK_SIZE):
+        chunk = rows[i:i + UPSERT_CHUNK_SIZE]
+        statement = _upsert_statement(dialect, chunk, columns)
+        if statement is not None:
+            db.session.execute(statement)
+            continue
+
+        # 其他資料庫：先 UPDATE，再 INSERT 沒有狀態列的設備
+        table = DeviceStatus.__table__
+        ids = [row["device_id"] for row in chunk]
+        existing = {r[0] for r in db.session.query(DeviceStatus.device_id).filter(DeviceStatus.device_id.in_(ids))}
+        for row in chunk:
+            if row["device_id"] in existing:
+                db.session.execute(
+                    table.update().where(table.c.device_id == row["device_id"]).values(
+                        {c: row[c] for c in columns}
+                    )
+                )
+        missing = [row for row in chunk if row["device_id"] not in existing]
+        if missing:
+            db.session.execute(table.insert(), missing)
+    return len(rows)
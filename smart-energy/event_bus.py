@@ -0,0 +1,138 @@
+# event_bus.py
+# ==========================================
+# 行程內的事件發布 / 訂閱（供 /events SSE 使用）
+# - publish() 依序給每個事件一個遞增的 id，放進最近事件的環狀緩衝區，並送到每個訂閱者的佇列
+# - 每個訂閱者的佇列有上限：客戶端讀太慢導致佇列滿時，該訂閱被標記為 overflowed，
+#   由 SSE 端送出 reset 事件後結束連線，客戶端重新連線並重新讀取完整狀態
+# - subscribe(last_event_id) 會先補送 last_event_id 之後、仍在緩衝區中的事件；
+#   太舊（已不在緩衝區）或 id 不認得（伺服器重新啟動）時先送 reset
+#
+# 注意：事件只在同一個行程內傳遞，多個 worker 行程之間不共享
+# ==========================================
+
+from collections import deque
+from datetime import datetime
+import queue
+import threading
+
+HISTORY_SIZE = 1000         # 保留最近幾個事件供重新連線補送
+CLIENT_BUFFER_SIZE = 256    # 每個訂閱者最多累積幾個未送出的事件
+MAX_SUBSCRIBERS = 200       # 同時連線上限
+
+
+class Subscription:
+    """單一客戶端的訂閱（有上限的佇列）"""
+
+    def __init__(self, bus, buffer_size):
+        self._bus = bus
+        self._queue = queue.Queue(maxsize=buffer_size)
+        self.overflowed = False
+
+    def _offer(self, event):
+        """由 EventBus 呼叫（持有 bus 的鎖）；佇列已滿時標記 overflowed，不阻塞發布者"""
+        if self.overflowed:
+            return
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self.overflowed = True
+
+    def get(self, timeout):
+        """取得下一個事件，timeout 秒內沒有事件回傳 None"""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self._bus.unsubscribe(self)
+
+
+class EventBus:
+    """行程內的事件匯流排（執行緒安全）"""
+
+    def __init__(self, history_size=HISTORY_SIZE, max_subscribers=MAX_SUBSCRIBERS):
+        self._lock = threading.Lock()
+        self._history = deque(maxlen=history_size)
+        self._subscribers = set()
+        self._last_id = 0
+        self.max_subscribers = max_subscribers
+        self.published_count = 0
+        self.overflow_count = 0
+
+    def publish(self, event_type, data):
+        """
+        發布事件（不阻塞）
+
+        Args:
+            event_type: 事件名稱（SSE 的 event 欄位）
+            data: 可轉成 JSON 的內容
+
+        Returns:
+            int: 事件 id
+        """
+        with self._lock:
+            self._last_id += 1
+            event = {
+                "id": self._last_id,
+                "type": event_type,
+                "data": data,
+                "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            }
+            self._history.append(event)
+            self.published_count += 1
+            for subscription in self._subscribers:
+                was_overflowed = subscription.overflowed
+                subscription._offer(event)
+                if subscription.overflowed and not was_overflowed:
+                    self.overflow_count += 1
+            return event["id"]
+
+    def subscribe(self, last_event_id=None, buffer_size=CLIENT_BUFFER_SIZE):
+        """
+        新增訂閱
+
+        Args:
+            last_event_id: 客戶端最後收到的事件 id（重新連線時）
+
+        Returns:
+            (subscription, replay, needs_reset)：replay 為需要補送的事件；
+            needs_reset 為 True 表示無法完整補送，客戶端應重新讀取完整狀態
+        Raises:
+            RuntimeError: 超過連線上限
+        """
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                raise RuntimeError("Too many event subscribers")
+            subscription = Subscription(self, buffer_size)
+            self._subscribers.add(subscription)
+
+            replay, needs_reset = [], False
+            if last_event_id is not None:
+                oldest = self._history[0]["id"] if self._history else self._last_id + 1
+                if last_event_id > self._last_id or last_event_id < oldest - 1:
+                    needs_reset = True
+                else:
+                    replay = [event for event in self._history if event["id"] > last_event_id]
+            return subscription, replay, needs_reset
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    @property
+    def last_event_id(self):
+        return self._last_id
+
+    def stats(self):
+        with self._lock:
+            return {
+                "subscribers": len(self._subscribers),
+                "last_event_id": self._last_id,
+                "history_size": len(self._history),
+                "published_count": self.published_count,
+                "overflow_count": self.overflow_count
+            }
+
+
+EVENT_BUS = EventBus()
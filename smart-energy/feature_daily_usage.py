@@ -10,6 +10,10 @@
 #                       預設查詢最近 7 天
 #                       回傳: 每日用電量、電費（加總/累進費率）、設備明細
 #
+# - GET  /usage/logs     取得原始用電紀錄
+#                       查詢參數: start_date, end_date, limit, cursor (keyset 分頁),
+#                       format=ndjson (串流匯出)
+#
 # - GET  /usage/bill     計算總用電量與總電費（依月份分別計算）
 #                       回傳總用電量、總電費（加總/累進費率）、各月份統計
 #
@@ -19,56 +23,91 @@
 #                         "kwh": float (可選，直接提供度數),
 #                         "power_watts": float (可選，功率瓦數),
 #                         "hours": float (可選，使用時數),
-#                         "day": str (可選，日期 YYYY-MM-DD，預設今天)
+#                         "day": str (可選，日期 YYYY-MM-DD，預設今天),
+#                         "async": bool (可選，true 時放入寫入佇列並回傳 202 + ingestion_id)
 #                       }
 #                       必須提供 kwh 或 hours 其中一個
 #
+# - GET  /usage/ingest/status           非同步寫入佇列狀態（深度、寫入延遲）
+# - GET  /usage/cache/stats             已結束期間統計快取的命中 / 未命中次數
+# - GET  /usage/ingest/<ingestion_id>   查詢非同步寫入結果
+#
 # - GET  /usage/monthly/<year>/<month>  取得指定月份的用電統計
 #                       回傳: 月總用電量、總電費、每日明細
 #
 # - GET  /usage/yearly/<year>           取得指定年份的用電統計
 #                       回傳: 年總用電量、總電費、每月明細
 #
-# - GET  /usage/compare                 比較兩個時間段的用電統計
-#                       查詢參數: period_type (day/month/year), date1, date2
-#                       回傳: 兩個時間段的統計與比較結果
+# - GET  /usage/compare                 比較多個時間段的用電統計
+#                       查詢參數: period_type (day/month/year), periods (逗號分隔), baseline
+#                       （舊版 date1, date2 仍可使用）
+#                       回傳: 各時間段的統計、相對基準與相鄰期間的差異
 #
 # - POST /usage/batch                   批次新增多筆用電記錄
 #                       請求體: {"records": [...]} - 多筆記錄陣列
+#
+# - GET  /usage/forecast                預測月底用電量、累進電費與各級距超過日期
+#                       查詢參數: month (YYYY-MM，預設本月), lookback_days, device_limit
+#
+# - GET  /usage/anomalies               偵測設備用電異常（設備 × 日期矩陣、中位數/MAD 基準）
+#                       查詢參數: start_date, end_date, baseline_days, by_weekday, threshold, incremental
+#
+# - POST /usage/price                   批次試算累進電費（不寫入資料庫）
+#                       請求體: {"date" 或 "season", "kwh": [...], "ranges": [[from, to], ...]}
+#
+# 統計類端點（/bill、/monthly、/yearly、/compare）讀取 usage_daily_rollup /
+# usage_monthly_rollup 彙總表；寫入時於同一交易內增量更新（見 usage_rollup.py）
+# /monthly、/yearly、/compare 中已結束的期間會快取結果，寫入該期間時才失效（見 usage_period_cache.py）
+#
+# /usage/add 與 /usage/batch 的每筆資料可帶 "idempotency_key"：重送時回傳第一次的結果，
+# 不會重新計價或寫入（見 usage_dedupe.py）
+#
+# 補登較早日期時，同月之後的紀錄會在同一交易內依累進費率重新計價（見 usage_reprice.py）
+#
+# CLI 指令：
+# - flask usage rebuild-rollups         從 power_logs 重新產生彙總表
+# - flask usage purge-idempotency       清除過期的 idempotency_key 紀錄
+# - flask usage reprice                 重新計價所有月份的 power_logs
+# - flask usage detect-anomalies        偵測最近的設備用電異常（--incremental 只評分新日期）
+# - flask usage explain                 以 EXPLAIN 確認各用電查詢都使用索引（SQLite / MySQL）
 # ==========================================
 
-from flask import Blueprint, jsonify, request
-from models import db, PowerLog
+from flask import Blueprint, Response, current_app, jsonify, request, stream_with_context
+from models import db, PowerLog, UsageDailyRollup, UsageMonthlyRollup, not_deleted_device
 from datetime import datetime, date, timedelta
-from sqlalchemy import func, extract
+from sqlalchemy import func, or_, and_
 from decimal import Decimal
+from usage_rollup import (
+    HOME_DEVICE_ID, month_start_of, apply_usage_deltas, record_log_added, rebuild_rollups,
+    lock_month_ledgers, load_home_day_units, ledger_base_units
+)
+from tariff import (
+    TAIPOWER_RATES, season_of, price_cumulative, price_cumulative_by_month,
+    marginal_cost, marginal_cost_by_month
+)
+from usage_ingest import IngestQueue
+from usage_dedupe import validate_key, find_replays, remember_results, purge_expired
+from usage_reprice import reprice_after, reprice_all
+from usage_period_cache import PERIOD_CACHE
+from usage_periods import resolve_period, resolve_date_range, month_to_date, in_period, label_of
+from usage_explain import run_plan_checks
+from usage_forecast import forecast_month
+from usage_anomaly import detect_anomalies
+from fixed_point import (
+    ENERGY_SCALE, energy_units, cost_units, energy_units_sql, cost_units_sql, energy_value, cost_value
+)
+import numpy as np
+import click
+import json
+import queue
 
 bp = Blueprint("usage", __name__, template_folder="templates")
 
-# 台電住宅用電累進費率（元/度）
-# 夏月（6-9月）與非夏月費率 - 2025年最新費率
-TAIPOWER_RATES = {
-    "summer": [
-        (120, 1.78),      # 0-120度
-        (330, 2.55),      # 121-330度
-        (500, 3.80),      # 331-500度
-        (700, 5.14),      # 501-700度
-        (1000, 6.44),     # 701-1000度
-        (float('inf'), 8.86)  # 1001度以上
-    ],
-    "non_summer": [
-        (120, 1.78),      # 0-120度
-        (330, 2.26),      # 121-330度
-        (500, 3.13),      # 331-500度
-        (700, 4.24),      # 501-700度
-        (1000, 5.27),     # 701-1000度
-        (float('inf'), 7.03)  # 1001度以上
-    ]
-}
+INGEST_QUEUE = None                              # /usage/add 非同步寫入佇列（首次使用時建立）
 
 def calculate_taiwan_bill(total_kwh, usage_date):
     """
-    根據台電累進費率計算電費
+    根據台電累進費率計算電費（委派給 tariff.py 的預算表）
     
     Args:
         total_kwh: 當月累積用電度數
@@ -77,29 +116,23 @@ def calculate_taiwan_bill(total_kwh, usage_date):
     Returns:
         計算出的電費金額（元）
     """
-    # 判斷夏月或非夏月（6-9月為夏月）
-    if isinstance(usage_date, str):
-        usage_date = datetime.strptime(usage_date, "%Y-%m-%d").date()
-    
-    is_summer = 6 <= usage_date.month <= 9
-    rates = TAIPOWER_RATES["summer"] if is_summer else TAIPOWER_RATES["non_summer"]
-    
-    # 累進計算電費
-    total_bill = 0
-    remaining_kwh = total_kwh
-    prev_tier = 0
+    return round(float(price_cumulative(total_kwh, season_of(usage_date))), 2)
+
+
+def calculate_marginal_cost(base_kwh, kwh, usage_date):
+    """
+    計算在當月已累積 base_kwh 度的情況下，再用 kwh 度的邊際電費
     
-    for tier_limit, rate in rates:
-        if remaining_kwh <= 0:
-            break
-        
-        # 計算這個級距要使用的度數
-        tier_kwh = min(remaining_kwh, tier_limit - prev_tier)
-        total_bill += tier_kwh * rate
-        remaining_kwh -= tier_kwh
-        prev_tier = tier_limit
+    Args:
+        base_kwh: 計算前的當月累積度數
+        kwh: 本次新增度數
+        usage_date: 日期物件（決定夏月/非夏月）
     
-    return round(total_bill, 2)
+    Returns:
+        邊際電費（元，四捨五入到小數點後 2 位）
+    """
+    season = season_of(usage_date)
+    return round(float(marginal_cost(base_kwh, base_kwh + kwh, season)), 2)
 
 
 def get_monthly_total_kwh(target_date, include_target_date=False):
@@ -116,20 +149,13 @@ def get_monthly_total_kwh(target_date, include_target_date=False):
     if isinstance(target_date, str):
         target_date = datetime.strptime(target_date, "%Y-%m-%d").date()
     
-    # 計算月份的開始日期
-    month_start = date(target_date.year, target_date.month, 1)
+    # 月初到目標日期的日期範圍（可使用 log_date 索引）
+    period = month_to_date(target_date, include_target_date)
     
-    # 使用 SQLAlchemy 查詢
-    query = db.session.query(func.sum(PowerLog.energy_consumed)).filter(
-        PowerLog.log_date >= month_start
-    )
-    
-    if include_target_date:
-        query = query.filter(PowerLog.log_date <= target_date)
-    else:
-        query = query.filter(PowerLog.log_date < target_date)
-    
-    result = query.scalar()
+    result = db.session.query(func.sum(PowerLog.energy_consumed)).filter(
+        in_period(PowerLog.log_date, period),
+        not_deleted_device(PowerLog.device_id)
+    ).scalar()
     return float(result) if result else 0
 
 
@@ -148,7 +174,8 @@ def get_daily_total_kwh_db(target_date, exclude_device_id=None):
         target_date = datetime.strptime(target_date, "%Y-%m-%d").date()
     
     query = db.session.query(func.sum(PowerLog.energy_consumed)).filter(
-        PowerLog.log_date == target_date
+        PowerLog.log_date == target_date,
+        not_deleted_device(PowerLog.device_id)
     )
     
     if exclude_device_id is not None:
@@ -180,15 +207,17 @@ def _get_logs_in_date_range(start_date, end_date):
         end_date: 結束日期
     
     Returns:
-        PowerLog 記錄列表
+        (PowerLog, 度數整數單位, 電費整數單位) 列表（單位換算在 SQL 中完成）
     """
     from sqlalchemy.orm import joinedload
     
-    return db.session.query(PowerLog).options(
+    return db.session.query(
+        PowerLog, energy_units_sql(PowerLog.energy_consumed), cost_units_sql(PowerLog.cost)
+    ).options(
         joinedload(PowerLog.device)
     ).filter(
-        PowerLog.log_date >= start_date,
-        PowerLog.log_date <= end_date
+        in_period(PowerLog.log_date, resolve_date_range(start_date, end_date)),
+        not_deleted_device(PowerLog.device_id)
     ).order_by(PowerLog.log_date, PowerLog.created_at).all()
 
 
@@ -197,13 +226,13 @@ def _aggregate_by_date(logs):
     將記錄按日期分組並計算總和
     
     Args:
-        logs: PowerLog 記錄列表
+        logs: _get_logs_in_date_range() 回傳的 (PowerLog, 度數單位, 電費單位) 列表
     
     Returns:
         dict: {date: {"kwh": total, "cost": total, "devices": [...]}}
     """
     result = {}
-    for log in logs:
+    for log, kwh_units, cost_units_ in logs:
         day_key = str(log.log_date)
         if day_key not in result:
             result[day_key] = {
@@ -211,22 +240,50 @@ def _aggregate_by_date(logs):
                 "cost": 0,
                 "devices": []
             }
-        result[day_key]["kwh"] += _to_float(log.energy_consumed)
-        result[day_key]["cost"] += _to_float(log.cost)
+        result[day_key]["kwh"] += kwh_units
+        result[day_key]["cost"] += cost_units_
         result[day_key]["devices"].append({
             "device_id": log.device_id,
-            "kwh": round(_to_float(log.energy_consumed), 4),
-            "cost": round(_to_float(log.cost), 2)
+            "kwh": energy_value(kwh_units),
+            "cost": cost_value(cost_units_)
         })
     
-    # Round totals
+    # 整數加總完成後才轉回浮點數
     for day_key in result:
-        result[day_key]["kwh"] = round(result[day_key]["kwh"], 4)
-        result[day_key]["cost"] = round(result[day_key]["cost"], 2)
+        result[day_key]["kwh"] = energy_value(result[day_key]["kwh"])
+        result[day_key]["cost"] = cost_value(result[day_key]["cost"])
     
     return result
 
 
+def _get_month_bases(start_date, end_date):
+    """
+    取得查詢範圍內各月份在範圍起始日之前的累積用電量
+    
+    只有起始日所在月份需要查詢資料庫（月初到 start_date 前一天），
+    之後的月份都從範圍內的月初開始，基準值為 0。
+    
+    Args:
+        start_date: 開始日期
+        end_date: 結束日期
+    
+    Returns:
+        dict: {(year, month): 範圍起始前的當月累積用電量（度）}
+    """
+    bases = {}
+    year, month = start_date.year, start_date.month
+    while (year, month) <= (end_date.year, end_date.month):
+        bases[(year, month)] = 0
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    
+    if start_date.day > 1:
+        bases[(start_date.year, start_date.month)] = get_monthly_total_kwh(
+            start_date, include_target_date=False
+        )
+    
+    return bases
+
+
 @bp.get("/daily")
 def get_daily_usage():
     """
@@ -269,7 +326,7 @@ def get_daily_usage():
     
     # 按日期分組
     daily_data = {}
-    for log in logs:
+    for log, kwh_units, cost_units_ in logs:
         day_key = str(log.log_date)
         if day_key not in daily_data:
             daily_data[day_key] = {
@@ -277,52 +334,117 @@ def get_daily_usage():
                 "kwh": 0,
                 "cost_sum": 0
             }
-        daily_data[day_key]["logs"].append(log)
-        daily_data[day_key]["kwh"] += _to_float(log.energy_consumed)
-        daily_data[day_key]["cost_sum"] += _to_float(log.cost)
+        daily_data[day_key]["logs"].append((log, kwh_units, cost_units_))
+        # 以整數單位加總（見 fixed_point.py）
+        daily_data[day_key]["kwh"] += kwh_units
+        daily_data[day_key]["cost_sum"] += cost_units_
+    
+    # 查詢範圍起始日之前的當月累積用電（只需一次查詢）
+    month_bases = _get_month_bases(start_date, end_date)
+    
+    # 逐日累加當月累積用電（daily_data 已依日期排序，跨月時重設）
+    days = [datetime.strptime(day_str, "%Y-%m-%d").date() for day_str in daily_data]
+    totals_before = []
+    running_month = None
+    running_kwh = 0
+    for day, data in zip(days, daily_data.values()):
+        month_key = (day.year, day.month)
+        if month_key != running_month:
+            running_month = month_key
+            running_kwh = energy_units(month_bases.get(month_key, 0))
+        totals_before.append(running_kwh)
+        running_kwh += data["kwh"]
+    
+    # 使用台電累進費率一次計算所有日期的邊際電費（整數單位 → 度）
+    totals_before = np.array(totals_before, dtype=np.int64) / ENERGY_SCALE
+    day_kwh = np.array([data["kwh"] for data in daily_data.values()], dtype=np.int64) / ENERGY_SCALE
+    costs_progressive = marginal_cost_by_month(
+        totals_before, totals_before + day_kwh, [day.month for day in days]
+    )
     
     # 構建結果
     result = {}
-    for day_str, data in daily_data.items():
-        day = datetime.strptime(day_str, "%Y-%m-%d").date()
+    for (day_str, data), cost_progressive in zip(daily_data.items(), costs_progressive):
         total_kwh = data["kwh"]
         cost_sum = data["cost_sum"]
         
-        # 使用台電累進費率重新計算當天電費
-        month_total_before = get_monthly_total_kwh(day, include_target_date=False)
-        month_total_after = month_total_before + total_kwh
-        
-        bill_before = calculate_taiwan_bill(month_total_before, day)
-        bill_after = calculate_taiwan_bill(month_total_after, day)
-        cost_progressive = bill_after - bill_before
-        
         # 各設備明細
         devices = []
-        for log in data["logs"]:
+        for log, kwh_units, cost_units_ in data["logs"]:
             devices.append({
                 "device_id": log.device_id,
                 "device_name": log.device.device_name if log.device else f"Device {log.device_id}",
-                "kwh": round(_to_float(log.energy_consumed), 4),
-                "cost": round(_to_float(log.cost), 2)
+                "kwh": energy_value(kwh_units),
+                "cost": cost_value(cost_units_)
             })
         
         result[day_str] = {
-            "kwh": round(total_kwh, 4),
-            "cost_sum": round(cost_sum, 2),
-            "cost_progressive": round(cost_progressive, 2),
+            "kwh": energy_value(total_kwh),
+            "cost_sum": cost_value(cost_sum),
+            "cost_progressive": round(float(cost_progressive), 2),
             "devices": devices
         }
     
     return jsonify(result)
 
 
+# 分頁與串流匯出設定
+LOGS_PAGE_MAX = 5000        # 每頁最多筆數
+LOGS_STREAM_CHUNK = 1000    # 串流模式每次從 server-side cursor 取回的筆數
+
+
+def _parse_log_cursor(cursor):
+    """
+    解析分頁游標（格式：YYYY-MM-DD:log_id）
+    
+    Returns:
+        (log_date, log_id)
+    """
+    try:
+        date_part, id_part = cursor.rsplit(":", 1)
+        return datetime.strptime(date_part, "%Y-%m-%d").date(), int(id_part)
+    except (AttributeError, ValueError):
+        raise ValueError("cursor 格式錯誤，應為 YYYY-MM-DD:log_id")
+
+
+def _make_log_cursor(log):
+    """以 (log_date, log_id) 產生下一頁游標"""
+    return f"{log.log_date.strftime('%Y-%m-%d')}:{log.log_id}"
+
+
+def _logs_keyset_query(start_date, end_date, cursor=None):
+    """
+    依 (log_date, log_id) 排序的範圍查詢，若有游標則從游標之後開始
+    """
+    query = db.session.query(PowerLog).filter(
+        in_period(PowerLog.log_date, resolve_date_range(start_date, end_date)),
+        not_deleted_device(PowerLog.device_id)
+    )
+    if cursor is not None:
+        cursor_date, cursor_id = cursor
+        query = query.filter(or_(
+            PowerLog.log_date > cursor_date,
+            and_(PowerLog.log_date == cursor_date, PowerLog.log_id > cursor_id)
+        ))
+    return query.order_by(PowerLog.log_date, PowerLog.log_id)
+
+
 @bp.get("/logs")
 def get_power_logs():
     """
     取得指定日期範圍內的原始 power logs
     查詢參數：start_date (YYYY-MM-DD), end_date (YYYY-MM-DD)
     若未提供，預設最近 7 天
-    回傳：{"ok": True, "logs": [ {...}, ... ]}
+    
+    分頁 / 匯出參數（可選）：
+    - limit: 每頁筆數（最多 LOGS_PAGE_MAX），提供時改用 keyset 分頁
+    - cursor: 上一頁回傳的 next_cursor（YYYY-MM-DD:log_id）
+    - format=ndjson: 以 NDJSON 串流回傳（每行一筆），記憶體用量固定
+    
+    回傳：
+    - 預設：{"ok": True, "logs": [ {...}, ... ]}
+    - 分頁：{"ok": True, "logs": [...], "next_cursor": "2025-01-31:1234" 或 null}
+    - 串流：application/x-ndjson，每行一筆 log
     """
     try:
         end_date_str = request.args.get('end_date')
@@ -338,13 +460,44 @@ def get_power_logs():
         else:
             start_date = end_date - timedelta(days=6)
 
+        cursor_str = request.args.get('cursor')
+        cursor = _parse_log_cursor(cursor_str) if cursor_str else None
+        limit = request.args.get('limit', type=int)
+        output_format = request.args.get('format', 'json')
+
+        if output_format == 'ndjson':
+            # 使用 server-side cursor 分批取回，邊讀邊輸出
+            query = _logs_keyset_query(start_date, end_date, cursor).execution_options(
+                stream_results=True
+            ).yield_per(LOGS_STREAM_CHUNK)
+
+            def generate():
+                for log in query:
+                    yield json.dumps(log.to_dict(), ensure_ascii=False) + "\n"
+
+            return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+        if limit is not None or cursor is not None:
+            # keyset 分頁：多取一筆判斷是否還有下一頁
+            limit = max(1, min(limit or LOGS_PAGE_MAX, LOGS_PAGE_MAX))
+            logs = _logs_keyset_query(start_date, end_date, cursor).limit(limit + 1).all()
+            has_more = len(logs) > limit
+            logs = logs[:limit]
+            return jsonify({
+                "ok": True,
+                "logs": [l.to_dict() for l in logs],
+                "next_cursor": _make_log_cursor(logs[-1]) if has_more else None
+            })
+
         logs = db.session.query(PowerLog).filter(
-            PowerLog.log_date >= start_date,
-            PowerLog.log_date <= end_date
+            in_period(PowerLog.log_date, resolve_date_range(start_date, end_date)),
+            not_deleted_device(PowerLog.device_id)
         ).order_by(PowerLog.log_date, PowerLog.created_at).all()
 
         logs_list = [l.to_dict() for l in logs]
         return jsonify({"ok": True, "logs": logs_list})
+    except ValueError as ve:
+        return jsonify({"ok": False, "msg": str(ve)}), 400
     except Exception as e:
         return jsonify({"ok": False, "msg": str(e)}), 500
 
@@ -357,62 +510,52 @@ def get_total_bill():
     1. cost_sum: 各設備電費加總
     2. cost_progressive: 用累進費率重新計算的月總電費
     """
-    # 使用 SQLAlchemy 查詢所有記錄的總和
-    total_result = db.session.query(
-        func.sum(PowerLog.energy_consumed).label('total_kwh'),
-        func.sum(PowerLog.cost).label('total_cost')
-    ).first()
+    # 從全戶月彙總表讀取各月份統計（不再掃描 power_logs）
+    monthly_result = db.session.query(
+        UsageMonthlyRollup.month_start,
+        energy_units_sql(UsageMonthlyRollup.energy_consumed).label('kwh_units'),
+        cost_units_sql(UsageMonthlyRollup.cost).label('cost_units')
+    ).filter(
+        UsageMonthlyRollup.device_id == HOME_DEVICE_ID,
+        UsageMonthlyRollup.record_count > 0
+    ).order_by(UsageMonthlyRollup.month_start).all()
     
-    if not total_result or total_result.total_kwh is None:
+    if not monthly_result:
         return jsonify({"total_kwh": 0, "total_cost_sum": 0, "total_cost_progressive": 0, "months": []})
     
-    total_kwh = _to_float(total_result.total_kwh)
-    total_cost_sum = _to_float(total_result.total_cost)
+    month_kwh_units = [row.kwh_units for row in monthly_result]
+    month_cost_units = [row.cost_units for row in monthly_result]
     
-    # 按月份統計
-    monthly_result = db.session.query(
-        extract('year', PowerLog.log_date).label('year'),
-        extract('month', PowerLog.log_date).label('month'),
-        func.sum(PowerLog.energy_consumed).label('kwh'),
-        func.sum(PowerLog.cost).label('cost')
-    ).group_by(
-        extract('year', PowerLog.log_date),
-        extract('month', PowerLog.log_date)
-    ).order_by(
-        extract('year', PowerLog.log_date),
-        extract('month', PowerLog.log_date)
-    ).all()
+    # 用累進費率一次重新計算所有月份的總電費（轉成整數分）
+    month_costs_progressive = np.rint(price_cumulative_by_month(
+        np.array(month_kwh_units, dtype=np.int64) / ENERGY_SCALE,
+        [row.month_start.month for row in monthly_result]
+    ) * 100).astype(np.int64)
     
     monthly_stats = []
-    total_cost_progressive = 0
     
-    for row in monthly_result:
-        year = int(row.year)
-        month = int(row.month)
-        month_kwh = _to_float(row.kwh)
-        month_cost_sum = _to_float(row.cost)
+    for row, kwh_units, cost_sum_units, progressive_units in zip(
+        monthly_result, month_kwh_units, month_cost_units, month_costs_progressive.tolist()
+    ):
+        year = row.month_start.year
+        month = row.month_start.month
         
         year_month = f"{year}-{month:02d}"
-        sample_date = date(year, month, 1)
         is_summer = 6 <= month <= 9
         
-        # 用累進費率重新計算該月總電費
-        month_cost_progressive = calculate_taiwan_bill(month_kwh, sample_date)
-        total_cost_progressive += month_cost_progressive
-        
         monthly_stats.append({
             "month": year_month,
-            "kwh": round(month_kwh, 2),
-            "cost_sum": round(month_cost_sum, 2),
-            "cost_progressive": round(month_cost_progressive, 2),
+            "kwh": energy_value(kwh_units, 2),
+            "cost_sum": cost_value(cost_sum_units),
+            "cost_progressive": cost_value(progressive_units),
             "season": "夏月" if is_summer else "非夏月",
-            "difference": round(month_cost_progressive - month_cost_sum, 2)
+            "difference": cost_value(progressive_units - cost_sum_units)
         })
 
     return jsonify({
-        "total_kwh": round(total_kwh, 2),
-        "total_cost_sum": round(total_cost_sum, 2),
-        "total_cost_progressive": round(total_cost_progressive, 2),
+        "total_kwh": energy_value(sum(month_kwh_units), 2),
+        "total_cost_sum": cost_value(sum(month_cost_units)),
+        "total_cost_progressive": cost_value(int(month_costs_progressive.sum())),
         "months": monthly_stats,
         "billing_method": "台電累進費率",
         "explanation": {
@@ -439,6 +582,16 @@ def add_usage():
     if not device_id:
         return jsonify({"ok": False, "msg": "device_id 必填"}), 400
 
+    # 閘道重送：相同 idempotency_key 直接回傳第一次的結果
+    try:
+        idempotency_key = validate_key(data.get("idempotency_key"))
+    except ValueError as ve:
+        return jsonify({"ok": False, "msg": str(ve)}), 400
+    if idempotency_key:
+        replay = find_replays([idempotency_key]).get(idempotency_key)
+        if replay:
+            return jsonify(dict(replay, replayed=True))
+
     # 檢查輸入：必須提供 kwh 或 hours
     if kwh is not None:
         # 方式1: 直接提供度數
@@ -456,7 +609,7 @@ def add_usage():
         # 如果沒有提供 power_watts，從 devices 表讀取額定功率
         if power_watts is None:
             device_query = db.session.execute(
-                db.text("SELECT rated_power FROM devices WHERE device_id = :device_id"),
+                db.text("SELECT rated_power FROM devices WHERE device_id = :device_id AND deleted_at IS NULL"),
                 {"device_id": device_id}
             ).fetchone()
             
@@ -494,48 +647,61 @@ def add_usage():
     # 轉成 date 物件
     current_date = datetime.strptime(day_str, "%Y-%m-%d").date() if isinstance(day_str, str) else day_str
 
-    # ==========================================
-    # 核心修正：計算「目前這筆資料」該落在哪個級距
-    # ==========================================
-    
-    # 1. 取得「本月截至昨天」的累積用電 (Base A)
-    #    (include_target_date=False 代表只算到 target_date 的前一天)
-    base_month_kwh = get_monthly_total_kwh(current_date, include_target_date=False)
+    # 非同步模式：驗證完成即放入寫入佇列，電費由背景寫入時依序計算
+    if data.get("async"):
+        try:
+            ingestion_id = _get_ingest_queue().submit({
+                "device_id": device_id,
+                "log_date": current_date,
+                "kwh": kwh,
+                "power_watts": power_watts if calculation_method == "calculated" else None,
+                "hours": hours if calculation_method == "calculated" else None,
+                "idempotency_key": idempotency_key
+            })
+        except queue.Full:
+            return jsonify({"ok": False, "msg": "寫入佇列已滿，請稍後再試"}), 503
+        return jsonify({
+            "ok": True,
+            "queued": True,
+            "ingestion_id": ingestion_id,
+            "calculation_method": calculation_method
+        }), 202
 
-    # 2. 取得「今天稍早已經新增」的累積用電 (Base B)
-    #    這一步非常重要！原本的程式漏了這段，導致同一天的資料彼此「互不認識」
-    #    使用 SQLAlchemy 直接查詢資料庫
-    base_today_kwh_result = db.session.query(
-        func.sum(PowerLog.energy_consumed)
-    ).filter(
-        PowerLog.log_date == current_date
-    ).scalar()
-    base_today_kwh = _to_float(base_today_kwh_result) if base_today_kwh_result else 0
+    try:
+        # ==========================================
+        # 核心修正：計算「目前這筆資料」該落在哪個級距
+        # ==========================================
+        
+        # 1. 鎖定本月的月帳本（全戶月彙總列，SELECT ... FOR UPDATE）
+        #    同月的併發寫入會在這裡排隊，確保每筆都以前一筆寫入後的累積量計價
+        ledger = lock_month_ledgers([month_start_of(current_date)]).get(month_start_of(current_date))
 
-    # 3. 算出「計算本筆電費前的總累積度數」
-    #    (本月總累積 = 昨以前 + 今天已存)
-    current_cumulative_kwh = base_month_kwh + base_today_kwh
+        # 2. 由帳本取得「本月截至昨天」(Base A) 與「今天稍早已經新增」(Base B) 的累積用電
+        #    這一步非常重要！原本的程式漏了 Base B，導致同一天的資料彼此「互不認識」
+        base_month_units, base_today_units = ledger_base_units(ledger, current_date)
+        base_month_kwh = energy_value(base_month_units)
+        base_today_kwh = energy_value(base_today_units)
 
-    # 4. 計算加入本筆後的「新累積度數」
-    new_cumulative_kwh = current_cumulative_kwh + kwh
+        # 3. 算出「計算本筆電費前的總累積度數」
+        #    (本月總累積 = 昨以前 + 今天已存，以整數單位相加避免浮點誤差)
+        current_cumulative_kwh = energy_value(base_month_units + base_today_units)
 
-    # ==========================================
-    # 開始算錢 (使用台電累進費率)
-    # ==========================================
-    
-    # 算式：(加了這筆後的總電費) - (還沒加這筆前的總電費) = 這筆電的真實邊際成本
-    bill_before = calculate_taiwan_bill(current_cumulative_kwh, current_date)
-    bill_after = calculate_taiwan_bill(new_cumulative_kwh, current_date)
-    
-    real_cost = round(bill_after - bill_before, 2)
-    
-    # 計算平均費率 (四捨五入到小數點後2位，避免浮點數誤差)
-    avg_rate = round(real_cost / kwh, 2) if kwh > 0 else 0
+        # 4. 計算加入本筆後的「新累積度數」
+        new_cumulative_kwh = current_cumulative_kwh + kwh
 
-    # ==========================================
-    # 存入資料庫
-    # ==========================================
-    try:
+        # ==========================================
+        # 開始算錢 (使用台電累進費率)
+        # ==========================================
+        
+        # 算式：(加了這筆後的總電費) - (還沒加這筆前的總電費) = 這筆電的真實邊際成本
+        real_cost = calculate_marginal_cost(current_cumulative_kwh, kwh, current_date)
+        
+        # 計算平均費率 (四捨五入到小數點後2位，避免浮點數誤差)
+        avg_rate = round(real_cost / kwh, 2) if kwh > 0 else 0
+
+        # ==========================================
+        # 存入資料庫（與帳本鎖定在同一交易）
+        # ==========================================
         new_log = PowerLog(
             device_id=device_id,
             power_watts=power_watts if calculation_method == "calculated" else None,
@@ -546,32 +712,42 @@ def add_usage():
             electricity_rate=avg_rate
         )
         db.session.add(new_log)
-        db.session.commit()
-        
-        # 重新整理以取得自動產生的 log_id
-        db.session.refresh(new_log)
+        record_log_added(new_log)  # 同一交易內更新彙總表（含月帳本）
+        db.session.flush()  # 取得自動產生的 log_id
         new_row = new_log.to_dict()
+
+        # 補登較早日期：同月之後的紀錄重新計價
+        repriced = reprice_after([current_date])
+
+        response_data = {
+            "ok": True, 
+            "new_data": new_row,
+            "debug_info": {
+                "month_base_kwh": float(base_month_kwh),
+                "today_base_kwh": float(base_today_kwh),
+                "total_accumulated_before": float(current_cumulative_kwh),
+                "total_accumulated_after": float(new_cumulative_kwh),
+                "this_tier_rate": avg_rate,
+                "calculation_method": calculation_method,
+                "repriced_count": len(repriced)
+            }
+        }
+        
+        # 如果是從瓦數計算的，加入計算資訊
+        if power_info:
+            response_data["power_calculation"] = power_info
+        
+        # 與 power_logs 同一交易記錄去重結果
+        remember_results([(idempotency_key, new_log.log_id, response_data)])
+        db.session.commit()
         
     except Exception as e:
         db.session.rollback()
+        # 同一 key 併發重送時，唯一索引會擋下較晚的那筆：回傳先完成的結果
+        replay = find_replays([idempotency_key]).get(idempotency_key) if idempotency_key else None
+        if replay:
+            return jsonify(dict(replay, replayed=True))
         return jsonify({"ok": False, "msg": f"儲存失敗: {str(e)}"}), 500
-
-    response_data = {
-        "ok": True, 
-        "new_data": new_row,
-        "debug_info": {
-            "month_base_kwh": float(base_month_kwh),
-            "today_base_kwh": float(base_today_kwh),
-            "total_accumulated_before": float(current_cumulative_kwh),
-            "total_accumulated_after": float(new_cumulative_kwh),
-            "this_tier_rate": avg_rate,
-            "calculation_method": calculation_method
-        }
-    }
-    
-    # 如果是從瓦數計算的，加入計算資訊
-    if power_info:
-        response_data["power_calculation"] = power_info
     
     return jsonify(response_data)
 
@@ -594,53 +770,57 @@ def get_monthly_summary(year, month):
     - days_with_data: 有資料的天數
     """
     try:
-        # 計算該月的開始和結束日期
-        start_date = date(year, month, 1)
-        if month == 12:
-            end_date = date(year + 1, 1, 1) - timedelta(days=1)
-        else:
-            end_date = date(year, month + 1, 1) - timedelta(days=1)
-        
-        # 查詢該月的每日統計
-        daily_stats = db.session.query(
-            PowerLog.log_date,
-            func.sum(PowerLog.energy_consumed).label('kwh'),
-            func.sum(PowerLog.cost).label('cost'),
-            func.count(PowerLog.log_id).label('record_count')
-        ).filter(
-            PowerLog.log_date >= start_date,
-            PowerLog.log_date <= end_date
-        ).group_by(PowerLog.log_date).order_by(PowerLog.log_date).all()
-        
-        # 計算月總計
-        total_kwh = sum(_to_float(row.kwh) for row in daily_stats)
-        total_cost = sum(_to_float(row.cost) for row in daily_stats)
-        
-        # 建立每日明細
-        daily_breakdown = [
-            {
-                "date": row.log_date.strftime("%Y-%m-%d"),
-                "kwh": round(_to_float(row.kwh), 2),
-                "cost": round(_to_float(row.cost), 2),
-                "record_count": row.record_count
-            }
-            for row in daily_stats
-        ]
-        
-        return jsonify({
-            "ok": True,
-            "year": year,
-            "month": month,
-            "total_kwh": round(total_kwh, 2),
-            "total_cost": round(total_cost, 2),
-            "days_with_data": len(daily_stats),
-            "daily_breakdown": daily_breakdown
-        })
+        summary = PERIOD_CACHE.get_or_compute(
+            "monthly", resolve_period("month", f"{year}-{month}").label, lambda: _compute_monthly_summary(year, month)
+        )
+        return jsonify(dict(summary, ok=True))
         
     except Exception as e:
         return jsonify({"ok": False, "msg": f"查詢失敗: {str(e)}"}), 500
 
 
+def _compute_monthly_summary(year, month):
+    """從全戶日彙總表計算月份統計（已結束的月份會被快取）"""
+    # 該月的日期範圍 [月初, 下月初)
+    period = resolve_period("month", f"{year}-{month}")
+    
+    # 從全戶日彙總表查詢該月的每日統計
+    daily_stats = db.session.query(
+        UsageDailyRollup.log_date,
+        energy_units_sql(UsageDailyRollup.energy_consumed).label('kwh_units'),
+        cost_units_sql(UsageDailyRollup.cost).label('cost_units'),
+        UsageDailyRollup.record_count.label('record_count')
+    ).filter(
+        UsageDailyRollup.device_id == HOME_DEVICE_ID,
+        in_period(UsageDailyRollup.log_date, period),
+        UsageDailyRollup.record_count > 0
+    ).order_by(UsageDailyRollup.log_date).all()
+    
+    # 計算月總計
+    total_kwh = sum(row.kwh_units for row in daily_stats)
+    total_cost = sum(row.cost_units for row in daily_stats)
+    
+    # 建立每日明細
+    daily_breakdown = [
+        {
+            "date": row.log_date.strftime("%Y-%m-%d"),
+            "kwh": energy_value(row.kwh_units, 2),
+            "cost": cost_value(row.cost_units),
+            "record_count": row.record_count
+        }
+        for row in daily_stats
+    ]
+    
+    return {
+        "year": year,
+        "month": month,
+        "total_kwh": energy_value(total_kwh, 2),
+        "total_cost": cost_value(total_cost),
+        "days_with_data": len(daily_stats),
+        "daily_breakdown": daily_breakdown
+    }
+
+
 @bp.route("/yearly/<int:year>", methods=["GET"])
 def get_yearly_summary(year):
     """
@@ -655,133 +835,196 @@ def get_yearly_summary(year):
     - months_with_data: 有資料的月份數
     """
     try:
-        # 查詢該年的每月統計
-        monthly_stats = db.session.query(
-            extract('month', PowerLog.log_date).label('month'),
-            func.sum(PowerLog.energy_consumed).label('kwh'),
-            func.sum(PowerLog.cost).label('cost'),
-            func.count(PowerLog.log_id).label('record_count')
-        ).filter(
-            extract('year', PowerLog.log_date) == year
-        ).group_by(
-            extract('month', PowerLog.log_date)
-        ).order_by(
-            extract('month', PowerLog.log_date)
-        ).all()
-        
-        # 計算年總計
-        total_kwh = sum(_to_float(row.kwh) for row in monthly_stats)
-        total_cost = sum(_to_float(row.cost) for row in monthly_stats)
-        
-        # 建立每月明細
-        monthly_breakdown = [
-            {
-                "month": int(row.month),
-                "kwh": round(_to_float(row.kwh), 2),
-                "cost": round(_to_float(row.cost), 2),
-                "record_count": row.record_count
-            }
-            for row in monthly_stats
-        ]
-        
-        return jsonify({
-            "ok": True,
-            "year": year,
-            "total_kwh": round(total_kwh, 2),
-            "total_cost": round(total_cost, 2),
-            "months_with_data": len(monthly_stats),
-            "monthly_breakdown": monthly_breakdown
-        })
+        summary = PERIOD_CACHE.get_or_compute(
+            "yearly", str(year), lambda: _compute_yearly_summary(year)
+        )
+        return jsonify(dict(summary, ok=True))
         
     except Exception as e:
         return jsonify({"ok": False, "msg": f"查詢失敗: {str(e)}"}), 500
 
 
+def _compute_yearly_summary(year):
+    """從全戶月彙總表計算年份統計（已結束的年份會被快取）"""
+    # 從全戶月彙總表查詢該年的每月統計
+    monthly_stats = db.session.query(
+        UsageMonthlyRollup.month_start,
+        energy_units_sql(UsageMonthlyRollup.energy_consumed).label('kwh_units'),
+        cost_units_sql(UsageMonthlyRollup.cost).label('cost_units'),
+        UsageMonthlyRollup.record_count.label('record_count')
+    ).filter(
+        UsageMonthlyRollup.device_id == HOME_DEVICE_ID,
+        in_period(UsageMonthlyRollup.month_start, resolve_period("year", year)),
+        UsageMonthlyRollup.record_count > 0
+    ).order_by(UsageMonthlyRollup.month_start).all()
+    
+    # 計算年總計
+    total_kwh = sum(row.kwh_units for row in monthly_stats)
+    total_cost = sum(row.cost_units for row in monthly_stats)
+    
+    # 建立每月明細
+    monthly_breakdown = [
+        {
+            "month": row.month_start.month,
+            "kwh": energy_value(row.kwh_units, 2),
+            "cost": cost_value(row.cost_units),
+            "record_count": row.record_count
+        }
+        for row in monthly_stats
+    ]
+    
+    return {
+        "year": year,
+        "total_kwh": energy_value(total_kwh, 2),
+        "total_cost": cost_value(total_cost),
+        "months_with_data": len(monthly_stats),
+        "monthly_breakdown": monthly_breakdown
+    }
+
+
+COMPARE_MAX_PERIODS = 60    # /usage/compare 單次最多比較的期間數
+
+
+def _load_period_stats(period_type, periods):
+    """
+    以單一查詢取得多個期間的全戶統計
+    
+    日 → 全戶日彙總；月/年 → 全戶月彙總。每個期間轉成 [start, end) 範圍後以 OR 合併，
+    可直接使用日期索引，再於記憶體中依期間標籤加總（整數單位）。
+    
+    Args:
+        period_type: day / month / year
+        periods: Period 列表（見 usage_periods.py）
+    
+    Returns:
+        dict: {label: {"label", "kwh", "cost", "record_count"}}
+    """
+    if period_type == "day":
+        model, date_column = UsageDailyRollup, UsageDailyRollup.log_date
+    else:
+        model, date_column = UsageMonthlyRollup, UsageMonthlyRollup.month_start
+    
+    rows = db.session.query(
+        date_column, energy_units_sql(model.energy_consumed), cost_units_sql(model.cost), model.record_count
+    ).filter(
+        model.device_id == HOME_DEVICE_ID,
+        or_(*[in_period(date_column, p) for p in periods])
+    ).all()
+    
+    totals = {p.label: [0, 0, 0] for p in periods}
+    for row_date, kwh_units, cost_units_, count in rows:
+        acc = totals.get(label_of(period_type, row_date))
+        if acc is None:
+            continue
+        acc[0] += kwh_units
+        acc[1] += cost_units_
+        acc[2] += count or 0
+    
+    return {
+        label: {
+            "label": label,
+            "kwh": energy_value(kwh_units, 2),
+            "cost": cost_value(cost_total),
+            "record_count": count
+        }
+        for label, (kwh_units, cost_total, count) in totals.items()
+    }
+
+
+def _compare_stats(base, target):
+    """計算 target 相對 base 的差異（以整數單位相減，避免 0.1 + 0.2 類誤差）"""
+    kwh_diff = energy_value(energy_units(target["kwh"]) - energy_units(base["kwh"]), 2)
+    cost_diff = cost_value(cost_units(target["cost"]) - cost_units(base["cost"]))
+    return {
+        "kwh_difference": round(kwh_diff, 2),
+        "cost_difference": round(cost_diff, 2),
+        "kwh_percent_change": round((kwh_diff / base["kwh"]) * 100, 2) if base["kwh"] > 0 else None,
+        "cost_percent_change": round((cost_diff / base["cost"]) * 100, 2) if base["cost"] > 0 else None
+    }
+
+
 @bp.route("/compare", methods=["GET"])
 def compare_periods():
     """
-    比較兩個時間段的用電統計
+    比較多個時間段的用電統計
     
-    URL: GET /usage/compare?period_type=<type>&date1=<date1>&date2=<date2>
+    URL: GET /usage/compare?period_type=<type>&periods=<p1>,<p2>,...&baseline=<label>
+         GET /usage/compare?period_type=<type>&date1=<date1>&date2=<date2>   （舊版，兩個期間）
     
     參數：
     - period_type: 比較類型 ('day', 'month', 'year')
-    - date1: 第一個時間點 (YYYY-MM-DD 或 YYYY-MM 或 YYYY)
-    - date2: 第二個時間點 (YYYY-MM-DD 或 YYYY-MM 或 YYYY)
+    - periods: 以逗號分隔的期間 (YYYY-MM-DD 或 YYYY-MM 或 YYYY)，最多 COMPARE_MAX_PERIODS 個
+    - baseline: 基準期間（可選，預設為第一個期間）
+    - date1 / date2: 舊版參數，等同 periods=date1,date2
+    
+    所有期間以單一查詢計算，已結束的期間直接讀快取（見 usage_period_cache.py）
     
     回傳：
-    - period1: 第一個時間段的統計資料
-    - period2: 第二個時間段的統計資料
-    - comparison: 比較結果 (差異與百分比變化)
+    - periods: 各期間的統計資料（依請求順序）
+    - baseline: 基準期間標籤
+    - baseline_deltas: 各期間相對基準的差異
+    - pairwise: 相鄰期間（前 → 後）的差異
+    - period1 / period2 / comparison: 使用 date1 / date2 時沿用舊版欄位
     """
     try:
         period_type = request.args.get("period_type", "month")
+        periods_str = request.args.get("periods")
         date1_str = request.args.get("date1")
         date2_str = request.args.get("date2")
         
-        if not date1_str or not date2_str:
-            return jsonify({"ok": False, "msg": "請提供 date1 和 date2 參數"}), 400
-        
-        def get_period_stats(date_str, period_type):
-            """取得指定時間段的統計"""
-            if period_type == "day":
-                target_date = datetime.strptime(date_str, "%Y-%m-%d").date()
-                filters = [PowerLog.log_date == target_date]
-                label = date_str
-            elif period_type == "month":
-                parts = date_str.split("-")
-                year, month = int(parts[0]), int(parts[1])
-                start_date = date(year, month, 1)
-                if month == 12:
-                    end_date = date(year + 1, 1, 1) - timedelta(days=1)
-                else:
-                    end_date = date(year, month + 1, 1) - timedelta(days=1)
-                filters = [PowerLog.log_date >= start_date, PowerLog.log_date <= end_date]
-                label = f"{year}-{month:02d}"
-            elif period_type == "year":
-                year = int(date_str)
-                filters = [extract('year', PowerLog.log_date) == year]
-                label = str(year)
-            else:
-                raise ValueError(f"不支援的 period_type: {period_type}")
-            
-            result = db.session.query(
-                func.sum(PowerLog.energy_consumed).label('kwh'),
-                func.sum(PowerLog.cost).label('cost'),
-                func.count(PowerLog.log_id).label('record_count')
-            ).filter(*filters).first()
-            
-            return {
-                "label": label,
-                "kwh": round(_to_float(result.kwh), 2) if result.kwh else 0,
-                "cost": round(_to_float(result.cost), 2) if result.cost else 0,
-                "record_count": result.record_count if result.record_count else 0
-            }
+        if periods_str:
+            values = [v.strip() for v in periods_str.split(",") if v.strip()]
+        elif date1_str and date2_str:
+            values = [date1_str, date2_str]
+        else:
+            return jsonify({"ok": False, "msg": "請提供 periods 或 date1 和 date2 參數"}), 400
         
-        period1 = get_period_stats(date1_str, period_type)
-        period2 = get_period_stats(date2_str, period_type)
+        if len(values) > COMPARE_MAX_PERIODS:
+            return jsonify({"ok": False, "msg": f"單次最多比較 {COMPARE_MAX_PERIODS} 個期間"}), 400
         
-        # 計算比較結果
-        kwh_diff = period2["kwh"] - period1["kwh"]
-        cost_diff = period2["cost"] - period1["cost"]
+        periods = [resolve_period(period_type, v) for v in values]
+        unique_periods = list({p.label: p for p in periods}.values())
+        by_label = {p.label: p for p in unique_periods}
         
-        kwh_pct_change = round((kwh_diff / period1["kwh"]) * 100, 2) if period1["kwh"] > 0 else None
-        cost_pct_change = round((cost_diff / period1["cost"]) * 100, 2) if period1["cost"] > 0 else None
+        # 已結束的期間直接讀快取，其餘一次查詢
+        stats = PERIOD_CACHE.get_many_or_compute(
+            period_type,
+            [p.label for p in unique_periods],
+            lambda labels: _load_period_stats(period_type, [by_label[label] for label in labels])
+        )
+        period_stats = [stats[p.label] for p in periods]
         
-        comparison = {
-            "kwh_difference": round(kwh_diff, 2),
-            "cost_difference": round(cost_diff, 2),
-            "kwh_percent_change": kwh_pct_change,
-            "cost_percent_change": cost_pct_change
-        }
+        baseline_label = request.args.get("baseline")
+        if baseline_label:
+            baseline_label = resolve_period(period_type, baseline_label).label
+            if baseline_label not in stats:
+                return jsonify({"ok": False, "msg": f"baseline 必須是 periods 其中之一: {baseline_label}"}), 400
+        else:
+            baseline_label = periods[0].label
+        baseline = stats[baseline_label]
         
-        return jsonify({
+        response = {
             "ok": True,
             "period_type": period_type,
-            "period1": period1,
-            "period2": period2,
-            "comparison": comparison
-        })
+            "periods": period_stats,
+            "baseline": baseline_label,
+            "baseline_deltas": [
+                dict(_compare_stats(baseline, p), label=p["label"]) for p in period_stats
+            ],
+            "pairwise": [
+                dict(_compare_stats(prev, cur), **{"from": prev["label"], "to": cur["label"]})
+                for prev, cur in zip(period_stats, period_stats[1:])
+            ]
+        }
+        
+        if not periods_str:
+            response.update({
+                "period1": period_stats[0],
+                "period2": period_stats[1],
+                "comparison": _compare_stats(period_stats[0], period_stats[1])
+            })
+        
+        return jsonify(response)
         
     except ValueError as ve:
         return jsonify({"ok": False, "msg": str(ve)}), 400
@@ -789,6 +1032,253 @@ def compare_periods():
         return jsonify({"ok": False, "msg": f"比較失敗: {str(e)}"}), 500
 
 
+def price_entries_in_order(entries):
+    """
+    依序為多筆用電資料計算累進電費（與逐筆呼叫 /usage/add 的結果相同）
+    
+    每筆的計價基準 = 當月在該日之前的累積用電 + 當日已存在的用電，
+    並包含同一批中排在前面的資料。
+    
+    先鎖定相關月份的月帳本（見 usage_rollup.lock_month_ledgers），再從全戶日彙總
+    一次讀出所有月份的每日用電，必須在寫入的同一交易內呼叫。
+    
+    Args:
+        entries: dict 列表，需含 "log_date" 與 "kwh"；
+                 會寫入 "base_kwh"、"cost"、"electricity_rate"
+    """
+    if not entries:
+        return
+    month_starts = {month_start_of(e["log_date"]) for e in entries}
+    lock_month_ledgers(month_starts)
+    # 每月一個以「日」為索引的用電陣列，計價基準 = 月初到當日（含）的前綴和，
+    # 不隨月份天數或其他月份的資料量增加
+    month_days = {month_start: [0] * 32 for month_start in month_starts}
+    for d, units in load_home_day_units(month_starts).items():
+        month_days[month_start_of(d)][d.day] += units
+    for entry in entries:
+        log_date = entry["log_date"]
+        days = month_days[month_start_of(log_date)]
+        base_kwh = energy_value(sum(days[:log_date.day + 1]))
+        kwh = entry["kwh"]
+        cost = calculate_marginal_cost(base_kwh, kwh, log_date)
+        entry["base_kwh"] = base_kwh
+        entry["cost"] = cost
+        entry["electricity_rate"] = round(cost / kwh, 2) if kwh > 0 else 0
+        days[log_date.day] += energy_units(kwh)
+
+
+def _find_existing_keys(entries):
+    """一次查出 entries 中已存在於資料庫的 (device_id, log_date)"""
+    if not entries:
+        return set()
+    return set(db.session.query(
+        PowerLog.device_id, PowerLog.log_date
+    ).filter(
+        PowerLog.device_id.in_({e["device_id"] for e in entries}),
+        PowerLog.log_date.in_({e["log_date"] for e in entries})
+    ).all())
+
+
+def _insert_priced_entries(entries):
+    """
+    以單一 executemany INSERT 寫入已計價的資料，並更新彙總表（不 commit）
+    
+    Args:
+        entries: 經過 price_entries_in_order() 的 dict 列表
+    
+    Returns:
+        dict: {(device_id, log_date): log_id}
+    """
+    if not entries:
+        return {}
+    now = datetime.now()
+    db.session.execute(PowerLog.__table__.insert(), [
+        {
+            "device_id": e["device_id"],
+            "power_watts": e["power_watts"],
+            "hours": e["hours"],
+            "log_date": e["log_date"],
+            "energy_consumed": e["kwh"],
+            "cost": e["cost"],
+            "electricity_rate": e["electricity_rate"],
+            "created_at": now
+        }
+        for e in entries
+    ])
+    
+    apply_usage_deltas([
+        (e["device_id"], e["log_date"], e["kwh"], e["cost"], 1) for e in entries
+    ])
+    
+    # 取回 log_id（以 uk_device_date 對應）
+    return {
+        (device_id, log_date): log_id
+        for log_id, device_id, log_date in db.session.query(
+            PowerLog.log_id, PowerLog.device_id, PowerLog.log_date
+        ).filter(
+            PowerLog.device_id.in_({e["device_id"] for e in entries}),
+            PowerLog.log_date.in_({e["log_date"] for e in entries})
+        ).all()
+    }
+
+
+def _reprice_inserted(entries, log_ids):
+    """
+    批次寫入後重新計價同月之後的紀錄（不 commit）
+
+    同一批中日期較晚的資料也可能被重新計價，會同步更新 entries 的
+    "cost" 與 "electricity_rate"，讓回傳結果與資料庫一致。
+    """
+    if not entries:
+        return
+    repriced = reprice_after(e["log_date"] for e in entries)
+    for entry in entries:
+        log_id = log_ids.get((entry["device_id"], entry["log_date"]))
+        if log_id in repriced:
+            entry.update(repriced[log_id])
+
+
+def _write_ingested_entries(entries):
+    """
+    背景寫入佇列的寫入函式：一批資料一個交易
+    
+    與 /usage/batch 不同，單筆衝突（同設備同日已有紀錄）只讓該筆失敗，
+    其餘資料照常寫入。
+    
+    Returns:
+        list: 與 entries 同順序的結果 dict
+    """
+    results = [None] * len(entries)
+    existing_keys = _find_existing_keys(entries)
+    replays = find_replays(e.get("idempotency_key") for e in entries)
+    accepted = []
+    first_by_key = {}
+    for idx, entry in enumerate(entries):
+        # 重送的資料：回傳原始結果（同批中重複的 key 稍後沿用第一筆的結果）
+        idem_key = entry.get("idempotency_key")
+        if idem_key in replays:
+            results[idx] = dict(replays[idem_key], replayed=True)
+            continue
+        if idem_key and idem_key in first_by_key:
+            continue
+        if idem_key:
+            first_by_key[idem_key] = idx
+        key = (entry["device_id"], entry["log_date"])
+        if key in existing_keys:
+            results[idx] = {
+                "success": False,
+                "error": f"設備 {entry['device_id']} 在 {entry['log_date']} 已有用電紀錄"
+            }
+            continue
+        existing_keys.add(key)
+        accepted.append((idx, entry))
+    
+    try:
+        price_entries_in_order([entry for _, entry in accepted])
+        log_ids = _insert_priced_entries([entry for _, entry in accepted])
+        _reprice_inserted([entry for _, entry in accepted], log_ids)
+        for idx, entry in accepted:
+            results[idx] = {
+                "success": True,
+                "log_id": log_ids.get((entry["device_id"], entry["log_date"])),
+                "device_id": entry["device_id"],
+                "date": entry["log_date"].strftime("%Y-%m-%d"),
+                "kwh": entry["kwh"],
+                "cost": entry["cost"],
+                "electricity_rate": entry["electricity_rate"]
+            }
+        remember_results(
+            (entry.get("idempotency_key"), results[idx]["log_id"], results[idx])
+            for idx, entry in accepted
+        )
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        for idx, _ in accepted:
+            results[idx] = {"success": False, "error": str(e)}
+    
+    for idx, entry in enumerate(entries):
+        if results[idx] is None:
+            first = results[first_by_key[entry["idempotency_key"]]]
+            results[idx] = dict(first, replayed=True) if first.get("success") else first
+    return results
+
+
+def _get_ingest_queue():
+    """取得（必要時建立並啟動）非同步寫入佇列"""
+    global INGEST_QUEUE
+    if INGEST_QUEUE is None:
+        config = current_app.config
+        INGEST_QUEUE = IngestQueue(
+            _write_ingested_entries,
+            max_size=config.get("USAGE_INGEST_QUEUE_SIZE", 10000),
+            flush_interval_ms=config.get("USAGE_INGEST_FLUSH_MS", 200),
+            flush_max_records=config.get("USAGE_INGEST_FLUSH_RECORDS", 500)
+        )
+    INGEST_QUEUE.start(current_app._get_current_object())
+    return INGEST_QUEUE
+
+
+def _parse_batch_record(record, devices):
+    """
+    驗證並解析批次中的單筆記錄
+    
+    Args:
+        record: 請求中的單筆記錄
+        devices: {device_id: Device}（已預先載入）
+    
+    Returns:
+        dict: device_id, log_date, kwh, power_watts, hours
+    """
+    device_id = record.get("device_id")
+    if not device_id:
+        raise ValueError("缺少 device_id")
+    
+    # 解析日期
+    if "date" in record:
+        try:
+            log_date = datetime.strptime(record["date"], "%Y-%m-%d").date()
+        except ValueError:
+            raise ValueError(f"日期格式錯誤，應為 YYYY-MM-DD")
+    else:
+        log_date = date.today()
+    
+    # 計算用電量
+    if "kwh" in record:
+        kwh = float(record["kwh"])
+        power_watts = None
+        hours = None
+    elif "watts" in record and "hours" in record:
+        power_watts = float(record["watts"])
+        hours = float(record["hours"])
+        kwh = round(power_watts * hours / 1000, 2)
+    elif "watts" in record or "hours" in record:
+        # 只有一個參數，嘗試從設備取得額定功率
+        device = devices.get(device_id)
+        if not device:
+            raise ValueError(f"找不到設備 ID: {device_id}")
+        if not device.rated_power:
+            raise ValueError(f"設備 {device.device_name} 沒有設定額定功率")
+        
+        power_watts = float(record.get("watts", device.rated_power))
+        hours = float(record.get("hours", 1))
+        kwh = round(power_watts * hours / 1000, 2)
+    else:
+        raise ValueError("請提供 kwh 或 (watts + hours)")
+    
+    if kwh <= 0:
+        raise ValueError("用電量必須大於 0")
+    
+    return {
+        "device_id": device_id,
+        "log_date": log_date,
+        "kwh": kwh,
+        "power_watts": power_watts,
+        "hours": hours,
+        "idempotency_key": validate_key(record.get("idempotency_key"))
+    }
+
+
 @bp.route("/batch", methods=["POST"])
 def add_usage_batch():
     """
@@ -812,6 +1302,13 @@ def add_usage_batch():
         ]
     }
     
+    處理流程（批次大小不影響查詢次數）：
+    1. 一次載入相關設備並驗證所有記錄
+    2. 一次查出所有相關月份的每日用電，於記憶體中依序計算累進電費
+    3. 以單一 executemany INSERT 寫入，並更新彙總表（見 _insert_priced_entries）
+    4. 同月中日期較晚的既有紀錄重新計價（見 usage_reprice.py）
+    任何一筆失敗即回滾全部變更。
+    
     回傳：
     - success_count: 成功筆數
     - failure_count: 失敗筆數
@@ -829,104 +1326,75 @@ def add_usage_batch():
             return jsonify({"ok": False, "msg": "records 必須是非空陣列"}), 400
         
         results = []
+        entries = []
         success_count = 0
         failure_count = 0
         
-        # 使用 savepoint 來處理交易
         try:
+            # 1. 一次載入相關設備，再驗證所有記錄
+            device_ids = {
+                r.get("device_id") for r in records
+                if isinstance(r, dict) and r.get("device_id")
+            }
+            devices = {
+                d.device_id: d
+                for d in Device.query.filter(
+                    Device.device_id.in_(device_ids), Device.deleted_at.is_(None)
+                ).all()
+            } if device_ids else {}
+            
+            parsed = []
             for idx, record in enumerate(records):
                 try:
-                    device_id = record.get("device_id")
-                    if not device_id:
-                        raise ValueError("缺少 device_id")
-                    
-                    # 解析日期
-                    if "date" in record:
-                        try:
-                            log_date = datetime.strptime(record["date"], "%Y-%m-%d").date()
-                        except ValueError:
-                            raise ValueError(f"日期格式錯誤，應為 YYYY-MM-DD")
-                    else:
-                        log_date = date.today()
-                    
-                    # 計算用電量
-                    if "kwh" in record:
-                        kwh = float(record["kwh"])
-                        calculation_method = "direct"
-                        power_watts = None
-                        hours = None
-                    elif "watts" in record and "hours" in record:
-                        power_watts = float(record["watts"])
-                        hours = float(record["hours"])
-                        kwh = round(power_watts * hours / 1000, 2)
-                        calculation_method = "calculated"
-                    elif "watts" in record or "hours" in record:
-                        # 只有一個參數，嘗試從設備取得額定功率
-                        device = Device.query.get(device_id)
-                        if not device:
-                            raise ValueError(f"找不到設備 ID: {device_id}")
-                        if not device.rated_power:
-                            raise ValueError(f"設備 {device.name} 沒有設定額定功率")
-                        
-                        power_watts = float(record.get("watts", device.rated_power))
-                        hours = float(record.get("hours", 1))
-                        kwh = round(power_watts * hours / 1000, 2)
-                        calculation_method = "calculated"
-                    else:
-                        raise ValueError("請提供 kwh 或 (watts + hours)")
-                    
-                    if kwh <= 0:
-                        raise ValueError("用電量必須大於 0")
-                    
-                    # 計算電費 (使用累進費率)
-                    base_month_kwh = get_monthly_total_kwh(log_date, include_target_date=False)
-                    base_today_kwh_result = db.session.query(
-                        func.sum(PowerLog.energy_consumed)
-                    ).filter(
-                        PowerLog.log_date == log_date
-                    ).scalar()
-                    base_today_kwh = _to_float(base_today_kwh_result) if base_today_kwh_result else 0
-                    
-                    current_cumulative_kwh = base_month_kwh + base_today_kwh
-                    new_cumulative_kwh = current_cumulative_kwh + kwh
-                    
-                    bill_before = calculate_taiwan_bill(current_cumulative_kwh, log_date)
-                    bill_after = calculate_taiwan_bill(new_cumulative_kwh, log_date)
-                    
-                    real_cost = round(bill_after - bill_before, 2)
-                    avg_rate = round(real_cost / kwh, 2) if kwh > 0 else 0
-                    
-                    # 建立記錄
-                    new_log = PowerLog(
-                        device_id=device_id,
-                        power_watts=power_watts,
-                        hours=hours,
-                        log_date=log_date,
-                        energy_consumed=kwh,
-                        cost=real_cost,
-                        electricity_rate=avg_rate
-                    )
-                    db.session.add(new_log)
-                    db.session.flush()  # 取得 log_id 但不 commit
-                    
+                    if not isinstance(record, dict):
+                        raise ValueError("記錄格式錯誤")
+                    entry = _parse_batch_record(record, devices)
+                    entry["index"] = idx
+                    parsed.append(entry)
+                except Exception as record_error:
                     results.append({
                         "index": idx,
-                        "success": True,
-                        "log_id": new_log.log_id,
-                        "device_id": device_id,
-                        "kwh": kwh,
-                        "cost": real_cost,
-                        "date": log_date.strftime("%Y-%m-%d")
+                        "success": False,
+                        "error": str(record_error)
                     })
+                    failure_count += 1
+            
+            # 已處理過的 idempotency_key：直接沿用原始結果，不再計價或寫入
+            replays = find_replays(e["idempotency_key"] for e in parsed)
+            replayed_results = []
+            first_by_key = {}
+            pending = []
+            for entry in parsed:
+                idem_key = entry["idempotency_key"]
+                if idem_key in replays:
+                    replayed_results.append(dict(replays[idem_key], index=entry["index"], replayed=True))
                     success_count += 1
-                    
-                except Exception as record_error:
+                elif idem_key and idem_key in first_by_key:
+                    # 同一批重複的 key：沿用第一筆的結果
+                    replayed_results.append({"index": entry["index"], "replay_of": first_by_key[idem_key]})
+                    success_count += 1
+                else:
+                    if idem_key:
+                        first_by_key[idem_key] = entry["index"]
+                    pending.append(entry)
+            
+            # 找出資料庫中已存在的 (device_id, log_date)，避免違反 uk_device_date
+            existing_keys = _find_existing_keys(pending)
+            
+            seen_keys = set()
+            for entry in pending:
+                key = (entry["device_id"], entry["log_date"])
+                if key in existing_keys or key in seen_keys:
                     results.append({
-                        "index": idx,
+                        "index": entry["index"],
                         "success": False,
-                        "error": str(record_error)
+                        "error": f"設備 {entry['device_id']} 在 {entry['log_date']} 已有用電紀錄"
                     })
                     failure_count += 1
+                    continue
+                seen_keys.add(key)
+                entries.append(entry)
+                success_count += 1
             
             # 如果有任何失敗，回滾所有變更
             if failure_count > 0:
@@ -936,12 +1404,43 @@ def add_usage_batch():
                     "msg": f"批次處理失敗，已回滾所有變更。成功: {success_count}, 失敗: {failure_count}",
                     "success_count": 0,
                     "failure_count": len(records),
-                    "results": results
+                    "results": sorted(results, key=lambda r: r["index"])
                 }), 400
             
+            # 2. 依序計算累進電費（所有月份基準只查一次）
+            price_entries_in_order(entries)
+            
+            # 3. 單一 executemany 寫入，並重新計價同月之後的紀錄
+            log_ids = _insert_priced_entries(entries)
+            _reprice_inserted(entries, log_ids)
+            
+            results = [
+                {
+                    "index": e["index"],
+                    "success": True,
+                    "log_id": log_ids.get((e["device_id"], e["log_date"])),
+                    "device_id": e["device_id"],
+                    "kwh": e["kwh"],
+                    "cost": e["cost"],
+                    "date": e["log_date"].strftime("%Y-%m-%d")
+                }
+                for e in entries
+            ]
+            remember_results(
+                (e["idempotency_key"], r["log_id"], r) for e, r in zip(entries, results)
+            )
+            
             # 全部成功才 commit
             db.session.commit()
             
+            # 補上重送資料的結果，依原始順序回傳
+            by_index = {r["index"]: r for r in results}
+            for replayed in replayed_results:
+                if "replay_of" in replayed:
+                    replayed.update(by_index[replayed.pop("replay_of")], index=replayed["index"], replayed=True)
+                results.append(replayed)
+            results.sort(key=lambda r: r["index"])
+            
             return jsonify({
                 "ok": True,
                 "msg": f"批次處理完成",
@@ -961,3 +1460,233 @@ def add_usage_batch():
             
     except Exception as e:
         return jsonify({"ok": False, "msg": f"請求格式錯誤: {str(e)}"}), 400
+
+
+@bp.route("/forecast", methods=["GET"])
+def forecast_usage():
+    """
+    預測月底用電量與累進電費
+    
+    URL: GET /usage/forecast?month=2025-06&lookback_days=28&device_limit=20
+    
+    參數：
+    - month: 月份 (YYYY-MM)，預設本月
+    - lookback_days: 以近幾天的用電計算日平均（1-90，預設 28）
+    - device_limit: 回傳預測用電最高的前幾個設備（預設 20）
+    
+    回傳：
+    - month_to_date / projected: 當月累積與預測的度數、電費
+    - tiers: 各級距上限是否已超過（crossed_on）或預計超過的日期（projected_crossing）
+    - devices: 各設備的當月累積、日平均與預測度數
+    
+    資料來源為彙總表，計算方式見 usage_forecast.py
+    """
+    try:
+        month = resolve_period("month", request.args.get("month") or date.today())
+        lookback_days = request.args.get("lookback_days", 28, type=int)
+        device_limit = request.args.get("device_limit", 20, type=int)
+        if not 1 <= lookback_days <= 90:
+            raise ValueError("lookback_days 必須介於 1 到 90")
+        if device_limit < 0:
+            raise ValueError("device_limit 不可為負數")
+    except ValueError as ve:
+        return jsonify({"ok": False, "msg": str(ve)}), 400
+    
+    result = forecast_month(month, date.today(), lookback_days, device_limit)
+    return jsonify(dict(result, ok=True))
+
+
+@bp.route("/anomalies", methods=["GET"])
+def get_usage_anomalies():
+    """
+    偵測設備用電異常（依設備歷史基準的 robust z-score）
+    
+    URL: GET /usage/anomalies?start_date=2025-06-01&end_date=2025-06-07
+    
+    參數：
+    - start_date / end_date: 評分區間，預設為昨天往前 7 天
+    - baseline_days: 基準天數（評分區間之前，7-365，預設 56）
+    - by_weekday: 是否依星期幾分別計算基準（預設 true）
+    - threshold: |z| 門檻（預設 3.5）
+    - incremental: true 時沿用快取的基準，只評分上次評分之後的日期
+    
+    計算方式見 usage_anomaly.py
+    """
+    try:
+        end_str = request.args.get("end_date")
+        start_str = request.args.get("start_date")
+        end_date = resolve_period("day", end_str).start if end_str else date.today() - timedelta(days=1)
+        start_date = resolve_period("day", start_str).start if start_str else end_date - timedelta(days=6)
+        if start_date > end_date:
+            raise ValueError("start_date 不可晚於 end_date")
+        baseline_days = request.args.get("baseline_days", 56, type=int)
+        if not 7 <= baseline_days <= 365:
+            raise ValueError("baseline_days 必須介於 7 到 365")
+        threshold = request.args.get("threshold", 3.5, type=float)
+        if threshold <= 0:
+            raise ValueError("threshold 必須大於 0")
+        by_weekday = request.args.get("by_weekday", "true").lower() != "false"
+        incremental = request.args.get("incremental", "false").lower() == "true"
+    except ValueError as ve:
+        return jsonify({"ok": False, "msg": str(ve)}), 400
+    
+    result = detect_anomalies(start_date, end_date, baseline_days, by_weekday, threshold, incremental)
+    return jsonify(dict(result, ok=True))
+
+
+@bp.route("/price", methods=["POST"])
+def price_usage():
+    """
+    批次試算累進電費（what-if 計價，不寫入資料庫）
+    
+    URL: POST /usage/price
+    
+    Request Body (JSON):
+    {
+        "date": "2025-07-01",          // 可選，用來判斷夏月/非夏月，預設今天
+        "season": "summer",            // 可選，直接指定 summer / non_summer（優先於 date）
+        "kwh": [100, 250.5, 800],      // 可選，當月累積度數 → 累積電費
+        "ranges": [[300, 350], [0, 120]]  // 可選，[from, to] → 邊際電費
+    }
+    
+    回傳：
+    - bills: 與 kwh 對應的累積電費
+    - marginal_costs: 與 ranges 對應的邊際電費
+    """
+    data = request.get_json(silent=True) or {}
+    
+    try:
+        season = data.get("season")
+        if season is None:
+            usage_date = data.get("date", str(date.today()))
+            if not isinstance(usage_date, str):
+                raise ValueError("date 必須是 YYYY-MM-DD 字串")
+            season = season_of(usage_date)
+        elif season not in TAIPOWER_RATES:
+            raise ValueError("season 必須是 summer 或 non_summer")
+        
+        kwh_list = data.get("kwh", [])
+        ranges = data.get("ranges", [])
+        if not isinstance(kwh_list, list) or not isinstance(ranges, list):
+            raise ValueError("kwh 與 ranges 必須是陣列")
+        if not kwh_list and not ranges:
+            raise ValueError("請提供 kwh 或 ranges")
+        
+        kwh_array = np.asarray(kwh_list, dtype=float)
+        range_array = np.asarray(ranges, dtype=float).reshape(-1, 2)
+        # JSON 解析允許 NaN / Infinity，須擋下，否則回應不是合法 JSON
+        if not (np.isfinite(kwh_array).all() and np.isfinite(range_array).all()):
+            raise ValueError("度數必須是有限數值")
+        if (kwh_array < 0).any() or (range_array < 0).any():
+            raise ValueError("度數不可為負")
+        if (range_array[:, 0] > range_array[:, 1]).any():
+            raise ValueError("ranges 的 from 不可大於 to")
+    except (TypeError, ValueError) as e:
+        return jsonify({"ok": False, "msg": f"請求格式錯誤: {str(e)}"}), 400
+    
+    bills = np.round(price_cumulative(kwh_array, season), 2)
+    marginal_costs = np.round(marginal_cost(range_array[:, 0], range_array[:, 1], season), 2)
+    
+    return jsonify({
+        "ok": True,
+        "season": season,
+        "bills": bills.tolist(),
+        "marginal_costs": marginal_costs.tolist()
+    })
+
+
+@bp.route("/ingest/status", methods=["GET"])
+def ingest_status():
+    """
+    查看非同步寫入佇列狀態
+    
+    URL: GET /usage/ingest/status
+    
+    回傳：queue_depth（佇列深度）、oldest_pending_ms / last_flush_lag_ms（寫入延遲）等
+    """
+    if INGEST_QUEUE is None:
+        return jsonify({"ok": True, "running": False, "queue_depth": 0})
+    return jsonify(dict(INGEST_QUEUE.stats(), ok=True))
+
+
+@bp.route("/ingest/<ingestion_id>", methods=["GET"])
+def ingest_result(ingestion_id):
+    """
+    查詢非同步寫入的處理結果
+    
+    URL: GET /usage/ingest/<ingestion_id>
+    
+    回傳 status: queued / written / failed（written 時含 log_id 與 cost）
+    """
+    result = INGEST_QUEUE.get_result(ingestion_id) if INGEST_QUEUE else None
+    if result is None:
+        return jsonify({"ok": False, "msg": f"找不到 ingestion_id: {ingestion_id}"}), 404
+    return jsonify(dict(result, ok=True, ingestion_id=ingestion_id))
+
+
+@bp.route("/cache/stats", methods=["GET"])
+def period_cache_stats():
+    """
+    已結束期間統計快取的狀態
+    
+    URL: GET /usage/cache/stats
+    """
+    return jsonify(dict(PERIOD_CACHE.stats(), ok=True))
+
+
+# ==========================================
+# CLI 指令
+# ==========================================
+
+@bp.cli.command("rebuild-rollups")
+def rebuild_rollups_command():
+    """從 power_logs 重新產生用電彙總表（flask usage rebuild-rollups）"""
+    stats = rebuild_rollups()
+    db.session.commit()
+    print(f"Rebuilt rollups: {stats['daily_rows']} daily rows, {stats['monthly_rows']} monthly rows")
+
+
+@bp.cli.command("reprice")
+def reprice_command():
+    """依 (日期, log_id) 順序重新計價所有月份的 power_logs（flask usage reprice）"""
+    stats = reprice_all()
+    db.session.commit()
+    print(f"Repriced {stats['months']} months, {stats['updated']} logs updated")
+
+
+@bp.cli.command("explain")
+def explain_command():
+    """檢查各用電查詢是否使用索引，有整表掃描時以非 0 結束（flask usage explain）"""
+    results = run_plan_checks()
+    for result in results:
+        status = "OK  " if result["uses_index"] else "FAIL"
+        print(f"[{status}] {result['name']}")
+        for line in result["plan"]:
+            print(f"         {line}")
+    failed = [r["name"] for r in results if not r["uses_index"]]
+    if failed:
+        print(f"{len(failed)} queries without index access: {', '.join(failed)}")
+        raise SystemExit(1)
+    print(f"All {len(results)} queries use index access")
+
+
+@bp.cli.command("detect-anomalies")
+@click.option("--days", default=1, show_default=True, help="評分最近幾天（到昨天為止）")
+@click.option("--incremental", is_flag=True, help="沿用快取的基準，只評分新的日期")
+def detect_anomalies_command(days, incremental):
+    """偵測設備用電異常（flask usage detect-anomalies）"""
+    end_date = date.today() - timedelta(days=1)
+    result = detect_anomalies(end_date - timedelta(days=days - 1), end_date, incremental=incremental)
+    print(f"Scored {result['scored_count']} device-days ({result['start']} ~ {result['end']}), "
+          f"{result['anomaly_count']} anomalies")
+    for anomaly in result["anomalies"]:
+        print(f"  {anomaly['date']} {anomaly['device_name']}: {anomaly['kwh']} kWh "
+              f"(baseline {anomaly['baseline_kwh']}, z={anomaly['score']})")
+
+
+@bp.cli.command("purge-idempotency")
+def purge_idempotency_command():
+    """清除過期的 idempotency_key 去重紀錄（flask usage purge-idempotency）"""
+    deleted = purge_expired()
+    db.session.commit()
+    print(f"Purged {deleted} expired idempotency keys")
@@ -1,41 +1,43 @@
 # feature_device_control.py
 # ==========================================
 # 電器控制功能 (Database Version)：
-# - GET   /device/state   從資料庫取得所有電器開關狀態
-# - PATCH /device/toggle  更新資料庫中的電器開關狀態
+# - GET   /device/state   取得所有電器開關狀態（由行程內的狀態快取回答，見 device_state.py）
+# - PATCH /device/toggle  更新資料庫中的電器開關狀態（預設只回傳被切換的設備）
+# - PATCH /device/toggle/bulk  一次切換多個設備（同一個交易、一個多列 upsert）
+# - PATCH /device/group/<location>  控制同一位置（可再依類型篩選）的所有設備：開關 / 模式 / 目標溫度
 # - GET   /device/list    取得所有設備列表（含詳細資訊、狀態）
 # - POST  /device/add     新增設備
-# - DELETE /device/remove/<device_id>  刪除設備
+# - POST  /device/bulk_add  一次新增多個設備（同一個交易、批次配置 ID 與多列 INSERT）
+# - DELETE /device/remove/<device_id>  刪除設備（立即軟刪除，歷史資料由背景分批清除，回傳 job_id）
+# - GET   /device/remove/jobs[/<job_id>]  刪除工作的清除進度
+# - flask device purge-deleted  清除所有已軟刪除設備的歷史資料（前景執行到完成）
 # ==========================================
 
-from flask import Blueprint, request, jsonify
-from models import db, Device, DeviceStatus
-from sqlalchemy import exc as sa_exc, text
+from flask import Blueprint, request, jsonify, current_app
+from models import db, User, Device, DeviceStatus
+from sqlalchemy import exc as sa_exc, or_
+from event_bus import EVENT_BUS
+from device_ids import insert_devices
+from device_state import (
+    DEVICE_STATE_CACHE, DEFAULT_STATUS, find_group_devices, load_device_rows, mark_devices_changed,
+    upsert_device_status
+)
+from device_purge import DEVICE_PURGER, soft_delete_device
+from app_metrics import get_logger
 
 # 建立 Blueprint 物件 (只要定義一次就好)
 bp = Blueprint("device", __name__)
+log = get_logger("device")
+
+BULK_TOGGLE_MAX = 5000      # /toggle/bulk 一次最多幾個設備
+BULK_ADD_MAX = 5000         # /bulk_add 一次最多幾個設備
+LOOKUP_CHUNK_SIZE = 500     # IN (...) 查詢每次最多幾個值
+DEVICE_TYPES = ("air_conditioner", "light")
+STATUS_MODES = ("cool", "heat", "dry", "auto")
 
 def _get_all_device_states():
-    """輔助函數：從資料庫取得所有電器狀態（內部使用）"""
-    # 1. 查詢所有啟用中的裝置 (WHERE is_active = True)
-    devices = Device.query.filter_by(is_active=True).all()
-    
-    # 2. 整理成前端需要的格式 { "設備名稱": True/False }
-    states = {}
-    for d in devices:
-        # 透過 relationship 取得 status，如果沒資料預設為 False
-        try:
-            is_on = d.status.is_on if d.status else False
-        except sa_exc.OperationalError as oe:
-            # 若資料庫缺少欄位 (例如 current_temperature 等)，記錄錯誤並使用預設值
-            print(f"[get_all_device_states] DB operational error when loading status for device {d.device_id}: {oe}")
-            is_on = False
-        except Exception as e:
-            print(f"[get_all_device_states] Unexpected error when loading status for device {d.device_id}: {e}")
-            is_on = False
-        states[d.device_name] = is_on
-    
-    return states
+    """輔助函數：取得所有啟用中電器的開關狀態 { "設備名稱": True/False }（由 DEVICE_STATE_CACHE 回答）"""
+    return DEVICE_STATE_CACHE.states()
 
 @bp.get("/state")
 def get_state():
@@ -44,13 +46,23 @@ def get_state():
         states = _get_all_device_states()
         return jsonify({"ok": True, "state": states})
         
-    except Exception as e:
-        print(f"Error fetching state: {e}")
+    except Exception:
+        log.exception("Error fetching state")
         return jsonify({"ok": False, "msg": "Database error"}), 500
 
+def _wants_full_state(data):
+    """請求是否要求一併回傳所有設備狀態（body 的 include_state 或 ?include_state=1）"""
+    flag = data.get("include_state", request.args.get("include_state"))
+    return flag is True or str(flag).lower() in ("1", "true")
+
 @bp.patch("/toggle")
 def toggle_device():
-    """更新資料庫中的電器開關狀態"""
+    """
+    更新資料庫中的電器開關狀態
+    
+    一次查詢設備 + 一個 upsert 寫入狀態；預設只回傳被切換的設備，
+    帶 "include_state": true 時才回傳所有設備狀態
+    """
     data = request.get_json(silent=True) or {}
     # 支援傳入 device_id（較穩定）或 device_name（向後相容）
     device_id = data.get("device_id")
@@ -62,144 +74,228 @@ def toggle_device():
         return jsonify({"ok": False, "msg": "Invalid input: require 'on' (bool) and 'device_id' or 'name'"}), 400
 
     try:
-        print(f"[toggle_device] payload: {data}")
-        # 1. 根據 device_id 或 name 搜尋裝置（優先使用 id）
+        # 1. 根據 device_id 或 name 搜尋裝置（優先使用 id，只讀取需要的欄位）
+        query = db.session.query(Device.device_id, Device.device_name).filter(Device.deleted_at.is_(None))
         if device_id is not None:
             try:
                 device_id = int(device_id)
             except Exception:
                 return jsonify({"ok": False, "msg": "Invalid device_id"}), 400
-            target_device = Device.query.get(device_id)
+            target_device = query.filter(Device.device_id == device_id).first()
         else:
-            target_device = Device.query.filter_by(device_name=name).first()
-        print(f"[toggle_device] target_device: {getattr(target_device, 'device_id', None)} / {getattr(target_device, 'device_name', None)}")
+            target_device = query.filter(Device.device_name == name).first()
         if not target_device:
             key = f"id {device_id}" if device_id is not None else f"name '{name}'"
             return jsonify({"ok": False, "msg": f"Device {key} not found"}), 404
         
-        # 2. 使用原生 SQL 安全地取得或建立狀態紀錄 (避免 ORM 在映射時因缺少欄位而失敗)
-        status_table_issue = False
-        created_new = False
-        fresh_is_on = False
+        # 2. 以一個 upsert 更新或建立狀態紀錄
+        toggled_info = {"device_id": target_device.device_id, "device_name": target_device.device_name, "is_on": on}
         try:
-            # 直接查 is_on 欄位（若欄位存在於資料表）
-            pre = db.session.execute(text("SELECT * FROM device_status WHERE device_id = :id"), {"id": target_device.device_id}).fetchall()
-            print(f"[toggle_device] pre-update device_status rows: {pre}")
-            sel = db.session.execute(
-                text("SELECT is_on FROM device_status WHERE device_id = :id"),
-                {"id": target_device.device_id}
-            ).fetchone()
-            if sel is None:
-                # 無紀錄 -> 新增一筆
-                db.session.execute(
-                    text("INSERT INTO device_status (device_id, is_on) VALUES (:id, :on)"),
-                    {"id": target_device.device_id, "on": bool(on)}
-                )
-                created_new = True
-            else:
-                # 更新現有紀錄
-                db.session.execute(
-                    text("UPDATE device_status SET is_on = :on WHERE device_id = :id"),
-                    {"on": bool(on), "id": target_device.device_id}
-                )
-
+            upsert_device_status([{"device_id": target_device.device_id, "is_on": on}])
             db.session.commit()
-
-            # 再次讀取最新值
-            sel2 = db.session.execute(
-                text("SELECT is_on FROM device_status WHERE device_id = :id"),
-                {"id": target_device.device_id}
-            ).fetchone()
-            post = db.session.execute(text("SELECT * FROM device_status WHERE device_id = :id"), {"id": target_device.device_id}).fetchall()
-            print(f"[toggle_device] post-update device_status rows: {post}")
-            fresh_is_on = bool(sel2[0]) if sel2 is not None else False
-
         except sa_exc.OperationalError as oe:
-            # 若直接 SQL 執行也發生 OperationalError，記錄並標示
-            print(f"[toggle_device] OperationalError when touching device_status for device {target_device.device_id}: {oe}")
-            db.session.rollback()
-            status_table_issue = True
-            fresh_is_on = False
-        except Exception as e:
-            print(f"[toggle_device] Unexpected error when touching device_status: {e}")
+            # 資料表結構不符（缺少欄位等），記錄並標示
+            log.warning("OperationalError when touching device_status for device %s: %s", target_device.device_id, oe)
             db.session.rollback()
-            return jsonify({"ok": False, "msg": str(e)}), 500
-
-        # 3. 回傳最新狀態並增加被切換的裝置資訊
-        states = _get_all_device_states()
-        toggled_info = {"device_id": target_device.device_id, "device_name": target_device.device_name, "is_on": fresh_is_on, "created_new_status": created_new}
-        if status_table_issue:
+            toggled_info["is_on"] = False
             toggled_info["status_table_issue"] = True
-        print(f"[toggle_device] toggled: {toggled_info}")
-        return jsonify({"ok": True, "state": states, "toggled": toggled_info})
+
+        # 3. 回傳被切換的裝置資訊（要求時才附上所有設備狀態）
+        resp = {"ok": True, "toggled": toggled_info}
+        if _wants_full_state(data):
+            resp["state"] = _get_all_device_states()
+        return jsonify(resp)
         
     except Exception as e:
         db.session.rollback() # 發生錯誤時回滾，避免資料庫鎖死
-        print(f"Error toggling device: {e}")
+        log.exception("Error toggling device")
+        return jsonify({"ok": False, "msg": str(e)}), 500
+
+@bp.patch("/toggle/bulk")
+def toggle_devices_bulk():
+    """
+    一次切換多個設備（同一個交易）
+    
+    請求體（兩種格式擇一）：
+    - {"devices": [{"device_id": 1, "on": false}, {"name": "客廳冷氣", "on": true}, ...]}
+    - {"device_ids": [1, 2, 3], "on": false}
+    可加 "include_state": true 一併回傳所有設備狀態
+    
+    一次查詢所有設備 + 一個多列 upsert + 一次 commit；
+    找不到的設備列在 results 中（ok: false），不影響其他設備
+    """
+    data = request.get_json(silent=True) or {}
+    items = data.get("devices")
+    if items is None and isinstance(data.get("device_ids"), list):
+        items = [{"device_id": device_id, "on": data.get("on")} for device_id in data["device_ids"]]
+    if not isinstance(items, list) or not items:
+        return jsonify({"ok": False, "msg": "Invalid input: require 'devices' list or 'device_ids' + 'on'"}), 400
+    if len(items) > BULK_TOGGLE_MAX:
+        return jsonify({"ok": False, "msg": f"Too many devices (max {BULK_TOGGLE_MAX})"}), 400
+
+    # 1. 驗證每一筆
+    targets = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict) or not isinstance(item.get("on"), bool):
+            return jsonify({"ok": False, "msg": f"devices[{index}]: require 'on' (bool)"}), 400
+        if item.get("device_id") is not None:
+            try:
+                targets.append(("id", int(item["device_id"]), item["on"]))
+            except (TypeError, ValueError):
+                return jsonify({"ok": False, "msg": f"devices[{index}]: invalid device_id"}), 400
+        elif item.get("name"):
+            targets.append(("name", item["name"], item["on"]))
+        else:
+            return jsonify({"ok": False, "msg": f"devices[{index}]: require 'device_id' or 'name'"}), 400
+
+    try:
+        # 2. 一次查詢所有指定的設備
+        ids = {key for kind, key, _ in targets if kind == "id"}
+        names = {key for kind, key, _ in targets if kind == "name"}
+        conditions = []
+        if ids:
+            conditions.append(Device.device_id.in_(ids))
+        if names:
+            conditions.append(Device.device_name.in_(names))
+        found = db.session.query(Device.device_id, Device.device_name).filter(
+            or_(*conditions), Device.deleted_at.is_(None)
+        ).all()
+        by_id = {d.device_id: d for d in found}
+        by_name = {d.device_name: d for d in found}
+
+        # 3. 同一設備出現多次時以最後一筆為準
+        results = []
+        desired = {}
+        for kind, key, on in targets:
+            device = by_id.get(key) if kind == "id" else by_name.get(key)
+            if device is None:
+                if kind == "id":
+                    results.append({"ok": False, "device_id": key, "msg": f"Device id {key} not found"})
+                else:
+                    results.append({"ok": False, "name": key, "msg": f"Device name '{key}' not found"})
+                continue
+            desired[device.device_id] = on
+            results.append({"ok": True, "device_id": device.device_id, "device_name": device.device_name, "is_on": on})
+
+        # 4. 一個多列 upsert + 一次 commit
+        upsert_device_status([{"device_id": device_id, "is_on": on} for device_id, on in desired.items()])
+        db.session.commit()
+
+        resp = {
+            "ok": True,
+            "updated": len(desired),
+            "not_found": sum(1 for r in results if not r["ok"]),
+            "results": results
+        }
+        if _wants_full_state(data):
+            resp["state"] = _get_all_device_states()
+        return jsonify(resp)
+
+    except Exception as e:
+        db.session.rollback()
+        log.exception("Error bulk toggling devices")
+        return jsonify({"ok": False, "msg": str(e)}), 500
+
+def _group_fields(data):
+    """
+    驗證 /group 要寫入的狀態欄位
+
+    Returns:
+        dict: {"is_on": ..., "mode": ..., "target_temperature": ...}（只含有提供的欄位）
+    Raises:
+        ValueError: 欄位錯誤
+    """
+    fields = {}
+    if "on" in data:
+        if not isinstance(data["on"], bool):
+            raise ValueError("Invalid on: must be bool")
+        fields["is_on"] = data["on"]
+    if "mode" in data:
+        if data["mode"] not in STATUS_MODES:
+            raise ValueError(f"Invalid mode. Must be one of {', '.join(STATUS_MODES)}")
+        fields["mode"] = data["mode"]
+    if "target_temperature" in data:
+        target = _optional_number(data, "target_temperature")
+        if target is None or abs(target) >= 100:
+            raise ValueError("Invalid target_temperature")
+        fields["target_temperature"] = target
+    if not fields:
+        raise ValueError("Require at least one of 'on', 'mode', 'target_temperature'")
+    return fields
+
+@bp.patch("/group/<location>")
+def control_device_group(location):
+    """
+    控制同一位置的一組設備（例如下班時關閉整層樓）
+
+    請求體：{"on": false, "mode": "cool", "target_temperature": 26, "device_type": "air_conditioner"}
+    - on / mode / target_temperature 至少提供一項
+    - device_type 可為字串或列表（也可用 ?type=air_conditioner），不指定表示所有類型
+    - 只控制啟用中的設備；可加 "include_state": true 一併回傳所有設備狀態
+
+    一次查詢設備（idx_location_type_active）+ 一個多列 upsert
+    （同時更新既有狀態並補建缺少的狀態列）+ 一次 commit
+    """
+    data = request.get_json(silent=True) or {}
+    device_types = data.get("device_type", request.args.getlist("type") or None)
+    if isinstance(device_types, str):
+        device_types = [device_types]
+    try:
+        fields = _group_fields(data)
+        if device_types is not None and (
+            not isinstance(device_types, list) or any(t not in DEVICE_TYPES for t in device_types)
+        ):
+            raise ValueError("Invalid device_type. Must be 'air_conditioner' or 'light'")
+    except ValueError as ve:
+        return jsonify({"ok": False, "msg": str(ve)}), 400
+
+    try:
+        devices = find_group_devices(location, device_types)
+        if not devices:
+            return jsonify({"ok": False, "msg": f"No active devices at location '{location}'"}), 404
+
+        upsert_device_status([dict(fields, device_id=device_id) for device_id, _ in devices])
+        db.session.commit()
+
+        resp = {
+            "ok": True,
+            "location": location,
+            "device_types": device_types,
+            "applied": fields,
+            "updated": len(devices),
+            "device_ids": [device_id for device_id, _ in devices]
+        }
+        if _wants_full_state(data):
+            resp["state"] = _get_all_device_states()
+        return jsonify(resp)
+
+    except Exception as e:
+        db.session.rollback()
+        log.exception("Error controlling device group '%s'", location)
         return jsonify({"ok": False, "msg": str(e)}), 500
 
 @bp.get("/list")
 def get_device_list():
-    """取得所有設備列表（含詳細資訊、狀態）"""
+    """取得所有設備列表（含詳細資訊、狀態），設備與狀態以一個 JOIN 查詢讀取"""
     try:
         # 查詢所有設備（包含已停用的）
-        print("[device_list] fetching devices from DB...")
-        devices = Device.query.all()
-        print(f"[device_list] fetched {len(devices)} devices")
-        status_load_error = False
+        rows, status_load_error = load_device_rows()
         
         # 整理成詳細資訊列表
-        device_list = []
-        for d in devices:
-            # 取得狀態資訊
-            status_info = None
-            try:
-                if d.status:
-                    status_info = {
-                        "is_on": d.status.is_on,
-                        "current_temperature": float(d.status.current_temperature) if d.status.current_temperature else None,
-                        "target_temperature": float(d.status.target_temperature) if d.status.target_temperature else None,
-                        "mode": d.status.mode
-                    }
-                else:
-                    # 如果沒有狀態記錄，使用預設值
-                    status_info = {
-                        "is_on": False,
-                        "current_temperature": None,
-                        "target_temperature": None,
-                        "mode": None
-                    }
-            except sa_exc.OperationalError as oe:
-                # 發生資料庫操作錯誤（例如欄位不存在），回退為預設狀態但不要中斷整個清單
-                print(f"[get_device_list] OperationalError when loading status for device {d.device_id}: {oe}")
-                status_load_error = True
-                status_info = {
-                    "is_on": False,
-                    "current_temperature": None,
-                    "target_temperature": None,
-                    "mode": None
-                }
-            except Exception as e:
-                print(f"[get_device_list] Unexpected error when loading status for device {d.device_id}: {e}")
-                status_info = {
-                    "is_on": False,
-                    "current_temperature": None,
-                    "target_temperature": None,
-                    "mode": None
-                }
-            
-            device_info = {
-                "device_id": d.device_id,
-                "device_name": d.device_name,
-                "device_type": d.device_type,
-                "model_number": d.model_number,
-                "location": d.location,
-                "rated_power": float(d.rated_power) if d.rated_power else None,
-                "is_active": d.is_active,
-                "user_id": d.user_id,
-                "status": status_info
+        device_list = [
+            {
+                "device_id": row["device_id"],
+                "device_name": row["device_name"],
+                "device_type": row["device_type"],
+                "model_number": row["model_number"],
+                "location": row["location"],
+                "rated_power": row["rated_power"],
+                "is_active": row["is_active"],
+                "user_id": row["user_id"],
+                "status": {key: row[key] for key in DEFAULT_STATUS}
             }
-            device_list.append(device_info)
+            for row in rows
+        ]
         
         resp = {"ok": True, "devices": device_list, "count": len(device_list)}
         if status_load_error:
@@ -210,7 +306,7 @@ def get_device_list():
     except Exception as e:
         import traceback
         tb = traceback.format_exc()
-        print(f"Error fetching device list: {e}\n{tb}")
+        log.exception("Error fetching device list")
         # 回傳詳細錯誤資訊以便前端偵錯（開發環境用）
         return jsonify({"ok": False, "msg": str(e), "trace": tb}), 500
 
@@ -238,59 +334,37 @@ def add_device():
         }), 400
     
     # 檢查設備名稱是否已存在
-    existing_device = Device.query.filter_by(device_name=device_name).first()
+    existing_device = Device.query.filter_by(device_name=device_name, deleted_at=None).first()
     if existing_device:
         return jsonify({
             "ok": False,
             "msg": f"Device with name '{device_name}' already exists"
         }), 409
     
+    # 檢查使用者是否存在（寫入時的完整性錯誤只有 device_id 衝突會重試）
+    if db.session.get(User, user_id) is None:
+        return jsonify({
+            "ok": False,
+            "msg": f"User {user_id} not found"
+        }), 404
+    
     try:
-        # 決定要分配的 device_id：使用最小可用的正整數（填補被刪除的 ID）
-        try:
-            existing = db.session.execute(text("SELECT device_id FROM devices ORDER BY device_id ASC")).fetchall()
-            existing_ids = [r[0] for r in existing]
-            next_id = 1
-            for eid in existing_ids:
-                if eid == next_id:
-                    next_id += 1
-                elif eid > next_id:
-                    break
-        except Exception as e:
-            print(f"[add_device] warning computing next_id: {e}")
-            # fallback to letting DB assign via autoincrement
-            next_id = None
-
-        # 建立新設備並指定 device_id（若成功計算到 next_id）
-        if next_id:
-            new_device = Device(
-                device_id=next_id,
-                user_id=user_id,
-                device_name=device_name,
-                device_type=device_type,
-                model_number=data.get("model_number"),
-                location=data.get("location"),
-                rated_power=data.get("rated_power"),
-                is_active=data.get("is_active", True)  # 預設為啟用
-            )
-        else:
-            new_device = Device(
-                user_id=user_id,
-                device_name=device_name,
-                device_type=device_type,
-                model_number=data.get("model_number"),
-                location=data.get("location"),
-                rated_power=data.get("rated_power"),
-                is_active=data.get("is_active", True)  # 預設為啟用
-            )
-
-        db.session.add(new_device)
-        db.session.flush()  # 取得 device_id (無論是指定或 autoincrement)
+        # 配置最小可用的 device_id（填補被刪除的 ID）並寫入，見 device_ids.py
+        row = {
+            "user_id": user_id,
+            "device_name": device_name,
+            "device_type": device_type,
+            "model_number": data.get("model_number"),
+            "location": data.get("location"),
+            "rated_power": data.get("rated_power"),
+            "is_active": data.get("is_active", True)  # 預設為啟用
+        }
+        device_id = insert_devices([row])[0]
         
         # 可選：如果提供了初始狀態，建立狀態記錄
         if data.get("create_status", False):
             initial_status = DeviceStatus(
-                device_id=new_device.device_id,
+                device_id=device_id,
                 is_on=data.get("initial_is_on", False),
                 current_temperature=data.get("initial_current_temperature"),
                 target_temperature=data.get("initial_target_temperature"),
@@ -298,56 +372,232 @@ def add_device():
             )
             db.session.add(initial_status)
         
+        mark_devices_changed(db.session)
         db.session.commit()
         
         # 回傳新建立的設備資訊
-        device_info = {
-            "device_id": new_device.device_id,
-            "device_name": new_device.device_name,
-            "device_type": new_device.device_type,
-            "model_number": new_device.model_number,
-            "location": new_device.location,
-            "rated_power": float(new_device.rated_power) if new_device.rated_power else None,
-            "is_active": new_device.is_active,
-            "user_id": new_device.user_id
-        }
+        device_info = dict(
+            row,
+            device_id=device_id,
+            rated_power=float(row["rated_power"]) if row["rated_power"] else None
+        )
         
+        EVENT_BUS.publish("device_added", device_info)
         return jsonify({"ok": True, "msg": "Device added successfully", "device": device_info}), 201
         
     except Exception as e:
         db.session.rollback()
-        print(f"Error adding device: {e}")
+        log.exception("Error adding device")
         return jsonify({"ok": False, "msg": str(e)}), 500
 
-@bp.delete("/remove/<int:device_id>")
-def remove_device(device_id):
-    """刪除設備"""
+def _existing_values(column, values, *criteria):
+    """分批以 IN 查詢哪些值已存在（criteria 為額外的篩選條件）"""
+    values = list(values)
+    found = set()
+    for i in range(0, len(values), LOOKUP_CHUNK_SIZE):
+        chunk = values[i:i + LOOKUP_CHUNK_SIZE]
+        found.update(r[0] for r in db.session.query(column).filter(column.in_(chunk), *criteria))
+    return found
+
+def _optional_number(spec, key):
+    """選填的數字欄位：沒有提供回傳 None，格式錯誤丟出 ValueError"""
+    value = spec.get(key)
+    if value is None or value == "":
+        return None
+    if isinstance(value, bool):
+        raise ValueError(f"Invalid {key}")
     try:
-        # 以純 SQL 方式處理，避免透過 ORM 觸發關聯讀取導致 schema mismatch
-        row = db.session.execute(text("SELECT device_name FROM devices WHERE device_id = :id"), {"id": device_id}).fetchone()
-        if not row:
-            return jsonify({"ok": False, "msg": f"Device with ID {device_id} not found"}), 404
-        device_name = row[0]
+        return float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid {key}")
 
-        # 刪除 device_status（如果存在）
-        try:
-            db.session.execute(text("DELETE FROM device_status WHERE device_id = :id"), {"id": device_id})
-        except Exception as e:
-            print(f"[remove_device] warning deleting device_status: {e}")
+def _validate_bulk_spec(spec):
+    """
+    驗證 /bulk_add 的單一設備（欄位與 /add 相同）
+    
+    Returns:
+        (device_row, status_row 或 None)
+    Raises:
+        ValueError: 欄位錯誤
+    """
+    if not isinstance(spec, dict):
+        raise ValueError("Device spec must be an object")
+    device_name = spec.get("device_name")
+    device_type = spec.get("device_type")
+    user_id = spec.get("user_id")
+    if not device_name or not device_type or not user_id:
+        raise ValueError("Missing required fields: device_name, device_type, user_id")
+    if not isinstance(device_name, str) or len(device_name) > 100:
+        raise ValueError("Invalid device_name")
+    if device_type not in DEVICE_TYPES:
+        raise ValueError("Invalid device_type. Must be 'air_conditioner' or 'light'")
+    try:
+        user_id = int(user_id)
+    except (TypeError, ValueError):
+        raise ValueError("Invalid user_id")
+
+    device_row = {
+        "user_id": user_id,
+        "device_name": device_name,
+        "device_type": device_type,
+        "model_number": spec.get("model_number"),
+        "location": spec.get("location"),
+        "rated_power": _optional_number(spec, "rated_power"),
+        "is_active": bool(spec.get("is_active", True))
+    }
+
+    status_row = None
+    if spec.get("create_status", False):
+        mode = spec.get("initial_mode")
+        if mode is not None and mode not in STATUS_MODES:
+            raise ValueError(f"Invalid initial_mode. Must be one of {', '.join(STATUS_MODES)}")
+        status_row = {
+            "is_on": bool(spec.get("initial_is_on", False)),
+            "current_temperature": _optional_number(spec, "initial_current_temperature"),
+            "target_temperature": _optional_number(spec, "initial_target_temperature"),
+            "mode": mode
+        }
+    return device_row, status_row
+
+@bp.post("/bulk_add")
+def bulk_add_devices():
+    """
+    一次新增多個設備
+    
+    請求體：{"devices": [{"device_name": ..., "device_type": ..., "user_id": ..., ...}, ...]}
+    每個設備的欄位與 /device/add 相同（含 create_status、initial_*）
+    
+    - 設備名稱（與資料庫及同一批次比對）、user_id 各以一次 IN 查詢檢查
+    - device_id 一次配置（見 device_ids.py），Device 與 DeviceStatus 各以一個多列 INSERT 寫入
+    - 全部在同一個交易中；不合格的設備不寫入，列在 results 中（ok: false）
+    """
+    data = request.get_json(silent=True) or {}
+    specs = data.get("devices")
+    if not isinstance(specs, list) or not specs:
+        return jsonify({"ok": False, "msg": "Invalid input: require 'devices' list"}), 400
+    if len(specs) > BULK_ADD_MAX:
+        return jsonify({"ok": False, "msg": f"Too many devices (max {BULK_ADD_MAX})"}), 400
 
-        # 刪除 power_logs（如果存在）
+    # 1. 逐筆驗證欄位
+    results = [None] * len(specs)
+    valid = []      # [(index, device_row, status_row)]
+    for index, spec in enumerate(specs):
         try:
-            db.session.execute(text("DELETE FROM power_logs WHERE device_id = :id"), {"id": device_id})
-        except Exception as e:
-            print(f"[remove_device] warning deleting power_logs: {e}")
+            device_row, status_row = _validate_bulk_spec(spec)
+            valid.append((index, device_row, status_row))
+        except ValueError as ve:
+            results[index] = {"index": index, "ok": False, "msg": str(ve)}
+
+    try:
+        # 2. 以集合查詢檢查名稱重複與使用者是否存在
+        existing_names = _existing_values(
+            Device.device_name, {row["device_name"] for _, row, _ in valid}, Device.deleted_at.is_(None)
+        )
+        existing_users = _existing_values(User.user_id, {row["user_id"] for _, row, _ in valid})
+        accepted = []
+        seen_names = set()
+        for index, device_row, status_row in valid:
+            name = device_row["device_name"]
+            if name in existing_names or name in seen_names:
+                results[index] = {"index": index, "ok": False, "device_name": name,
+                                  "msg": f"Device with name '{name}' already exists"}
+            elif device_row["user_id"] not in existing_users:
+                results[index] = {"index": index, "ok": False, "device_name": name,
+                                  "msg": f"User {device_row['user_id']} not found"}
+            else:
+                seen_names.add(name)
+                accepted.append((index, device_row, status_row))
+
+        if not accepted:
+            return jsonify({"ok": False, "msg": "No valid devices", "created": 0, "failed": len(specs),
+                            "results": results}), 400
 
-        # 刪除 devices
-        db.session.execute(text("DELETE FROM devices WHERE device_id = :id"), {"id": device_id})
+        # 3. 批次配置 ID 並寫入設備與狀態
+        device_ids = insert_devices([device_row for _, device_row, _ in accepted])
+        status_rows = [
+            dict(status_row, device_id=device_id)
+            for (_, _, status_row), device_id in zip(accepted, device_ids)
+            if status_row is not None
+        ]
+        if status_rows:
+            db.session.execute(DeviceStatus.__table__.insert(), status_rows)
+
+        mark_devices_changed(db.session)
         db.session.commit()
 
-        return jsonify({"ok": True, "msg": f"Device '{device_name}' (ID: {device_id}) deleted successfully"}), 200
+        for (index, device_row, _), device_id in zip(accepted, device_ids):
+            results[index] = {"index": index, "ok": True, "device_id": device_id,
+                              "device_name": device_row["device_name"]}
+
+        EVENT_BUS.publish("devices_bulk_added", {"count": len(device_ids), "device_ids": device_ids})
+        return jsonify({
+            "ok": True,
+            "created": len(device_ids),
+            "failed": len(specs) - len(device_ids),
+            "results": results
+        }), 201
+
+    except Exception as e:
+        db.session.rollback()
+        log.exception("Error bulk adding devices")
+        return jsonify({"ok": False, "msg": str(e)}), 500
 
+@bp.delete("/remove/<int:device_id>")
+def remove_device(device_id):
+    """
+    刪除設備
+    
+    立即軟刪除（設定 deleted_at、停用設備、從全戶彙總扣除用量），設備從列表、狀態、
+    用電查詢與模擬器中消失；歷史用電紀錄由背景執行緒分批清除（見 device_purge.py），
+    回傳 202 與 job_id，可由 GET /device/remove/jobs/<job_id> 查詢進度
+    """
+    try:
+        device_name = soft_delete_device(device_id)
+        if device_name is None:
+            db.session.rollback()
+            return jsonify({"ok": False, "msg": f"Device with ID {device_id} not found"}), 404
+        mark_devices_changed(db.session)
+        db.session.commit()
     except Exception as e:
         db.session.rollback()
-        print(f"Error deleting device: {e}")
+        log.exception("Error deleting device %s", device_id)
         return jsonify({"ok": False, "msg": str(e)}), 500
+
+    EVENT_BUS.publish("device_removed", {"device_id": device_id, "device_name": device_name})
+    job_id = _get_device_purger().submit(device_id, device_name)
+    return jsonify({
+        "ok": True,
+        "msg": f"Device '{device_name}' (ID: {device_id}) deleted; history is being purged in the background",
+        "job_id": job_id
+    }), 202
+
+def _get_device_purger():
+    """取得（必要時啟動）背景清除執行緒"""
+    config = current_app.config
+    DEVICE_PURGER.chunk_size = config.get("DEVICE_PURGE_CHUNK_SIZE", DEVICE_PURGER.chunk_size)
+    DEVICE_PURGER.pause_ms = config.get("DEVICE_PURGE_PAUSE_MS", DEVICE_PURGER.pause_ms)
+    DEVICE_PURGER.start(current_app._get_current_object())
+    return DEVICE_PURGER
+
+@bp.get("/remove/jobs")
+def list_remove_jobs():
+    """列出本行程中的刪除工作與進度（新的在前）"""
+    return jsonify({"ok": True, "jobs": DEVICE_PURGER.jobs()})
+
+@bp.get("/remove/jobs/<job_id>")
+def get_remove_job(job_id):
+    """查詢刪除工作進度"""
+    job = DEVICE_PURGER.get_job(job_id)
+    if job is None:
+        return jsonify({"ok": False, "msg": f"Job {job_id} not found"}), 404
+    return jsonify(dict(job, ok=True))
+
+@bp.cli.command("purge-deleted")
+def purge_deleted_command():
+    """清除所有已軟刪除設備的歷史資料（flask device purge-deleted，執行到完成為止）"""
+    purger = _get_device_purger()
+    purger.wait_until_empty()
+    for job in purger.jobs():
+        print(f"device {job['device_id']}: {job['status']}, "
+              f"{job['deleted_logs']} logs / {job['deleted_intervals']} intervals deleted"
+              + (f", error: {job['error']}" if job["error"] else ""))
@@ -0,0 +1,103 @@
+# feature_events.py
+# ==========================================
+# 功能6：即時事件推送（Server-Sent Events）
+# - GET /events          以 SSE 推送設備狀態與自動控制的變化，取代前端輪詢
+#                        重新連線時瀏覽器會帶 Last-Event-ID，伺服器補送錯過的事件
+#                        （也可用 ?last_event_id= 指定）
+# - GET /events/stats    訂閱者數量、已發布事件數等統計
+#
+# 事件類型（data 為 JSON）：
+# - device_state     設備狀態變更（/device/toggle、/device/toggle/bulk、/device/group、自動控制），
+#                    每個交易一個事件：{"devices": [{"device_id": 1, "is_on": true, ...}]}
+# - device_added     新增設備，內容同 /device/add 回傳的 device
+# - devices_bulk_added  /device/bulk_add 新增多個設備，{"count": 3, "device_ids": [...]}
+# - device_removed   刪除設備，{"device_id": 1, "device_name": "..."}
+# - auto_decision    自動溫度判斷結果（/auto/check 與背景監控）
+# - monitor_status   自動監控啟動 / 停止 / 設定變更
+# - reset            無法補送錯過的事件（或客戶端讀取太慢），請重新讀取完整狀態
+#
+# 每 EVENTS_HEARTBEAT_SECONDS 秒沒有事件時送出註解行（: heartbeat）保持連線
+# 事件來源見 event_bus.py（行程內 pub/sub）
+# ==========================================
+
+from flask import Blueprint, Response, current_app, jsonify, request
+from event_bus import EVENT_BUS
+import json
+
+bp = Blueprint("events", __name__)
+
+RETRY_MS = 3000             # 建議瀏覽器斷線後多久重新連線
+
+
+def format_event(event):
+    """轉成 SSE 格式"""
+    payload = json.dumps(dict(event["data"], event_time=event["time"]), ensure_ascii=False)
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {payload}\n\n"
+
+
+def _reset_event():
+    # reset 事件帶目前最新的 id，客戶端重新讀取完整狀態後從這裡繼續
+    return f"id: {EVENT_BUS.last_event_id}\nevent: reset\ndata: {{}}\n\n"
+
+
+def _parse_last_event_id():
+    raw = request.headers.get("Last-Event-ID") or request.args.get("last_event_id")
+    if raw is None or raw == "":
+        return None
+    try:
+        return int(raw)
+    except ValueError:
+        return -1   # 不認得的 id，視為需要 reset
+
+
+@bp.route("", methods=["GET"])
+def stream_events():
+    """SSE 事件串流"""
+    heartbeat = current_app.config.get("EVENTS_HEARTBEAT_SECONDS", 15)
+    buffer_size = current_app.config.get("EVENTS_CLIENT_BUFFER", 256)
+    last_event_id = _parse_last_event_id()
+    if EVENT_BUS.stats()["subscribers"] >= EVENT_BUS.max_subscribers:
+        return jsonify({"ok": False, "msg": "Too many event subscribers"}), 503
+
+    def generate():
+        # 在產生器內訂閱：回應在開始輸出前就被關閉（客戶端已斷線）時不會留下訂閱
+        subscription = None
+        try:
+            try:
+                subscription, replay, needs_reset = EVENT_BUS.subscribe(last_event_id, buffer_size)
+            except RuntimeError:
+                # 檢查之後名額才被佔滿：結束連線，瀏覽器會在 retry 毫秒後重新連線
+                yield f"retry: {RETRY_MS}\n\n"
+                return
+            yield f"retry: {RETRY_MS}\n\n"
+            if needs_reset:
+                yield _reset_event()
+            for event in replay:
+                yield format_event(event)
+
+            while True:
+                event = subscription.get(timeout=heartbeat)
+                if subscription.overflowed:
+                    # 客戶端跟不上：通知重新讀取完整狀態並結束連線（瀏覽器會自動重新連線）
+                    yield _reset_event()
+                    return
+                if event is None:
+                    yield ": heartbeat\n\n"
+                    continue
+                yield format_event(event)
+        finally:
+            if subscription is not None:
+                subscription.close()
+
+    # 產生器不使用 request / 資料庫，不需要 stream_with_context（長時間連線不佔用 app context）
+    return Response(
+        generate(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@bp.route("/stats", methods=["GET"])
+def event_stats():
+    """事件推送統計"""
+    return jsonify(dict(EVENT_BUS.stats(), ok=True))
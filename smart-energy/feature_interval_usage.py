@@ -0,0 +1,373 @@
+# feature_interval_usage.py
+# ==========================================
+# 功能5：區間（15 分鐘 / 1 小時）用電記錄
+# power_intervals 儲存電錶的區間讀數，每日 power_logs 由區間自動彙總產生
+# ==========================================
+# API 端點：
+# - POST /usage/intervals   批次寫入區間讀數
+#                       請求體: {"readings": [
+#                         {"device_id": 1, "start": "2025-06-01T10:15", "minutes": 15, "kwh": 0.42},
+#                         ...
+#                       ]}
+#                       同一設備同一區間（起點與長度相同）重送時以新值覆蓋；
+#                       與已儲存、長度不同的區間重疊時回傳 409，
+#                       帶 "replace_overlapping": true 則刪除重疊的舊區間後寫入
+#                       受影響日期的 power_logs 在同一交易內更新，同月之後的日紀錄依累進費率重新計價
+#
+#                       日紀錄與區間的關係：有區間讀數的 (設備, 日期)，power_logs 的度數
+#                       一律等於當日區間總和，取代原本 /usage/add 手動輸入的度數（不會相加）
+#
+# - GET  /usage/intervals   查詢區間用電
+#                       查詢參數: device_id (可選), start, end (YYYY-MM-DD 或 YYYY-MM-DDTHH:MM),
+#                                 resolution (auto/interval/hour/day，預設 auto)
+#                       auto 會選擇能回答查詢的最粗解析度：
+#                       - 範圍以整日對齊且 ≥ 2 天 → day（讀 power_logs）
+#                       - 範圍超過 1 天 → hour（區間依小時加總）
+#                       - 其餘 → interval（原始讀數）
+# ==========================================
+
+from flask import Blueprint, jsonify, request
+from models import db, Device, PowerLog, PowerInterval, not_deleted_device
+from datetime import datetime, date, time, timedelta
+from decimal import Decimal
+from sqlalchemy import tuple_
+from usage_rollup import apply_usage_deltas, lock_month_ledgers, month_start_of
+from usage_reprice import reprice_from
+from fixed_point import energy_units, energy_units_sql, energy_value
+from feature_daily_usage import price_entries_in_order, _insert_priced_entries
+
+bp = Blueprint("interval", __name__)
+
+INTERVAL_MINUTES = (15, 60)     # 支援的區間長度
+SLOT_MINUTES = 15               # 檢查重疊的最小時段
+MAX_READINGS = 20000            # 單次請求最多筆數
+MAX_CONFLICTS = 100             # 409 回應最多列出幾筆衝突
+
+
+def _parse_datetime(value):
+    """解析 YYYY-MM-DD 或 YYYY-MM-DDTHH:MM（也接受空白分隔）"""
+    for fmt in ("%Y-%m-%dT%H:%M", "%Y-%m-%d %H:%M", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(value, fmt)
+        except (TypeError, ValueError):
+            continue
+    raise ValueError(f"時間格式錯誤: {value}，應為 YYYY-MM-DD 或 YYYY-MM-DDTHH:MM")
+
+
+def _parse_reading(reading, device_ids):
+    """驗證單筆區間讀數，回傳 (device_id, interval_start, minutes, kwh)"""
+    if not isinstance(reading, dict):
+        raise ValueError("讀數格式錯誤")
+    device_id = reading.get("device_id")
+    if device_id not in device_ids:
+        raise ValueError(f"找不到設備 ID: {device_id}")
+
+    minutes = reading.get("minutes", 60)
+    if minutes not in INTERVAL_MINUTES:
+        raise ValueError(f"minutes 必須是 {INTERVAL_MINUTES} 其中之一")
+
+    start = _parse_datetime(reading.get("start"))
+    if start.second or start.microsecond or start.minute % minutes:
+        raise ValueError(f"start 必須對齊 {minutes} 分鐘區間")
+
+    kwh = reading.get("kwh")
+    if not isinstance(kwh, (int, float)) or kwh < 0:
+        raise ValueError("kwh 必須是非負數字")
+
+    return device_id, start, minutes, kwh
+
+
+def _slots(start, minutes):
+    """區間涵蓋的 15 分鐘時段起點"""
+    return [start + timedelta(minutes=m) for m in range(0, minutes, SLOT_MINUTES)]
+
+
+def _interval_day_totals(day_keys):
+    """
+    一次查出各 (設備, 日期) 的區間總和
+
+    Returns:
+        dict: {(device_id, log_date): 度數總和（整數單位）}
+    """
+    totals = dict.fromkeys(day_keys, 0)
+    if not totals:
+        return totals
+    days = [log_date for _, log_date in totals]
+    for device_id, interval_start, units in db.session.query(
+        PowerInterval.device_id, PowerInterval.interval_start, energy_units_sql(PowerInterval.energy_consumed)
+    ).filter(
+        PowerInterval.device_id.in_({device_id for device_id, _ in totals}),
+        PowerInterval.interval_start >= datetime.combine(min(days), time(0)),
+        PowerInterval.interval_start < datetime.combine(max(days) + timedelta(days=1), time(0))
+    ):
+        key = (device_id, interval_start.date())
+        if key in totals:
+            totals[key] += units
+    return totals
+
+
+def _sync_daily_logs(day_totals):
+    """
+    將區間總和同步到每日 power_logs（不 commit）
+
+    有區間讀數的 (設備, 日期)，日紀錄的度數一律等於當日區間總和，
+    原本以 /usage/add 手動輸入的度數會被取代（不會相加）。
+
+    Args:
+        day_totals: {(device_id, log_date): 當日區間總和（整數單位）}
+    """
+    if not day_totals:
+        return
+
+    keys = list(day_totals.keys())
+    # 同月的併發寫入依序處理（見 usage_rollup.lock_month_ledgers）
+    lock_month_ledgers(month_start_of(log_date) for _, log_date in keys)
+    existing = {
+        (log.device_id, log.log_date): log
+        for log in PowerLog.query.filter(
+            tuple_(PowerLog.device_id, PowerLog.log_date).in_(keys)
+        ).all()
+    }
+
+    # 新的日紀錄：依日期順序以累進費率計價後批次寫入
+    new_entries = [
+        {
+            "device_id": device_id,
+            "log_date": log_date,
+            "kwh": energy_value(units),
+            "power_watts": None,
+            "hours": None
+        }
+        for (device_id, log_date), units in sorted(day_totals.items(), key=lambda i: (i[0][1], i[0][0]))
+        if (device_id, log_date) not in existing and units
+    ]
+    price_entries_in_order(new_entries)
+    _insert_priced_entries(new_entries)
+
+    # 既有的日紀錄：度數改為區間總和，電費由下方的重新計價一併更新
+    changed_dates = [e["log_date"] for e in new_entries]
+    rollup_deltas = []
+    for key, log in existing.items():
+        delta_units = day_totals[key] - energy_units(log.energy_consumed)
+        if not delta_units:
+            continue
+        log.energy_consumed = Decimal(str(energy_value(day_totals[key])))
+        # 度數不再是「瓦數 × 時數」，清除手動輸入的計算依據
+        log.power_watts = None
+        log.hours = None
+        rollup_deltas.append((log.device_id, log.log_date, energy_value(delta_units), 0, 0))
+        changed_dates.append(log.log_date)
+    apply_usage_deltas(rollup_deltas)
+    db.session.flush()
+
+    # 受影響日期（含）之後的同月紀錄依累進費率重新計價
+    reprice_from(changed_dates)
+
+
+@bp.route("", methods=["POST"])
+def add_intervals():
+    """
+    批次寫入區間讀數，並同步更新每日 power_logs
+
+    URL: POST /usage/intervals
+
+    - 同一設備同一起點、同一長度的區間重送時以新值覆蓋
+    - 與同一批其他讀數重疊 → 400
+    - 與已儲存、長度不同的區間重疊 → 409（回傳 conflicts）；
+      請求體帶 "replace_overlapping": true 時改為刪除重疊的舊區間後寫入
+
+    回傳：
+    - inserted / updated / replaced: 新增、覆蓋的區間筆數與被取代而刪除的舊區間筆數
+    - days_affected: 受影響的 (設備, 日期) 數
+    """
+    data = request.get_json(silent=True) or {}
+    readings = data.get("readings")
+    if not isinstance(readings, list) or not readings:
+        return jsonify({"ok": False, "msg": "readings 必須是非空陣列"}), 400
+    if len(readings) > MAX_READINGS:
+        return jsonify({"ok": False, "msg": f"單次最多 {MAX_READINGS} 筆"}), 400
+
+    # 1. 驗證（設備只查一次）
+    requested_ids = {r.get("device_id") for r in readings if isinstance(r, dict)}
+    device_ids = {
+        row[0] for row in db.session.query(Device.device_id).filter(
+            Device.device_id.in_(requested_ids), Device.deleted_at.is_(None)
+        ).all()
+    } if requested_ids else set()
+
+    parsed = {}
+    slots = {}      # {(device_id, 15 分鐘時段起點): (device_id, 區間起點)}
+    errors = []
+    for idx, reading in enumerate(readings):
+        try:
+            device_id, start, minutes, kwh = _parse_reading(reading, device_ids)
+            key = (device_id, start)
+            if key in parsed and parsed[key][0] != minutes:
+                raise ValueError("與同一批中長度不同的讀數重疊")
+            for slot in _slots(start, minutes):
+                owner = slots.setdefault((device_id, slot), key)
+                if owner != key:
+                    raise ValueError(f"與同一批中 {owner[1]:%Y-%m-%d %H:%M} 開始的讀數重疊")
+            # 同一批重複的區間以最後一筆為準
+            parsed[key] = (minutes, kwh)
+        except ValueError as ve:
+            errors.append({"index": idx, "error": str(ve)})
+
+    if errors:
+        return jsonify({"ok": False, "msg": f"有 {len(errors)} 筆讀數格式錯誤，未寫入任何資料", "errors": errors}), 400
+
+    try:
+        # 2. 一次讀出時間範圍內已儲存的區間：相同區間覆蓋，長度不同而重疊的視為衝突
+        window_start = min(start for _, start in parsed) - timedelta(minutes=max(INTERVAL_MINUTES) - SLOT_MINUTES)
+        window_end = max(start + timedelta(minutes=minutes) for (_, start), (minutes, _) in parsed.items())
+        existing = {}
+        conflicts = []
+        for row in PowerInterval.query.filter(
+            PowerInterval.device_id.in_({device_id for device_id, _ in parsed}),
+            PowerInterval.interval_start >= window_start,
+            PowerInterval.interval_start < window_end
+        ).all():
+            key = (row.device_id, row.interval_start)
+            if key in parsed and parsed[key][0] == row.interval_minutes:
+                existing[key] = row
+            elif any((row.device_id, slot) in slots for slot in _slots(row.interval_start, row.interval_minutes)):
+                conflicts.append(row)
+
+        if conflicts and not data.get("replace_overlapping"):
+            db.session.rollback()
+            return jsonify({
+                "ok": False,
+                "msg": f"有 {len(conflicts)} 筆已儲存的區間與讀數重疊但長度不同，未寫入任何資料"
+                       "（帶 replace_overlapping: true 可取代）",
+                "conflicts": [row.to_dict() for row in conflicts[:MAX_CONFLICTS]]
+            }), 409
+        if conflicts:
+            db.session.execute(PowerInterval.__table__.delete().where(
+                PowerInterval.interval_id.in_([row.interval_id for row in conflicts])
+            ))
+            for row in conflicts:
+                db.session.expunge(row)
+
+        new_rows = []
+        for (device_id, start), (minutes, kwh) in parsed.items():
+            row = existing.get((device_id, start))
+            if row is None:
+                new_rows.append({
+                    "device_id": device_id,
+                    "interval_start": start,
+                    "interval_minutes": minutes,
+                    "energy_consumed": energy_value(energy_units(kwh))
+                })
+            else:
+                row.energy_consumed = Decimal(str(energy_value(energy_units(kwh))))
+
+        if new_rows:
+            db.session.execute(PowerInterval.__table__.insert(), new_rows)
+        db.session.flush()
+
+        # 3. 受影響日期的日紀錄改為當日區間總和，並同步彙總表
+        day_keys = {(device_id, start.date()) for device_id, start in parsed}
+        _sync_daily_logs(_interval_day_totals(day_keys))
+        db.session.commit()
+
+        return jsonify({
+            "ok": True,
+            "inserted": len(new_rows),
+            "updated": len(existing),
+            "replaced": len(conflicts),
+            "days_affected": len(day_keys)
+        })
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"ok": False, "msg": f"寫入失敗: {str(e)}"}), 500
+
+
+def _choose_resolution(start, end):
+    """選擇能回答查詢的最粗解析度"""
+    span = end - start
+    aligned = start.time() == time(0) and end.time() == time(0)
+    if aligned and span >= timedelta(days=2):
+        return "day"
+    if span > timedelta(days=1):
+        return "hour"
+    return "interval"
+
+
+@bp.route("", methods=["GET"])
+def get_intervals():
+    """
+    查詢區間用電（[start, end) 範圍）
+
+    URL: GET /usage/intervals?device_id=1&start=2025-06-01&end=2025-06-02&resolution=auto
+
+    - end 若只給日期，代表包含該日整天
+    - 回傳 resolution 與 points: [{"device_id", "start", "kwh"}, ...]
+    """
+    try:
+        start = _parse_datetime(request.args.get("start", str(date.today())))
+        end_str = request.args.get("end")
+        if end_str:
+            end = _parse_datetime(end_str)
+            if len(end_str) == 10:
+                end += timedelta(days=1)
+        else:
+            end = start + timedelta(days=1)
+        if end <= start:
+            raise ValueError("end 必須晚於 start")
+
+        device_id = request.args.get("device_id", type=int)
+        resolution = request.args.get("resolution", "auto")
+        if resolution == "auto":
+            resolution = _choose_resolution(start, end)
+        if resolution not in ("interval", "hour", "day"):
+            raise ValueError("resolution 必須是 auto / interval / hour / day")
+    except ValueError as ve:
+        return jsonify({"ok": False, "msg": str(ve)}), 400
+
+    points = []
+    if resolution == "day":
+        query = db.session.query(
+            PowerLog.device_id, PowerLog.log_date, energy_units_sql(PowerLog.energy_consumed)
+        ).filter(
+            PowerLog.log_date >= start.date(),
+            PowerLog.log_date < (end + timedelta(days=1) if end.time() != time(0) else end).date(),
+            not_deleted_device(PowerLog.device_id)
+        )
+        if device_id is not None:
+            query = query.filter(PowerLog.device_id == device_id)
+        for dev_id, log_date, units in query.order_by(PowerLog.log_date, PowerLog.device_id):
+            points.append({"device_id": dev_id, "start": log_date.strftime("%Y-%m-%d"), "kwh": energy_value(units)})
+    else:
+        query = db.session.query(
+            PowerInterval.device_id, PowerInterval.interval_start, energy_units_sql(PowerInterval.energy_consumed)
+        ).filter(
+            PowerInterval.interval_start >= start,
+            PowerInterval.interval_start < end,
+            not_deleted_device(PowerInterval.device_id)
+        )
+        if device_id is not None:
+            query = query.filter(PowerInterval.device_id == device_id)
+        query = query.order_by(PowerInterval.interval_start, PowerInterval.device_id)
+
+        if resolution == "interval":
+            for dev_id, interval_start, units in query:
+                points.append({"device_id": dev_id, "start": interval_start.strftime("%Y-%m-%d %H:%M"),
+                               "kwh": energy_value(units)})
+        else:
+            # 依小時加總（整數單位，輸出時才轉回度數）
+            hourly = {}
+            for dev_id, interval_start, units in query:
+                key = (interval_start.replace(minute=0), dev_id)
+                hourly[key] = hourly.get(key, 0) + units
+            for (hour_start, dev_id), units in sorted(hourly.items()):
+                points.append({"device_id": dev_id, "start": hour_start.strftime("%Y-%m-%d %H:%M"),
+                               "kwh": energy_value(units)})
+
+    return jsonify({
+        "ok": True,
+        "resolution": resolution,
+        "start": start.strftime("%Y-%m-%d %H:%M"),
+        "end": end.strftime("%Y-%m-%d %H:%M"),
+        "count": len(points),
+        "points": points
+    })
@@ -5,14 +5,18 @@
 # ==========================================
 
 from flask import Blueprint, jsonify, request
-from models import db, Device, PowerLog
+from models import db, Device, PowerLog, UsageDailyRollup, UsageMonthlyRollup
 from datetime import datetime, date, timedelta
 from decimal import Decimal
-from sqlalchemy import func
+from sqlalchemy import func, tuple_
+from usage_rollup import HOME_DEVICE_ID, apply_usage_deltas, lock_month_ledgers, month_start_of
+from usage_reprice import reprice_from
+from app_metrics import get_logger
 import random
 import math
 
 bp = Blueprint("simulator", __name__)
+log = get_logger("simulator")
 
 # ==========================================
 # 設備行為設定檔
@@ -198,9 +202,77 @@ def simulate_device_usage(device, target_date, outdoor_temp=None):
         "simulated": True
     }
 
+def save_simulated_rows(rows):
+    """
+    將多筆模擬資料在同一個交易中存入資料庫
+
+    同一設備同一天已有紀錄時以模擬值覆蓋；寫入後，各月份從最早寫入的日期（含）起
+    依累進費率重新計價（模擬資料本身的電費也在此計算）。
+
+    Args:
+        rows: (device_id, 日期, 功率（瓦）, 使用時數, 耗電量（度）) 的列表
+
+    Returns:
+        bool: 是否成功儲存
+    """
+    if not rows:
+        return True
+    try:
+        rows = [
+            (device_id, datetime.strptime(target_date, "%Y-%m-%d").date() if isinstance(target_date, str) else target_date,
+             power_watts, hours, kwh)
+            for device_id, target_date, power_watts, hours, kwh in rows
+        ]
+
+        # 與其他寫入同月用電紀錄的交易依序處理（見 usage_rollup.lock_month_ledgers）
+        lock_month_ledgers(month_start_of(target_date) for _, target_date, _, _, _ in rows)
+
+        # 一次查出已存在的日紀錄
+        existing = {
+            (power_log.device_id, power_log.log_date): power_log
+            for power_log in PowerLog.query.filter(
+                tuple_(PowerLog.device_id, PowerLog.log_date).in_(list({(r[0], r[1]) for r in rows}))
+            ).all()
+        }
+
+        deltas = []
+        for device_id, target_date, power_watts, hours, kwh in rows:
+            existing_log = existing.get((device_id, target_date))
+            if existing_log:
+                # 更新現有記錄（彙總表只需加上差額）
+                kwh_delta = Decimal(str(kwh)) - (existing_log.energy_consumed or Decimal("0"))
+                existing_log.power_watts = Decimal(str(power_watts))
+                existing_log.hours = Decimal(str(hours))
+                existing_log.energy_consumed = Decimal(str(kwh))
+                deltas.append((device_id, target_date, kwh_delta, 0, 0))
+            else:
+                # 建立新記錄
+                existing[(device_id, target_date)] = PowerLog(
+                    device_id=device_id,
+                    power_watts=Decimal(str(power_watts)),
+                    hours=Decimal(str(hours)),
+                    log_date=target_date,
+                    energy_consumed=Decimal(str(kwh))
+                )
+                db.session.add(existing[(device_id, target_date)])
+                deltas.append((device_id, target_date, kwh, 0, 1))
+        apply_usage_deltas(deltas)
+        db.session.flush()
+
+        # 補登或覆蓋較早日期後，同月之後的紀錄（含本次寫入）重新計價
+        reprice_from(target_date for _, target_date, _, _, _ in rows)
+
+        db.session.commit()
+        return True
+    except Exception:
+        db.session.rollback()
+        log.exception("Error saving simulated data")
+        return False
+
+
 def save_simulated_data(device_id, target_date, power_watts, hours, kwh):
     """
-    將模擬資料存入資料庫
+    將單筆模擬資料存入資料庫（見 save_simulated_rows）
     
     Args:
         device_id: 設備 ID
@@ -212,39 +284,7 @@ def save_simulated_data(device_id, target_date, power_watts, hours, kwh):
     Returns:
         bool: 是否成功儲存
     """
-    try:
-        if isinstance(target_date, str):
-            target_date = datetime.strptime(target_date, "%Y-%m-%d").date()
-        
-        # 檢查是否已存在該日記錄
-        existing = PowerLog.query.filter_by(
-            device_id=device_id,
-            log_date=target_date
-        ).first()
-        
-        if existing:
-            # 更新現有記錄
-            existing.power_watts = Decimal(str(power_watts))
-            existing.hours = Decimal(str(hours))
-            existing.energy_consumed = Decimal(str(kwh))
-            # 成本會在 API 層級計算
-        else:
-            # 建立新記錄
-            new_log = PowerLog(
-                device_id=device_id,
-                power_watts=Decimal(str(power_watts)),
-                hours=Decimal(str(hours)),
-                log_date=target_date,
-                energy_consumed=Decimal(str(kwh))
-            )
-            db.session.add(new_log)
-        
-        db.session.commit()
-        return True
-    except Exception as e:
-        db.session.rollback()
-        print(f"Error saving simulated data: {e}")
-        return False
+    return save_simulated_rows([(device_id, target_date, power_watts, hours, kwh)])
 
 # ==========================================
 # API 端點
@@ -306,7 +346,7 @@ def simulate_daily():
     outdoor_temp = simulate_outdoor_temperature(target_date, hour=12)
     
     # 取得所有啟用的設備
-    devices = Device.query.filter_by(is_active=True).all()
+    devices = Device.query.filter_by(is_active=True, deleted_at=None).all()
     
     results = []
     total_kwh = 0
@@ -318,18 +358,12 @@ def simulate_daily():
         if usage:  # 如果該設備當日有使用
             results.append(usage)
             total_kwh += usage["kwh"]
-            
-            # 存入資料庫
-            if save_to_db:
-                success = save_simulated_data(
-                    usage["device_id"],
-                    target_date,
-                    usage["power_watts"],
-                    usage["hours"],
-                    usage["kwh"]
-                )
-                if success:
-                    saved_count += 1
+    
+    # 存入資料庫（同一交易寫入並重新計價一次）
+    if save_to_db and save_simulated_rows([
+        (u["device_id"], target_date, u["power_watts"], u["hours"], u["kwh"]) for u in results
+    ]):
+        saved_count = len(results)
     
     return jsonify({
         "ok": True,
@@ -397,12 +431,14 @@ def simulate_range():
     total_kwh = 0
     days_count = 0
     
+    pending = []    # 尚未寫入的當月模擬資料
+    
     while current_date <= end_date:
         # 模擬當日溫度
         outdoor_temp = simulate_outdoor_temperature(current_date)
         
         # 取得所有啟用設備
-        devices = Device.query.filter_by(is_active=True).all()
+        devices = Device.query.filter_by(is_active=True, deleted_at=None).all()
         
         for device in devices:
             usage = simulate_device_usage(device, current_date, outdoor_temp)
@@ -412,16 +448,15 @@ def simulate_range():
                 total_kwh += usage["kwh"]
                 
                 if save_to_db:
-                    save_simulated_data(
-                        usage["device_id"],
-                        current_date,
-                        usage["power_watts"],
-                        usage["hours"],
-                        usage["kwh"]
-                    )
+                    pending.append((usage["device_id"], current_date, usage["power_watts"], usage["hours"], usage["kwh"]))
         
         days_count += 1
         current_date += timedelta(days=1)
+        
+        # 每個月寫入一次（一個交易、重新計價一次）
+        if pending and (current_date > end_date or current_date.day == 1):
+            save_simulated_rows(pending)
+            pending = []
     
     return jsonify({
         "ok": True,
@@ -512,24 +547,35 @@ def get_stats():
     }
     """
     try:
-        # 總記錄數
-        total_records = PowerLog.query.count()
+        # 總記錄數（全戶月彙總）
+        total_records = db.session.query(
+            func.sum(UsageMonthlyRollup.record_count)
+        ).filter(UsageMonthlyRollup.device_id == HOME_DEVICE_ID).scalar() or 0
         
-        # 日期範圍
-        min_date = db.session.query(func.min(PowerLog.log_date)).scalar()
-        max_date = db.session.query(func.max(PowerLog.log_date)).scalar()
+        # 日期範圍（全戶日彙總）
+        min_date, max_date = db.session.query(
+            func.min(UsageDailyRollup.log_date),
+            func.max(UsageDailyRollup.log_date)
+        ).filter(
+            UsageDailyRollup.device_id == HOME_DEVICE_ID,
+            UsageDailyRollup.record_count > 0
+        ).first()
         
-        # 各設備記錄數
+        # 各設備記錄數（設備月彙總）
         device_stats = db.session.query(
             Device.device_name,
-            func.count(PowerLog.log_id).label("record_count"),
-            func.sum(PowerLog.energy_consumed).label("total_kwh")
-        ).join(PowerLog).group_by(Device.device_id, Device.device_name).all()
+            func.sum(UsageMonthlyRollup.record_count).label("record_count"),
+            func.sum(UsageMonthlyRollup.energy_consumed).label("total_kwh")
+        ).join(
+            UsageMonthlyRollup, UsageMonthlyRollup.device_id == Device.device_id
+        ).group_by(Device.device_id, Device.device_name).having(
+            func.sum(UsageMonthlyRollup.record_count) > 0
+        ).all()
         
         devices = [
             {
                 "device_name": d[0],
-                "record_count": d[1],
+                "record_count": int(d[1]),
                 "total_kwh": float(d[2]) if d[2] else 0
             }
             for d in device_stats
@@ -537,7 +583,7 @@ def get_stats():
         
         return jsonify({
             "ok": True,
-            "total_records": total_records,
+            "total_records": int(total_records),
             "date_range": {
                 "start": min_date.strftime("%Y-%m-%d") if min_date else None,
                 "end": max_date.strftime("%Y-%m-%d") if max_date else None
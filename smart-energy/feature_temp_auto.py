@@ -5,12 +5,16 @@
 # ==========================================
 
 from flask import Blueprint, request, jsonify
-from models import db, Device, DeviceStatus
+from models import db
+from device_state import find_group_devices, upsert_device_status
+from event_bus import EVENT_BUS
+from app_metrics import get_logger
 from datetime import datetime, timedelta
 import threading
 import time
 
 bp = Blueprint("auto", __name__, template_folder="templates")
+log = get_logger("auto")
 
 TARGET_TEMP = 26.0                               # 設定溫度閾值
 AUTO_MONITOR_ENABLED = False                     # 自動監控開關
@@ -35,8 +39,8 @@ def get_latest_temperature():
         global SIMULATED_TEMP
         if SIMULATED_TEMP is not None:
             return float(SIMULATED_TEMP)
-    except Exception as e:
-        print(f"Error reading SIMULATED_TEMP: {e}")
+    except Exception:
+        log.exception("Error reading SIMULATED_TEMP")
 
     try:
         # 方法 1: 從 environment_logs 表讀取（如果有建立）
@@ -48,7 +52,7 @@ def get_latest_temperature():
         if latest and latest.indoor_temp:
             return float(latest.indoor_temp)
     except Exception as e:
-        print(f"EnvironmentLog not available: {e}")
+        log.debug("EnvironmentLog not available: %s", e)
     
     # 方法 2: 使用模擬器產生即時溫度
     try:
@@ -56,47 +60,37 @@ def get_latest_temperature():
         outdoor = simulate_outdoor_temperature(datetime.now().date(), datetime.now().hour)
         indoor = simulate_indoor_temperature(outdoor, ac_running=False)
         return indoor
-    except Exception as e:
-        print(f"Error getting temperature: {e}")
+    except Exception:
+        log.exception("Error getting temperature")
         return None
 
 def get_air_conditioner_devices():
     """
-    取得所有冷氣設備
+    取得所有啟用中的冷氣設備
     
     Returns:
-        list: Device 物件列表
+        list: [(device_id, device_name)]
     """
-    return Device.query.filter_by(
-        device_type='air_conditioner',
-        is_active=True
-    ).all()
+    return find_group_devices(device_types=["air_conditioner"])
 
-def control_device(device, turn_on):
+def control_devices(device_ids, turn_on):
     """
-    控制設備開關
+    一次控制多個設備開關（一個多列 upsert + 一次 commit）
     
     Args:
-        device: Device 物件
+        device_ids: 設備 ID 列表
         turn_on: True 為開啟，False 為關閉
     
     Returns:
         bool: 是否成功
     """
     try:
-        # 取得或建立設備狀態
-        status = device.status
-        if not status:
-            status = DeviceStatus(device_id=device.device_id, is_on=turn_on)
-            db.session.add(status)
-        else:
-            status.is_on = turn_on
-        
+        upsert_device_status([{"device_id": device_id, "is_on": turn_on} for device_id in device_ids])
         db.session.commit()
         return True
-    except Exception as e:
+    except Exception:
         db.session.rollback()
-        print(f"Error controlling device {device.device_id}: {e}")
+        log.exception("Error controlling devices %s", device_ids)
         return False
 
 def auto_temperature_check():
@@ -124,18 +118,14 @@ def auto_temperature_check():
     # 3. 取得所有冷氣設備
     devices = get_air_conditioner_devices()
     
-    # 4. 控制設備
-    controlled = []
-    for device in devices:
-        success = control_device(device, should_turn_on)
-        controlled.append({
-            "device_id": device.device_id,
-            "device_name": device.device_name,
-            "action": action,
-            "success": success
-        })
+    # 4. 一次控制所有冷氣（同一個交易）
+    success = control_devices([device_id for device_id, _ in devices], should_turn_on)
+    controlled = [
+        {"device_id": device_id, "device_name": device_name, "action": action, "success": success}
+        for device_id, device_name in devices
+    ]
     
-    return {
+    result = {
         "ok": True,
         "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
         "current_temp": current_temp,
@@ -144,6 +134,16 @@ def auto_temperature_check():
         "reason": f"Temperature {current_temp}°C {'>' if should_turn_on else '≤'} {TARGET_TEMP}°C",
         "devices_controlled": controlled
     }
+    EVENT_BUS.publish("auto_decision", result)
+    return result
+
+def publish_monitor_status():
+    """發布自動監控目前的狀態（monitor_status 事件）"""
+    EVENT_BUS.publish("monitor_status", {
+        "enabled": AUTO_MONITOR_ENABLED,
+        "interval": MONITOR_INTERVAL,
+        "target_temp": TARGET_TEMP
+    })
 
 # ==========================================
 # 背景監控執行緒
@@ -153,19 +153,19 @@ def monitor_loop():
     """背景執行緒：每隔指定時間檢查一次溫度"""
     global AUTO_MONITOR_ENABLED
     
-    print(f"🌡️ Auto temperature monitor started (interval: {MONITOR_INTERVAL}s)")
+    log.info("Auto temperature monitor started (interval: %ss)", MONITOR_INTERVAL)
     
     while AUTO_MONITOR_ENABLED:
         try:
             result = auto_temperature_check()
-            print(f"[{result.get('timestamp')}] Temp: {result.get('current_temp')}°C, Action: {result.get('action')}")
-        except Exception as e:
-            print(f"Error in monitor loop: {e}")
+            log.info("Temp: %s°C, Action: %s", result.get("current_temp"), result.get("action"))
+        except Exception:
+            log.exception("Error in monitor loop")
         
         # 等待下一次檢查
         time.sleep(MONITOR_INTERVAL)
     
-    print("🌡️ Auto temperature monitor stopped")
+    log.info("Auto temperature monitor stopped")
 
 # ==========================================
 # API 端點
@@ -249,6 +249,7 @@ def start_monitor():
     AUTO_MONITOR_ENABLED = True
     MONITOR_THREAD = threading.Thread(target=monitor_loop, daemon=True)
     MONITOR_THREAD.start()
+    publish_monitor_status()
     
     return jsonify({
         "ok": True,
@@ -273,6 +274,7 @@ def stop_monitor():
         }), 400
     
     AUTO_MONITOR_ENABLED = False
+    publish_monitor_status()
     
     return jsonify({
         "ok": True,
@@ -329,6 +331,7 @@ def config():
         except Exception:
             SIMULATED_TEMP = None
     
+    publish_monitor_status()
     return jsonify({
         "ok": True,
         "msg": "Config updated",
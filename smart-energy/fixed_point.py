@@ -0,0 +1,57 @@
+# fixed_point.py
+# ==========================================
+# 用電量 / 電費的整數定點運算
+# - 度數以「0.0001 度」為單位的整數表示（與 energy_consumed DECIMAL(8,4) 同精度）
+# - 電費以「0.01 元（分）」為單位的整數表示（與 cost DECIMAL(8,2) 同精度）
+# 加總一律使用整數，只在輸出 JSON 時才轉回浮點數，避免逐筆 Decimal→float 與累積誤差
+# 查詢大量資料列時，以 energy_units_sql() / cost_units_sql() 在 SQL 中就轉成整數單位，
+# Python 端不再逐筆轉換 Decimal
+# ==========================================
+
+from decimal import Decimal, ROUND_HALF_UP
+from sqlalchemy import BigInteger, cast, func
+
+ENERGY_SCALE = 10000   # 1 單位 = 0.0001 度
+COST_SCALE = 100       # 1 單位 = 0.01 元
+
+
+def _to_units(value, scale):
+    """將 Decimal / int / float / None 轉成指定精度的整數（四捨五入）"""
+    if value is None:
+        return 0
+    if isinstance(value, int):
+        return value * scale
+    if not isinstance(value, Decimal):
+        # 經由字串轉換，避免 1.005 這類浮點數被截成 1.00499...
+        value = Decimal(str(value))
+    return int((value * scale).to_integral_value(rounding=ROUND_HALF_UP))
+
+
+def energy_units(value):
+    """度數 → 整數單位（0.0001 度）"""
+    return _to_units(value, ENERGY_SCALE)
+
+
+def cost_units(value):
+    """電費 → 整數單位（0.01 元）"""
+    return _to_units(value, COST_SCALE)
+
+
+def energy_units_sql(column):
+    """SQL 運算式：度數 → 整數單位，CAST(ROUND(column * 10000) AS INTEGER)（NULL 視為 0）"""
+    return func.coalesce(cast(func.round(column * ENERGY_SCALE), BigInteger), 0)
+
+
+def cost_units_sql(column):
+    """SQL 運算式：電費 → 整數單位，CAST(ROUND(column * 100) AS INTEGER)（NULL 視為 0）"""
+    return func.coalesce(cast(func.round(column * COST_SCALE), BigInteger), 0)
+
+
+def energy_value(units, places=4):
+    """整數單位 → 度數（輸出用）"""
+    return round(units / ENERGY_SCALE, places)
+
+
+def cost_value(units):
+    """整數單位 → 電費（輸出用）"""
+    return round(units / COST_SCALE, 2)
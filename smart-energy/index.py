@@ -17,6 +17,9 @@ from feature_device_control import bp as device_bp   # 功能1：電器開關與
 from feature_daily_usage import bp as usage_bp       # 功能2：每日用電與電費統計
 from feature_temp_auto import bp as temp_bp          # 功能3：溫度判斷與自動開關
 from feature_simulator import bp as simulator_bp     # 功能4：資料模擬器
+from feature_interval_usage import bp as interval_bp # 功能5：區間用電記錄
+from feature_events import bp as events_bp           # 功能6：即時事件推送（SSE）
+from data_import import import_data_command         # CLI：flask import-data 大量匯入
 
 
 # ------------------------------------------
@@ -36,6 +39,15 @@ def register_all_features(app: Flask):
     
     # 掛載 功能4：資料模擬器模組
     app.register_blueprint(simulator_bp, url_prefix="/simulate")
+    
+    # 掛載 功能5：區間用電記錄模組
+    app.register_blueprint(interval_bp, url_prefix="/usage/intervals")
+    
+    # 掛載 功能6：即時事件推送模組
+    app.register_blueprint(events_bp, url_prefix="/events")
+
+    # 註冊 CLI 指令：CSV / SQL 匯出檔大量匯入
+    app.cli.add_command(import_data_command)
 
 
     # 備註：
@@ -62,9 +62,15 @@ class Device(db.Model):
     location = db.Column(db.String(100))
     rated_power = db.Column(db.DECIMAL(6, 2))  # 額定功率(kW)
     is_active = db.Column(db.Boolean, default=True)
+    deleted_at = db.Column(db.TIMESTAMP)  # 軟刪除時間（不為 NULL 表示等待背景清除，見 device_purge.py）
     created_at = db.Column(db.TIMESTAMP, default=datetime.now)
     updated_at = db.Column(db.TIMESTAMP, default=datetime.now, onupdate=datetime.now)
     
+    __table_args__ = (
+        db.Index('idx_devices_deleted_at', 'deleted_at'),
+        db.Index('idx_location_type_active', 'location', 'device_type', 'is_active'),
+    )
+    
     # 關聯
     status = db.relationship('DeviceStatus', backref='device', uselist=False, lazy=True)
     logs = db.relationship('PowerLog', backref='device', lazy=True)
@@ -86,6 +92,17 @@ class Device(db.Model):
     def __repr__(self):
         return f'<Device {self.device_id}: {self.device_name}>'
 
+
+def not_deleted_device(device_id_column):
+    """
+    排除已軟刪除設備的查詢條件（用於 power_logs 等以 device_id 關聯的資料表）
+    
+    例：PowerLog.query.filter(not_deleted_device(PowerLog.device_id))
+    """
+    return device_id_column.notin_(
+        db.select(Device.device_id).where(Device.deleted_at.isnot(None))
+    )
+
 # ==========================================
 # DeviceStatus 模型 (設備狀態表)
 # ==========================================
@@ -157,6 +174,117 @@ class PowerLog(db.Model):
     def __repr__(self):
         return f'<PowerLog {self.log_id}: Device {self.device_id} on {self.log_date}>'
 
+# ==========================================
+# PowerInterval 模型 (區間用電記錄表)
+# 儲存 15 分鐘或 1 小時的電錶讀數，每日 PowerLog 由此彙總產生
+# ==========================================
+class PowerInterval(db.Model):
+    __tablename__ = 'power_intervals'
+    
+    interval_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    device_id = db.Column(db.Integer, db.ForeignKey('devices.device_id'), nullable=False)
+    interval_start = db.Column(db.DateTime, nullable=False)
+    interval_minutes = db.Column(db.SmallInteger, nullable=False)  # 15 或 60
+    energy_consumed = db.Column(db.DECIMAL(10, 4), nullable=False)
+    
+    __table_args__ = (
+        db.UniqueConstraint('device_id', 'interval_start', name='uk_device_interval'),
+        db.Index('idx_interval_start', 'interval_start'),
+        {'mysql_engine': 'InnoDB', 
+         'mysql_charset': 'utf8mb4', 
+         'mysql_collate': 'utf8mb4_unicode_ci',
+         'comment': '區間用電記錄表'}
+    )
+    
+    def to_dict(self):
+        """將模型轉換為字典格式"""
+        return {
+            'device_id': self.device_id,
+            'interval_start': self.interval_start.strftime('%Y-%m-%d %H:%M') if self.interval_start else None,
+            'interval_minutes': self.interval_minutes,
+            'energy_consumed': float(self.energy_consumed) if self.energy_consumed else 0
+        }
+    
+    def __repr__(self):
+        return f'<PowerInterval Device {self.device_id} at {self.interval_start}>'
+
+# ==========================================
+# UsageDailyRollup 模型 (每日用電彙總表)
+# device_id = 0 代表全戶合計（HOME_DEVICE_ID）
+# ==========================================
+class UsageDailyRollup(db.Model):
+    __tablename__ = 'usage_daily_rollup'
+    
+    rollup_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    device_id = db.Column(db.Integer, nullable=False)  # 0 = 全戶
+    log_date = db.Column(db.Date, nullable=False)
+    energy_consumed = db.Column(db.DECIMAL(14, 4), nullable=False, default=0)
+    cost = db.Column(db.DECIMAL(14, 2), nullable=False, default=0)
+    record_count = db.Column(db.Integer, nullable=False, default=0)
+    
+    __table_args__ = (
+        db.UniqueConstraint('device_id', 'log_date', name='uk_daily_rollup_device_date'),
+        db.Index('idx_daily_rollup_date', 'log_date'),
+        {'mysql_engine': 'InnoDB', 
+         'mysql_charset': 'utf8mb4', 
+         'mysql_collate': 'utf8mb4_unicode_ci',
+         'comment': '每日用電彙總表'}
+    )
+    
+    def __repr__(self):
+        return f'<UsageDailyRollup Device {self.device_id} on {self.log_date}>'
+
+# ==========================================
+# UsageMonthlyRollup 模型 (每月用電彙總表)
+# month_start 為該月 1 日；device_id = 0 代表全戶合計
+# ==========================================
+class UsageMonthlyRollup(db.Model):
+    __tablename__ = 'usage_monthly_rollup'
+    
+    rollup_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    device_id = db.Column(db.Integer, nullable=False)  # 0 = 全戶
+    month_start = db.Column(db.Date, nullable=False)
+    energy_consumed = db.Column(db.DECIMAL(14, 4), nullable=False, default=0)
+    cost = db.Column(db.DECIMAL(14, 2), nullable=False, default=0)
+    record_count = db.Column(db.Integer, nullable=False, default=0)
+    
+    __table_args__ = (
+        db.UniqueConstraint('device_id', 'month_start', name='uk_monthly_rollup_device_month'),
+        db.Index('idx_monthly_rollup_month', 'month_start'),
+        {'mysql_engine': 'InnoDB', 
+         'mysql_charset': 'utf8mb4', 
+         'mysql_collate': 'utf8mb4_unicode_ci',
+         'comment': '每月用電彙總表'}
+    )
+    
+    def __repr__(self):
+        return f'<UsageMonthlyRollup Device {self.device_id} for {self.month_start}>'
+
+# ==========================================
+# UsageIdempotencyKey 模型 (用電寫入去重表)
+# 記錄 idempotency_key 對應的原始處理結果，重送時直接回傳
+# ==========================================
+class UsageIdempotencyKey(db.Model):
+    __tablename__ = 'usage_idempotency_keys'
+    
+    key_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    idempotency_key = db.Column(db.String(128), nullable=False)
+    log_id = db.Column(db.Integer)
+    result = db.Column(db.Text, nullable=False)  # 原始回傳結果 (JSON)
+    created_at = db.Column(db.TIMESTAMP, default=datetime.now, nullable=False)
+    
+    __table_args__ = (
+        db.UniqueConstraint('idempotency_key', name='uk_idempotency_key'),
+        db.Index('idx_idempotency_created', 'created_at'),
+        {'mysql_engine': 'InnoDB', 
+         'mysql_charset': 'utf8mb4', 
+         'mysql_collate': 'utf8mb4_unicode_ci',
+         'comment': '用電寫入去重表'}
+    )
+    
+    def __repr__(self):
+        return f'<UsageIdempotencyKey {self.idempotency_key}: Log {self.log_id}>'
+
 # ==========================================
 # EnvironmentLog 模型 (環境資料記錄表)
 # ==========================================
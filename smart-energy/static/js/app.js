@@ -298,8 +298,41 @@ async function addUsage(payload){
   }
 }
 
+// ======= 即時事件（/events SSE）：取代輪詢 =======
+// device_state 事件直接更新表格中的狀態；新增 / 刪除設備、自動控制狀態改變或 reset 時重新載入清單
+let __eventSource = null;
+let __reloadTimer = null;
+
+function scheduleDeviceListReload(){
+  if(__reloadTimer) return;
+  __reloadTimer = setTimeout(async () => { __reloadTimer = null; await renderDeviceList(); }, 300);
+}
+
+function applyDeviceStateEvent(payload){
+  for(const d of (payload.devices || [])){
+    if(typeof d.is_on !== 'boolean') continue;
+    const btn = document.querySelector(`#device-list button[data-id="${d.device_id}"][data-on]`);
+    if(!btn){ scheduleDeviceListReload(); continue; }
+    const row = btn.closest('tr');
+    const statusCell = row ? row.children[3] : null;
+    if(statusCell) statusCell.textContent = d.is_on ? '開' : '關';
+    btn.textContent = d.is_on ? '關閉' : '開啟';
+    btn.dataset.on = (!d.is_on).toString();
+  }
+}
+
+function subscribeEvents(){
+  if(__eventSource || !window.EventSource || !document.getElementById('device-list')) return;
+  __eventSource = new EventSource('/events');
+  __eventSource.addEventListener('device_state', e => applyDeviceStateEvent(JSON.parse(e.data)));
+  for(const type of ['device_added', 'devices_bulk_added', 'device_removed', 'monitor_status', 'reset']){
+    __eventSource.addEventListener(type, scheduleDeviceListReload);
+  }
+}
+
 // expose some functions for inline onclick handlers
 window.renderDeviceList = renderDeviceList;
+window.subscribeEvents = subscribeEvents;
 window.toggleDevice = toggleDevice;
 window.renderUsageDaily = renderUsageDaily;
 window.decideTemp = decideTemp;
@@ -0,0 +1,108 @@
+# tariff.py
+# ==========================================
+# 台電累進費率計價引擎（向量化版）
+# - 預先計算每個級距「起點的累積電費」，計價時不需逐級迴圈
+# - 以 NumPy 一次計算整個陣列的「當月累積度數 → 累積電費」
+# - 邊際電費：從 X 度用到 Y 度要多付多少 = bill(Y) - bill(X)
+# ==========================================
+
+import numpy as np
+from datetime import datetime
+
+# 台電住宅用電累進費率（元/度）
+# 夏月（6-9月）與非夏月費率 - 2025年最新費率
+TAIPOWER_RATES = {
+    "summer": [
+        (120, 1.78),      # 0-120度
+        (330, 2.55),      # 121-330度
+        (500, 3.80),      # 331-500度
+        (700, 5.14),      # 501-700度
+        (1000, 6.44),     # 701-1000度
+        (float('inf'), 8.86)  # 1001度以上
+    ],
+    "non_summer": [
+        (120, 1.78),      # 0-120度
+        (330, 2.26),      # 121-330度
+        (500, 3.13),      # 331-500度
+        (700, 4.24),      # 501-700度
+        (1000, 5.27),     # 701-1000度
+        (float('inf'), 7.03)  # 1001度以上
+    ]
+}
+
+
+def _build_table(rates):
+    """
+    將級距清單轉成計價表
+
+    Returns:
+        (upper, lower, rate, base_cost)
+        upper: 各級距上限
+        lower: 各級距下限
+        rate: 各級距費率
+        base_cost: 用到各級距下限時的累積電費
+    """
+    upper = np.array([limit for limit, _ in rates], dtype=float)
+    rate = np.array([r for _, r in rates], dtype=float)
+    lower = np.concatenate(([0.0], upper[:-1]))
+    base_cost = np.concatenate(([0.0], np.cumsum((upper[:-1] - lower[:-1]) * rate[:-1])))
+    return upper, lower, rate, base_cost
+
+
+# 模組載入時預先建立計價表
+TARIFF_TABLES = {season: _build_table(rates) for season, rates in TAIPOWER_RATES.items()}
+
+
+def season_of(usage_date):
+    """判斷夏月或非夏月（6-9月為夏月）"""
+    if isinstance(usage_date, str):
+        usage_date = datetime.strptime(usage_date, "%Y-%m-%d").date()
+    return "summer" if 6 <= usage_date.month <= 9 else "non_summer"
+
+
+def price_cumulative(kwh, season):
+    """
+    計算當月累積度數對應的累積電費（未四捨五入）
+
+    Args:
+        kwh: 單一數值或陣列（當月累積度數）
+        season: "summer" 或 "non_summer"
+
+    Returns:
+        與輸入相同形狀的 ndarray
+    """
+    upper, lower, rate, base_cost = TARIFF_TABLES[season]
+    kwh = np.maximum(np.asarray(kwh, dtype=float), 0.0)
+    tier = np.searchsorted(upper, kwh, side="left")
+    return base_cost[tier] + (kwh - lower[tier]) * rate[tier]
+
+
+def price_cumulative_by_month(kwh, months):
+    """
+    依各筆資料的月份（決定夏月/非夏月）計算累積電費
+
+    Args:
+        kwh: 當月累積度數陣列
+        months: 對應的月份陣列（1-12）
+    """
+    months = np.asarray(months)
+    is_summer = (months >= 6) & (months <= 9)
+    return np.where(
+        is_summer,
+        price_cumulative(kwh, "summer"),
+        price_cumulative(kwh, "non_summer")
+    )
+
+
+def marginal_cost(from_kwh, to_kwh, season):
+    """
+    計算當月累積用電從 from_kwh 增加到 to_kwh 的邊際電費（未四捨五入）
+    可傳入陣列一次計算多筆
+    """
+    return price_cumulative(to_kwh, season) - price_cumulative(from_kwh, season)
+
+
+def marginal_cost_by_month(from_kwh, to_kwh, months):
+    """依各筆資料的月份計算邊際電費（陣列版）"""
+    return price_cumulative_by_month(to_kwh, months) - price_cumulative_by_month(from_kwh, months)
+
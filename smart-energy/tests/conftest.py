@@ -0,0 +1,106 @@
+# tests/conftest.py
+# ==========================================
+# 測試共用設定
+# - 每個測試使用獨立的 SQLite 檔案資料庫（背景執行緒也能連到同一個資料庫）
+# - 重設行程內的快取與背景工作，避免測試之間互相影響
+# - 預先建立 1 位使用者與 3 個設備：
+#   1 客廳冷氣 (air_conditioner, 客廳)、2 臥室冷氣 (air_conditioner, 主臥室)、3 客廳主燈 (light, 客廳)
+# ==========================================
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DATABASE_URL", "sqlite://")   # 匯入 config 前設定，避免連線預設的 MySQL
+
+import pytest
+from config import Config
+from models import db, User, Device, UsageDailyRollup, UsageMonthlyRollup
+import device_purge
+import device_state
+import feature_daily_usage
+import feature_device_control
+import usage_anomaly
+import usage_period_cache
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "SQLALCHEMY_DATABASE_URI", f"sqlite:///{tmp_path / 'test.db'}")
+    monkeypatch.setattr(Config, "LOG_LEVEL", "WARNING")
+
+    usage_period_cache.PERIOD_CACHE.clear()
+    device_state.DEVICE_STATE_CACHE.invalidate()
+    usage_anomaly._BASELINE_CACHE.clear()
+    monkeypatch.setattr(feature_daily_usage, "INGEST_QUEUE", None)
+    purger = device_purge.DevicePurger(pause_ms=0)
+    monkeypatch.setattr(device_purge, "DEVICE_PURGER", purger)
+    monkeypatch.setattr(feature_device_control, "DEVICE_PURGER", purger)
+
+    from app import create_app
+    app = create_app()
+    app.config["TESTING"] = True
+    with app.app_context():
+        user = User(username="tester", password_hash="x")
+        db.session.add(user)
+        db.session.flush()
+        for device_id, name, device_type, location, rated_power in (
+            (1, "客廳冷氣", "air_conditioner", "客廳", 3.5),
+            (2, "臥室冷氣", "air_conditioner", "主臥室", 2.8),
+            (3, "客廳主燈", "light", "客廳", 0.02)
+        ):
+            db.session.add(Device(device_id=device_id, user_id=user.user_id, device_name=name,
+                                  device_type=device_type, location=location, rated_power=rated_power))
+        db.session.commit()
+
+    yield app
+
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def add_usage(client, device_id, day, kwh):
+    """以 /usage/add 寫入一筆用電紀錄，回傳 JSON 結果"""
+    resp = client.post("/usage/add", json={"device_id": device_id, "day": day, "kwh": kwh})
+    assert resp.status_code == 200, resp.get_json()
+    return resp.get_json()
+
+
+def rollup_snapshot():
+    """
+    目前的彙總表內容（需在 app context 中呼叫）
+
+    不含已歸零的列：月帳本鎖定時會先建立空列，軟刪除設備後全戶列也可能歸零，
+    這些列不影響查詢結果，重建時則不會產生
+    """
+    def rows(model, date_attr):
+        return sorted(
+            (r.device_id, getattr(r, date_attr), float(r.energy_consumed), float(r.cost), r.record_count)
+            for r in model.query
+            if r.record_count or r.energy_consumed or r.cost
+        )
+
+    return {"daily": rows(UsageDailyRollup, "log_date"), "monthly": rows(UsageMonthlyRollup, "month_start")}
+
+
+@pytest.fixture
+def assert_consistent(app):
+    """確認電費不需要重新計價，且彙總表與由 power_logs 重建的結果相同"""
+    from usage_reprice import reprice_all
+    from usage_rollup import rebuild_rollups
+
+    def check():
+        with app.app_context():
+            assert reprice_all()["updated"] == 0
+            before = rollup_snapshot()
+            rebuild_rollups()
+            assert rollup_snapshot() == before
+            db.session.rollback()
+
+    return check
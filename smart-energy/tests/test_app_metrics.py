@@ -0,0 +1,76 @@
+# tests/test_app_metrics.py
+# 請求量測、SQL 計數與 /metrics（app_metrics.py）
+
+import logging
+
+import pytest
+from sqlalchemy import text
+from models import db
+from app_metrics import Histogram, SamplingFilter
+
+
+def _sample(body, prefix):
+    return next(float(line.rsplit(" ", 1)[1]) for line in body.splitlines() if line.startswith(prefix))
+
+
+def test_metrics_count_requests_and_sql_per_endpoint(client):
+    client.get("/device/list")
+    client.get("/device/list")
+    client.get("/no/such/page")
+
+    body = client.get("/metrics").get_data(as_text=True)
+    labels = 'blueprint="device",endpoint="device.get_device_list",method="GET"'
+    assert _sample(body, f'smart_energy_requests_total{{{labels},status="200"}}') >= 2
+    assert _sample(body, f"smart_energy_request_sql_statements_count{{{labels}}}") >= 2
+    assert _sample(body, f"smart_energy_request_sql_statements_sum{{{labels}}}") >= 2
+    assert 'endpoint="<unmatched>",method="GET",status="404"' in body
+
+
+def test_failed_statements_do_not_leave_timings_behind(app):
+    with app.app_context():
+        for _ in range(3):
+            with pytest.raises(Exception):
+                db.session.execute(text("SELECT * FROM no_such_table"))
+            db.session.rollback()
+        connection = db.session.connection()
+        db.session.execute(text("SELECT 1"))
+        assert connection.info.get("metrics_query_start") == []
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = Histogram((1, 5))
+    for value in (0.5, 1, 3, 10):
+        histogram.observe(value)
+    assert histogram.samples("x", {"k": "v"}) == [
+        'x_bucket{k="v",le="1"} 2',
+        'x_bucket{k="v",le="5"} 3',
+        'x_bucket{k="v",le="+Inf"} 4',
+        'x_sum{k="v"} 14.5',
+        'x_count{k="v"} 4'
+    ]
+
+
+def test_sampling_keeps_every_warning():
+    never = SamplingFilter(0.0)
+    assert never.filter(logging.makeLogRecord({"levelno": logging.WARNING}))
+    assert not never.filter(logging.makeLogRecord({"levelno": logging.INFO}))
+
+
+def test_auto_control_failures_go_through_the_logger(app, caplog, monkeypatch):
+    import feature_temp_auto
+
+    def fail(rows):
+        raise RuntimeError("db down")
+
+    monkeypatch.setattr(feature_temp_auto, "upsert_device_status", fail)
+    logging.getLogger("smart_energy.auto").addHandler(caplog.handler)
+    try:
+        with app.app_context():
+            assert feature_temp_auto.control_devices([1, 2], True) is False
+    finally:
+        logging.getLogger("smart_energy.auto").removeHandler(caplog.handler)
+
+    record = caplog.records[-1]
+    assert record.levelno == logging.ERROR
+    assert record.getMessage() == "Error controlling devices [1, 2]"
+    assert record.exc_info is not None
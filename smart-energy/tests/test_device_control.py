@@ -0,0 +1,104 @@
+# tests/test_device_control.py
+# 設備控制端點（feature_device_control.py）
+
+from models import db, Device, DeviceStatus
+
+
+def _status(app):
+    with app.app_context():
+        return {s.device_id: s.is_on for s in DeviceStatus.query}
+
+
+def test_toggle_upserts_status_and_returns_only_the_device(app, client):
+    resp = client.patch("/device/toggle", json={"device_id": 1, "on": True}).get_json()
+    assert resp == {"ok": True, "toggled": {"device_id": 1, "device_name": "客廳冷氣", "is_on": True}}
+
+    resp = client.patch("/device/toggle", json={"name": "客廳冷氣", "on": False, "include_state": True}).get_json()
+    assert resp["state"]["客廳冷氣"] is False
+    assert _status(app) == {1: False}
+
+
+def test_toggle_unknown_device(client):
+    assert client.patch("/device/toggle", json={"device_id": 99, "on": True}).status_code == 404
+    assert client.patch("/device/toggle", json={"device_id": 1, "on": "yes"}).status_code == 400
+
+
+def test_bulk_toggle_in_one_transaction(app, client):
+    resp = client.patch("/device/toggle/bulk", json={"devices": [
+        {"device_id": 1, "on": True},
+        {"name": "客廳主燈", "on": True},
+        {"device_id": 99, "on": True},
+        {"device_id": 1, "on": False}
+    ]}).get_json()
+
+    assert (resp["updated"], resp["not_found"]) == (2, 1)
+    # 同一設備出現多次時以最後一筆為準
+    assert _status(app) == {1: False, 3: True}
+
+    resp = client.patch("/device/toggle/bulk", json={"device_ids": [1, 2], "on": True}).get_json()
+    assert resp["updated"] == 2
+    assert _status(app) == {1: True, 2: True, 3: True}
+
+
+def test_bulk_toggle_rejects_invalid_items(client):
+    resp = client.patch("/device/toggle/bulk", json={"devices": [{"device_id": 1, "on": True}, {"on": True}]})
+    assert resp.status_code == 400
+    assert "devices[1]" in resp.get_json()["msg"]
+
+
+def test_bulk_add_creates_valid_devices_and_reports_the_rest(app, client):
+    with app.app_context():
+        Device.query.filter_by(device_id=2).delete()
+        db.session.commit()
+
+    resp = client.post("/device/bulk_add", json={"devices": [
+        {"device_name": "書房燈", "device_type": "light", "user_id": 1,
+         "create_status": True, "initial_is_on": True},
+        {"device_name": "客廳冷氣", "device_type": "air_conditioner", "user_id": 1},
+        {"device_name": "書房冷氣", "device_type": "air_conditioner", "user_id": 1,
+         "create_status": True, "initial_mode": "cool", "initial_target_temperature": 26},
+        {"device_name": "書房燈", "device_type": "light", "user_id": 1},
+        {"device_name": "車庫燈", "device_type": "light", "user_id": 99},
+        {"device_name": "電扇", "device_type": "fan", "user_id": 1}
+    ]})
+    data = resp.get_json()
+
+    assert resp.status_code == 201
+    assert (data["created"], data["failed"]) == (2, 4)
+    # 先填補空號 2，再接在最大 ID 之後
+    assert [r.get("device_id") for r in data["results"]] == [2, None, 4, None, None, None]
+    assert _status(app) == {2: True, 4: False}
+    assert "書房燈" in client.get("/device/state").get_json()["state"]
+
+
+def test_bulk_add_with_no_valid_devices(client):
+    resp = client.post("/device/bulk_add", json={"devices": [{"device_name": "客廳冷氣", "device_type": "light",
+                                                               "user_id": 1}]})
+    assert resp.status_code == 400
+    assert resp.get_json()["created"] == 0
+
+
+def test_group_control_by_location_and_type(app, client):
+    client.patch("/device/toggle", json={"device_id": 1, "on": True})
+
+    resp = client.patch("/device/group/客廳?type=air_conditioner",
+                        json={"mode": "cool", "target_temperature": 25}).get_json()
+    assert resp["device_ids"] == [1]
+    with app.app_context():
+        status = DeviceStatus.query.filter_by(device_id=1).one()
+        # 只更新有提供的欄位，開關狀態不變
+        assert (status.is_on, status.mode, float(status.target_temperature)) == (True, "cool", 25)
+
+    resp = client.patch("/device/group/客廳", json={"on": False}).get_json()
+    assert resp["device_ids"] == [1, 3]
+    assert _status(app) == {1: False, 3: False}
+
+
+def test_group_control_validation(app, client):
+    with app.app_context():
+        db.session.get(Device, 2).is_active = False
+        db.session.commit()
+    # 停用的設備不列入群組
+    assert client.patch("/device/group/主臥室", json={"on": True}).status_code == 404
+    assert client.patch("/device/group/客廳", json={}).status_code == 400
+    assert client.patch("/device/group/客廳", json={"on": True, "device_type": "fan"}).status_code == 400
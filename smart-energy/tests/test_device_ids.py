@@ -0,0 +1,67 @@
+# tests/test_device_ids.py
+# 設備 ID 配置（device_ids.py）
+
+import pytest
+from sqlalchemy.exc import IntegrityError
+from models import db, Device
+import device_ids
+from device_ids import allocate_device_ids, insert_devices
+
+ROW = {"user_id": 1, "device_type": "light", "device_name": "新燈"}
+
+
+def _delete(*ids):
+    Device.query.filter(Device.device_id.in_(ids)).delete(synchronize_session=False)
+
+
+def test_allocator_fills_gaps_in_order(app):
+    with app.app_context():
+        _delete(1, 2)
+        db.session.add(Device(device_id=7, user_id=1, device_name="陽台燈", device_type="light"))
+        db.session.flush()
+        # 已使用 3、7
+        assert allocate_device_ids(6) == [1, 2, 4, 5, 6, 8]
+        assert allocate_device_ids(3, exclude={1, 4}) == [2, 5, 6]
+        db.session.rollback()
+
+
+def test_add_device_reuses_the_smallest_free_id(app, client):
+    with app.app_context():
+        _delete(2)
+        db.session.commit()
+    resp = client.post("/device/add", json=dict(ROW, device_name="書房燈")).get_json()
+    assert resp["device"]["device_id"] == 2
+
+
+def test_add_device_for_unknown_user(client):
+    resp = client.post("/device/add", json=dict(ROW, user_id=99))
+    assert resp.status_code == 404
+
+
+def test_primary_key_conflict_is_retried_with_other_ids(app, monkeypatch):
+    calls = []
+    real_allocate = device_ids.allocate_device_ids
+
+    def racing_allocate(count=1, exclude=()):
+        calls.append(set(exclude))
+        # 第一次回傳已被其他請求用掉的 3（模擬併發配置到相同 ID）
+        return [3] if len(calls) == 1 else real_allocate(count, exclude)
+
+    monkeypatch.setattr(device_ids, "allocate_device_ids", racing_allocate)
+    with app.app_context():
+        assert insert_devices([ROW]) == [4]
+        assert calls == [set(), {3}]
+        db.session.rollback()
+
+
+def test_other_integrity_errors_are_not_retried(app, monkeypatch):
+    calls = []
+    real_allocate = device_ids.allocate_device_ids
+    monkeypatch.setattr(
+        device_ids, "allocate_device_ids", lambda count=1, exclude=(): calls.append(1) or real_allocate(count, exclude)
+    )
+    with app.app_context():
+        with pytest.raises(IntegrityError):
+            insert_devices([dict(ROW, device_name=None)])
+        assert len(calls) == 1
+        db.session.rollback()
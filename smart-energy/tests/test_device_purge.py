@@ -0,0 +1,55 @@
+# tests/test_device_purge.py
+# 設備軟刪除與背景分批清除（device_purge.py）
+
+from models import db, Device, PowerInterval, PowerLog
+from device_purge import DevicePurger, soft_delete_device
+import feature_device_control
+from conftest import add_usage
+
+
+def test_remove_hides_device_then_purges_and_reprices(app, client, assert_consistent):
+    app.config["DEVICE_PURGE_CHUNK_SIZE"] = 2
+    for day in ("2025-01-01", "2025-01-02", "2025-01-03"):
+        add_usage(client, 1, day, 40)
+    add_usage(client, 2, "2025-01-04", 50)
+    client.post("/usage/intervals", json={"readings": [{"device_id": 1, "start": "2025-02-01T00:00", "kwh": 1}]})
+
+    resp = client.delete("/device/remove/1")
+    assert resp.status_code == 202
+    job_id = resp.get_json()["job_id"]
+
+    # 軟刪除後立即從列表與用電統計中消失
+    assert 1 not in [d["device_id"] for d in client.get("/device/list").get_json()["devices"]]
+    assert client.get("/usage/bill").get_json()["total_kwh"] == 50
+    assert client.delete("/device/remove/1").status_code == 404
+
+    feature_device_control.DEVICE_PURGER.wait_until_empty()
+    job = client.get(f"/device/remove/jobs/{job_id}").get_json()
+    assert (job["status"], job["deleted_logs"], job["deleted_intervals"], job["months_repriced"]) == ("done", 4, 1, 2)
+    with app.app_context():
+        assert db.session.get(Device, 1) is None
+        assert PowerInterval.query.count() == 0
+        # 設備 2 改為從 0 度開始計價
+        assert [float(log.cost) for log in PowerLog.query] == [89]
+    assert_consistent()
+
+
+def test_devices_left_soft_deleted_are_purged_on_start(app, client):
+    add_usage(client, 3, "2025-01-01", 1)
+    with app.app_context():
+        assert soft_delete_device(3) == "客廳主燈"
+        db.session.commit()
+
+    purger = DevicePurger(pause_ms=0)
+    purger.start(app)
+    purger.wait_until_empty()
+
+    assert [job["status"] for job in purger.jobs()] == ["done"]
+    with app.app_context():
+        assert db.session.get(Device, 3) is None
+        assert PowerLog.query.count() == 0
+
+
+def test_remove_unknown_device(client):
+    assert client.delete("/device/remove/99").status_code == 404
+    assert client.get("/device/remove/jobs/nope").status_code == 404
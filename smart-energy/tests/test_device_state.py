@@ -0,0 +1,64 @@
+# tests/test_device_state.py
+# 設備狀態的單一查詢載入與行程內快取（device_state.py）
+
+from contextlib import contextmanager
+
+from sqlalchemy import event
+from models import db
+from device_state import DEVICE_STATE_CACHE, upsert_device_status
+
+
+@contextmanager
+def count_statements(app):
+    with app.app_context():
+        engine = db.engine
+    statements = []
+
+    def before(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", before)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", before)
+
+
+def test_state_is_served_from_cache_and_written_through(app, client):
+    assert client.get("/device/state").get_json()["state"] == {"客廳冷氣": False, "臥室冷氣": False, "客廳主燈": False}
+
+    client.patch("/device/toggle", json={"device_id": 2, "on": True})
+    with count_statements(app) as statements:
+        state = client.get("/device/state").get_json()["state"]
+    assert state["臥室冷氣"] is True
+    assert statements == []
+
+    # 新增設備後整個重新載入
+    client.post("/device/add", json={"device_name": "書房燈", "device_type": "light", "user_id": 1})
+    assert "書房燈" in client.get("/device/state").get_json()["state"]
+
+
+def test_rolled_back_changes_do_not_reach_the_cache(app, client):
+    client.get("/device/state")
+    with app.app_context():
+        upsert_device_status([{"device_id": 1, "is_on": True}])
+        db.session.rollback()
+        # 之後的 commit 不會帶出已回滾的變更
+        db.session.commit()
+    assert DEVICE_STATE_CACHE.states()["客廳冷氣"] is False
+    assert client.get("/device/state").get_json()["state"]["客廳冷氣"] is False
+
+
+def test_device_list_loads_states_in_one_query(app, client):
+    client.patch("/device/toggle/bulk", json={"device_ids": [1, 3], "on": True})
+    with count_statements(app) as few:
+        client.get("/device/list")
+    for index in range(10):
+        client.post("/device/add", json={"device_name": f"燈 {index}", "device_type": "light", "user_id": 1})
+    with count_statements(app) as many:
+        data = client.get("/device/list").get_json()
+
+    assert len(few) == len(many)
+    devices = {d["device_id"]: d for d in data["devices"]}
+    assert len(devices) == 13
+    assert devices[1]["status"]["is_on"] is True
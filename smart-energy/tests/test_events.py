@@ -0,0 +1,59 @@
+# tests/test_events.py
+# 事件匯流排與 /events SSE（event_bus.py、feature_events.py）
+
+import json
+
+from event_bus import EventBus, EVENT_BUS
+
+
+def test_bus_replays_recent_events_and_resets_when_too_old():
+    bus = EventBus(history_size=3)
+    for n in range(5):
+        bus.publish("tick", {"n": n})
+
+    subscription, replay, needs_reset = bus.subscribe(last_event_id=3)
+    assert [e["id"] for e in replay] == [4, 5]
+    assert not needs_reset
+    # id 1 已不在緩衝區；id 99 不認得（伺服器重新啟動）
+    assert bus.subscribe(last_event_id=1)[2] is True
+    assert bus.subscribe(last_event_id=99)[2] is True
+    subscription.close()
+    assert bus.stats()["subscribers"] == 2
+
+
+def test_slow_subscriber_overflows_without_blocking_publishers():
+    bus = EventBus()
+    subscription, _, _ = bus.subscribe(buffer_size=2)
+    for n in range(5):
+        bus.publish("tick", {"n": n})
+    assert subscription.overflowed
+    assert bus.stats()["overflow_count"] == 1
+
+
+def test_stream_delivers_committed_state_changes(app, client):
+    app.config["EVENTS_HEARTBEAT_SECONDS"] = 0.05
+    baseline = EVENT_BUS.stats()["subscribers"]
+
+    resp = client.get("/events", buffered=False)
+    chunks = iter(resp.response)
+    assert next(chunks).decode().startswith("retry:")
+    client.patch("/device/toggle", json={"device_id": 1, "on": True})
+    event = next(chunks).decode()
+    assert "event: device_state" in event
+    data = json.loads(event.split("data: ", 1)[1])
+    assert data["devices"] == [{"device_id": 1, "is_on": True}]
+    assert next(chunks) == b": heartbeat\n\n"
+
+    resp.close()
+    assert EVENT_BUS.stats()["subscribers"] == baseline
+
+
+def test_stream_closed_before_reading_leaves_no_subscriber(client):
+    baseline = EVENT_BUS.stats()["subscribers"]
+    client.get("/events", buffered=False).close()
+    assert EVENT_BUS.stats()["subscribers"] == baseline
+
+
+def test_stream_rejects_when_full(client, monkeypatch):
+    monkeypatch.setattr(EVENT_BUS, "max_subscribers", EVENT_BUS.stats()["subscribers"])
+    assert client.get("/events").status_code == 503
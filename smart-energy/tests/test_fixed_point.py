@@ -0,0 +1,30 @@
+# tests/test_fixed_point.py
+# 整數單位的度數 / 電費換算（fixed_point.py）
+
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import literal, select
+from models import db
+from fixed_point import energy_units, cost_units, energy_units_sql, cost_units_sql, energy_value, cost_value
+
+
+@pytest.mark.parametrize("value, units", [
+    (None, 0), (3, 30000), (0.1, 1000), (Decimal("12.34565"), 123457), (1.00005, 10001), (-0.25, -2500)
+])
+def test_energy_units_round_half_up(value, units):
+    assert energy_units(value) == units
+
+
+def test_summing_units_avoids_float_drift():
+    assert 0.1 + 0.2 != 0.3
+    assert energy_value(energy_units(0.1) + energy_units(0.2)) == 0.3
+    assert cost_value(cost_units(1.005) + cost_units(2.675)) == 3.69
+
+
+def test_sql_helpers_match_python_conversion(app):
+    with app.app_context():
+        row = db.session.execute(select(
+            energy_units_sql(literal(12.3457)), cost_units_sql(literal(-2.68)), energy_units_sql(literal(None))
+        )).one()
+    assert tuple(row) == (energy_units(12.3457), cost_units(-2.68), 0)
@@ -0,0 +1,71 @@
+# tests/test_interval_usage.py
+# 區間用電與由區間產生的日紀錄（feature_interval_usage.py）
+
+from models import PowerLog
+from conftest import add_usage
+
+
+def _post(client, readings, **options):
+    return client.post("/usage/intervals", json=dict(options, readings=readings))
+
+
+def _daily_kwh(app, device_id, day):
+    with app.app_context():
+        log = PowerLog.query.filter_by(device_id=device_id, log_date=day).one()
+        return float(log.energy_consumed)
+
+
+def test_intervals_replace_manual_daily_value(app, client, assert_consistent):
+    add_usage(client, 1, "2025-06-12", 5)
+
+    resp = _post(client, [
+        {"device_id": 1, "start": f"2025-06-12T10:{m:02d}", "minutes": 15, "kwh": 0.25} for m in (0, 15, 30, 45)
+    ] + [{"device_id": 1, "start": "2025-06-12T11:00", "kwh": 1}])
+    assert resp.get_json() == {"ok": True, "inserted": 5, "updated": 0, "replaced": 0, "days_affected": 1}
+    assert _daily_kwh(app, 1, "2025-06-12") == 2
+
+    # 同一區間重送：覆蓋而不是相加
+    resp = _post(client, [{"device_id": 1, "start": "2025-06-12T11:00", "kwh": 0.5}])
+    assert resp.get_json()["updated"] == 1
+    assert _daily_kwh(app, 1, "2025-06-12") == 1.5
+
+    hourly = client.get("/usage/intervals?device_id=1&start=2025-06-12&end=2025-06-13T12:00").get_json()
+    assert hourly["resolution"] == "hour"
+    assert [p["kwh"] for p in hourly["points"]] == [1, 0.5]
+    assert_consistent()
+
+
+def test_sync_with_existing_logs_on_other_device_days(app, client, assert_consistent):
+    # 既有日紀錄只涵蓋部分 (設備, 日期)：先前會在同步時 KeyError
+    add_usage(client, 1, "2025-06-12", 2)
+
+    resp = _post(client, [
+        {"device_id": 1, "start": "2025-06-11T00:00", "kwh": 1},
+        {"device_id": 2, "start": "2025-06-12T00:00", "kwh": 1}
+    ])
+    assert resp.status_code == 200, resp.get_json()
+    assert _daily_kwh(app, 1, "2025-06-11") == 1
+    assert _daily_kwh(app, 1, "2025-06-12") == 2
+    assert _daily_kwh(app, 2, "2025-06-12") == 1
+    assert_consistent()
+
+
+def test_overlapping_interval_lengths(app, client, assert_consistent):
+    _post(client, [{"device_id": 1, "start": "2025-06-12T10:00", "minutes": 60, "kwh": 1}])
+
+    quarter = [{"device_id": 1, "start": "2025-06-12T10:15", "minutes": 15, "kwh": 0.3}]
+    resp = _post(client, quarter)
+    assert resp.status_code == 409
+    assert len(resp.get_json()["conflicts"]) == 1
+
+    resp = _post(client, quarter, replace_overlapping=True)
+    assert resp.get_json()["replaced"] == 1
+    assert _daily_kwh(app, 1, "2025-06-12") == 0.3
+
+    # 同一批中的讀數彼此重疊
+    resp = _post(client, [
+        {"device_id": 2, "start": "2025-06-12T10:00", "minutes": 60, "kwh": 1},
+        {"device_id": 2, "start": "2025-06-12T10:30", "minutes": 15, "kwh": 1}
+    ])
+    assert resp.status_code == 400
+    assert_consistent()
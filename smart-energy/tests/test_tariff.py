@@ -0,0 +1,60 @@
+# tests/test_tariff.py
+# 向量化累進費率計價（tariff.py）與 POST /usage/price
+
+import json
+
+import numpy as np
+import pytest
+from tariff import TAIPOWER_RATES, price_cumulative, marginal_cost_by_month
+
+
+def _bill_by_tiers(kwh, season):
+    """逐級距計算累積電費（對照用）"""
+    total, lower = 0.0, 0.0
+    for upper, rate in TAIPOWER_RATES[season]:
+        if kwh <= lower:
+            break
+        total += (min(kwh, upper) - lower) * rate
+        lower = upper
+    return total
+
+
+@pytest.mark.parametrize("season", ["summer", "non_summer"])
+def test_price_cumulative_matches_tier_loop(season):
+    kwh = np.array([0, 1, 119.5, 120, 120.01, 330, 499.99, 700, 1000, 1000.5, 2500])
+    expected = [_bill_by_tiers(k, season) for k in kwh]
+    assert np.allclose(price_cumulative(kwh, season), expected)
+
+
+def test_marginal_cost_uses_the_season_of_each_month():
+    costs = marginal_cost_by_month(np.array([100.0, 100.0]), np.array([150.0, 150.0]), [1, 7])
+    # 100 → 150 度：20 度第一級 + 30 度第二級（非夏月 2.26 / 夏月 2.55）
+    assert np.allclose(costs, [20 * 1.78 + 30 * 2.26, 20 * 1.78 + 30 * 2.55])
+
+
+def test_price_endpoint(client):
+    resp = client.post("/usage/price", json={"date": "2025-07-01", "kwh": [120, 330], "ranges": [[100, 150]]})
+    data = resp.get_json()
+    assert resp.status_code == 200
+    assert data["season"] == "summer"
+    assert data["bills"] == [213.6, 749.1]
+    assert data["marginal_costs"] == [112.1]
+
+
+def test_price_endpoint_rejects_unknown_season(client):
+    resp = client.post("/usage/price", json={"season": "winter", "kwh": [100]})
+    assert resp.status_code == 400
+    assert resp.get_json()["ok"] is False
+
+
+@pytest.mark.parametrize("body", [
+    {"date": 20250105, "kwh": [100]},
+    {"kwh": [float("nan")]},
+    {"kwh": [float("inf")]},
+    {"kwh": [-5]},
+    {"ranges": [[150, 100]]}
+])
+def test_price_endpoint_rejects_invalid_input(client, body):
+    resp = client.post("/usage/price", data=json.dumps(body), content_type="application/json")
+    assert resp.status_code == 400
+    assert resp.get_json()["ok"] is False
@@ -0,0 +1,45 @@
+# tests/test_usage_anomaly.py
+# 設備用電異常偵測（usage_anomaly.py）
+
+QUERY = "/usage/anomalies?baseline_days=28&by_weekday=false"
+
+
+def _seed(client, extra):
+    # 1/1 ~ 1/28 為基準：冷氣 9~11 度、臥室冷氣固定 5 度
+    records = [
+        {"device_id": 1, "date": f"2025-01-{day:02d}", "kwh": 9 + day % 3} for day in range(1, 29)
+    ] + [
+        {"device_id": 2, "date": f"2025-01-{day:02d}", "kwh": 5} for day in range(1, 29)
+    ] + [
+        {"device_id": device_id, "date": day, "kwh": kwh} for device_id, day, kwh in extra
+    ]
+    assert client.post("/usage/batch", json={"records": records}).get_json()["ok"]
+
+
+def test_spike_is_flagged_against_device_baseline(client):
+    _seed(client, [(1, "2025-01-29", 30), (2, "2025-01-29", 5)])
+
+    data = client.get(f"{QUERY}&start_date=2025-01-29&end_date=2025-01-29").get_json()
+
+    assert data["baseline"]["start"] == "2025-01-01"
+    assert data["scored_count"] == 2
+    assert [(a["device_id"], a["direction"], a["baseline_kwh"]) for a in data["anomalies"]] == [(1, "high", 10)]
+
+
+def test_incremental_scores_only_new_days_and_catches_flat_device_jumps(client):
+    _seed(client, [(1, "2025-01-29", 10), (2, "2025-01-29", 5), (1, "2025-01-30", 10), (2, "2025-01-30", 6)])
+
+    first = client.get(f"{QUERY}&start_date=2025-01-29&end_date=2025-01-29").get_json()
+    assert first["anomaly_count"] == 0
+
+    data = client.get(f"{QUERY}&start_date=2025-01-29&end_date=2025-01-30&incremental=true").get_json()
+    assert data["incremental"] is True
+    assert data["start"] == "2025-01-30"
+    assert data["scored_count"] == 2
+    # 用電固定的設備以離散程度下限（中位數 5%）評分：+1 度 → z = 4
+    assert [(a["device_id"], a["score"]) for a in data["anomalies"]] == [(2, 4.0)]
+
+
+def test_invalid_parameters_are_rejected(client):
+    assert client.get(f"{QUERY}&start_date=2025-01-30&end_date=2025-01-29").status_code == 400
+    assert client.get("/usage/anomalies?baseline_days=3").status_code == 400
@@ -0,0 +1,38 @@
+# tests/test_usage_batch.py
+# POST /usage/batch 的批次計價與寫入
+
+from models import PowerLog
+from conftest import add_usage
+
+
+def test_batch_prices_like_sequential_adds(client, assert_consistent):
+    add_usage(client, 3, "2025-01-01", 20)
+
+    resp = client.post("/usage/batch", json={"records": [
+        {"device_id": 1, "date": "2025-01-02", "kwh": 100},
+        {"device_id": 2, "date": "2025-01-01", "kwh": 80},
+        {"device_id": 3, "date": "2025-02-01", "kwh": 10}
+    ]})
+    data = resp.get_json()
+    assert resp.status_code == 200, data
+    costs = {r["date"]: r["cost"] for r in data["results"]}
+    # 1/1 共 100 度；1/2 補在其後：100 → 200 度
+    assert costs["2025-01-01"] == 80 * 1.78
+    assert costs["2025-01-02"] == round(20 * 1.78 + 80 * 2.26, 2)
+    # 跨月重新累計
+    assert costs["2025-02-01"] == 17.8
+    assert_consistent()
+
+
+def test_batch_rolls_back_when_a_record_conflicts(app, client):
+    add_usage(client, 1, "2025-01-01", 5)
+
+    resp = client.post("/usage/batch", json={"records": [
+        {"device_id": 2, "date": "2025-01-01", "kwh": 3},
+        {"device_id": 1, "date": "2025-01-01", "kwh": 4}
+    ]})
+    data = resp.get_json()
+    assert resp.status_code == 400
+    assert [r["index"] for r in data["results"] if not r["success"]] == [1]
+    with app.app_context():
+        assert PowerLog.query.count() == 1
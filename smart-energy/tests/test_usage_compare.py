@@ -0,0 +1,38 @@
+# tests/test_usage_compare.py
+# GET /usage/compare 多期間比較
+
+from conftest import add_usage
+
+
+def test_compare_many_months_in_one_request(client):
+    add_usage(client, 1, "2025-01-05", 100)
+    add_usage(client, 1, "2025-02-05", 50)
+    add_usage(client, 2, "2025-02-06", 25)
+
+    data = client.get("/usage/compare?period_type=month&periods=2025-01,2025-02,2025-03&baseline=2025-02").get_json()
+
+    assert [p["kwh"] for p in data["periods"]] == [100, 75, 0]
+    assert [p["record_count"] for p in data["periods"]] == [1, 2, 0]
+    assert data["baseline"] == "2025-02"
+    assert data["baseline_deltas"][0]["kwh_difference"] == 25
+    first_pair = data["pairwise"][0]
+    assert (first_pair["from"], first_pair["to"], first_pair["kwh_difference"]) == ("2025-01", "2025-02", -25)
+    assert data["pairwise"][1]["kwh_percent_change"] == -100
+    assert "comparison" not in data
+
+
+def test_legacy_two_date_form(client):
+    add_usage(client, 1, "2025-01-05", 10)
+    add_usage(client, 1, "2025-01-06", 15)
+
+    data = client.get("/usage/compare?period_type=day&date1=2025-01-05&date2=2025-01-06").get_json()
+    assert data["comparison"]["kwh_difference"] == 5
+    assert data["comparison"]["kwh_percent_change"] == 50
+    assert data["period1"]["label"] == "2025-01-05"
+
+
+def test_compare_rejects_bad_requests(client):
+    too_many = ",".join(f"20{y:02d}" for y in range(61))
+    assert client.get(f"/usage/compare?period_type=year&periods={too_many}").status_code == 400
+    assert client.get("/usage/compare?periods=2025-01&baseline=2025-05").status_code == 400
+    assert client.get("/usage/compare?period_type=week&periods=2025-01").status_code == 400
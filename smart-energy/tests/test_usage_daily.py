@@ -0,0 +1,38 @@
+# tests/test_usage_daily.py
+# /usage/daily 的當月累積與累進電費
+
+from conftest import add_usage
+
+
+def test_daily_progressive_cost_uses_running_month_total(client, assert_consistent):
+    add_usage(client, 1, "2025-01-01", 100)
+    add_usage(client, 2, "2025-01-02", 30)
+    add_usage(client, 3, "2025-01-02", 20)
+
+    data = client.get("/usage/daily?start_date=2025-01-01&end_date=2025-01-02").get_json()
+
+    assert data["2025-01-01"]["kwh"] == 100
+    assert data["2025-01-01"]["cost_progressive"] == 178.0
+    # 100 → 150 度：20 度 × 1.78 + 30 度 × 2.26
+    assert data["2025-01-02"]["kwh"] == 50
+    assert data["2025-01-02"]["cost_progressive"] == 103.4
+    assert data["2025-01-02"]["cost_sum"] == 103.4
+    assert sorted(d["device_id"] for d in data["2025-01-02"]["devices"]) == [2, 3]
+    assert_consistent()
+
+
+def test_daily_range_starting_mid_month_counts_earlier_usage(client):
+    add_usage(client, 1, "2025-01-01", 100)
+    add_usage(client, 1, "2025-01-02", 50)
+    add_usage(client, 1, "2025-02-01", 10)
+
+    data = client.get("/usage/daily?start_date=2025-01-02&end_date=2025-02-01").get_json()
+
+    assert list(data) == ["2025-01-02", "2025-02-01"]
+    assert data["2025-01-02"]["cost_progressive"] == 103.4
+    # 跨月後累積量歸零
+    assert data["2025-02-01"]["cost_progressive"] == 17.8
+
+
+def test_daily_without_logs_is_empty(client):
+    assert client.get("/usage/daily?start_date=2025-01-01&end_date=2025-01-07").get_json() == {}
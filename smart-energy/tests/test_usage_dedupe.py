@@ -0,0 +1,49 @@
+# tests/test_usage_dedupe.py
+# idempotency_key 去重（usage_dedupe.py）
+
+from models import db, PowerLog, UsageIdempotencyKey
+from usage_dedupe import purge_expired
+
+
+def test_add_retry_returns_first_result(app, client, assert_consistent):
+    body = {"device_id": 1, "day": "2025-01-01", "kwh": 3, "idempotency_key": "gw-1"}
+    first = client.post("/usage/add", json=body).get_json()
+    retry = client.post("/usage/add", json=dict(body, kwh=99)).get_json()
+
+    assert retry["replayed"] is True
+    assert retry["new_data"] == first["new_data"]
+    with app.app_context():
+        assert PowerLog.query.count() == 1
+    assert_consistent()
+
+
+def test_batch_reuses_keys_within_and_across_requests(app, client):
+    records = [
+        {"device_id": 1, "date": "2025-01-01", "kwh": 3, "idempotency_key": "a"},
+        {"device_id": 2, "date": "2025-01-01", "kwh": 4, "idempotency_key": "a"},
+        {"device_id": 3, "date": "2025-01-01", "kwh": 5, "idempotency_key": "b"}
+    ]
+    first = client.post("/usage/batch", json={"records": records}).get_json()
+    assert first["ok"] is True
+    assert first["results"][1]["replayed"] is True
+    assert first["results"][1]["log_id"] == first["results"][0]["log_id"]
+
+    again = client.post("/usage/batch", json={"records": records}).get_json()
+    assert again["ok"] is True
+    assert all(r["replayed"] for r in again["results"])
+    with app.app_context():
+        assert PowerLog.query.count() == 2
+
+
+def test_invalid_key_is_rejected(client):
+    resp = client.post("/usage/add", json={"device_id": 1, "kwh": 1, "idempotency_key": "x" * 129})
+    assert resp.status_code == 400
+
+
+def test_expired_keys_are_purged(app, client):
+    client.post("/usage/add", json={"device_id": 1, "day": "2025-01-01", "kwh": 3, "idempotency_key": "old"})
+    app.config["USAGE_IDEMPOTENCY_TTL_HOURS"] = 0
+    with app.app_context():
+        assert purge_expired() == 1
+        db.session.commit()
+        assert UsageIdempotencyKey.query.count() == 0
@@ -0,0 +1,29 @@
+# tests/test_usage_explain.py
+# 用電查詢的執行計畫檢查（usage_explain.py）
+
+from datetime import date
+
+import pytest
+from usage_explain import explain, run_plan_checks
+from models import db, PowerLog
+
+
+@pytest.mark.parametrize("sample_date", [date(2025, 6, 15), date(2025, 1, 1)])
+def test_every_plan_uses_an_index(app, sample_date):
+    with app.app_context():
+        results = run_plan_checks(sample_date)
+    assert results
+    for result in results:
+        assert result["uses_index"], (result["name"], result["plan"])
+
+
+def test_month_to_date_sum_excludes_deleted_devices(app):
+    with app.app_context():
+        result = next(r for r in run_plan_checks(date(2025, 6, 15)) if r["name"] == "month-to-date sum")
+    assert any("devices" in line for line in result["plan"])
+
+
+def test_full_scan_is_reported(app):
+    with app.app_context():
+        result = explain(db.session.query(PowerLog.log_id).filter(PowerLog.cost > 1))
+    assert not result["uses_index"]
@@ -0,0 +1,52 @@
+# tests/test_usage_forecast.py
+# 月底用電與電費預測（usage_forecast.py）
+
+from datetime import date
+
+import pytest
+from usage_forecast import forecast_month
+from usage_periods import resolve_period
+from conftest import add_usage
+
+
+@pytest.fixture
+def january(client):
+    # 1/1 ~ 1/10 每天冷氣 10 度、主燈 0.5 度
+    records = [
+        {"device_id": device_id, "date": f"2025-01-{day:02d}", "kwh": kwh}
+        for day in range(1, 11) for device_id, kwh in ((1, 10), (3, 0.5))
+    ]
+    assert client.post("/usage/batch", json={"records": records}).get_json()["ok"]
+    return resolve_period("month", "2025-01")
+
+
+def test_forecast_projects_month_end_and_tier_crossings(app, january):
+    with app.app_context():
+        result = forecast_month(january, date(2025, 1, 10), lookback_days=5, device_limit=1)
+
+    assert result["days_remaining"] == 21
+    assert result["month_to_date"]["kwh"] == 105
+    assert result["projected"]["daily_rate_kwh"] == 10.5
+    assert result["projected"]["kwh"] == 325.5
+    # 第一級 120 度：105 + 10.5 × 2 = 126 → 1/12 超過
+    assert result["tiers"][0]["projected_crossing"] == "2025-01-12"
+    assert result["tiers"][1]["projected_crossing"] is None
+    assert [d["device_id"] for d in result["devices"]] == [1]
+    assert result["devices"][0]["projected_kwh"] == 310
+
+
+def test_forecast_of_a_closed_month_uses_actual_crossings(app, client, january):
+    add_usage(client, 2, "2025-01-05", 50)
+    with app.app_context():
+        result = forecast_month(january, date(2025, 3, 1), lookback_days=28)
+
+    assert result["as_of"] == "2025-01-31"
+    assert result["days_remaining"] == 0
+    assert result["projected"]["kwh"] == result["month_to_date"]["kwh"] == 155
+    # 累積：1/6 113 度、1/7 123.5 度
+    assert result["tiers"][0]["crossed_on"] == "2025-01-07"
+    assert not result["tiers"][1]["crossed"]
+
+
+def test_forecast_rejects_bad_lookback(client):
+    assert client.get("/usage/forecast?month=2025-01&lookback_days=0").status_code == 400
@@ -0,0 +1,37 @@
+# tests/test_usage_ingest.py
+# /usage/add 的非同步寫入佇列（usage_ingest.py）
+
+import feature_daily_usage
+
+
+def _submit(client, device_id, day, kwh):
+    resp = client.post("/usage/add", json={"device_id": device_id, "day": day, "kwh": kwh, "async": True})
+    assert resp.status_code == 202, resp.get_json()
+    return resp.get_json()["ingestion_id"]
+
+
+def test_queued_records_are_written_and_priced(client, assert_consistent):
+    first = _submit(client, 1, "2025-01-01", 100)
+    second = _submit(client, 2, "2025-01-01", 50)
+    feature_daily_usage.INGEST_QUEUE.wait_until_empty()
+
+    results = [client.get(f"/usage/ingest/{i}").get_json() for i in (first, second)]
+    assert [r["status"] for r in results] == ["written", "written"]
+    # 同一批依序計價：第二筆從 100 度開始
+    assert results[1]["cost"] == round(20 * 1.78 + 30 * 2.26, 2)
+    status = client.get("/usage/ingest/status").get_json()
+    assert status["written_count"] == 2
+    assert status["queue_depth"] == 0
+    assert_consistent()
+
+
+def test_conflicting_record_fails_alone(client):
+    ok = _submit(client, 1, "2025-01-01", 5)
+    duplicate = _submit(client, 1, "2025-01-01", 6)
+    other = _submit(client, 2, "2025-01-01", 7)
+    feature_daily_usage.INGEST_QUEUE.wait_until_empty()
+
+    assert client.get(f"/usage/ingest/{ok}").get_json()["status"] == "written"
+    assert client.get(f"/usage/ingest/{duplicate}").get_json()["status"] == "failed"
+    assert client.get(f"/usage/ingest/{other}").get_json()["status"] == "written"
+    assert client.get("/usage/ingest/unknown").status_code == 404
@@ -0,0 +1,46 @@
+# tests/test_usage_logs.py
+# /usage/logs 的 keyset 分頁與 NDJSON 串流匯出
+
+import json
+
+from conftest import add_usage
+
+RANGE = "start_date=2025-05-01&end_date=2025-05-31"
+
+
+def _seed(client):
+    for day in ("2025-05-03", "2025-05-01", "2025-05-02"):
+        for device_id in (1, 2):
+            add_usage(client, device_id, day, 1.5)
+
+
+def test_pages_cover_every_log_once_in_order(client):
+    _seed(client)
+
+    seen, cursor = [], None
+    while True:
+        url = f"/usage/logs?{RANGE}&limit=4" + (f"&cursor={cursor}" if cursor else "")
+        data = client.get(url).get_json()
+        assert len(data["logs"]) <= 4
+        seen += [(log["log_date"], log["log_id"]) for log in data["logs"]]
+        cursor = data["next_cursor"]
+        if cursor is None:
+            break
+
+    assert len(seen) == 6
+    assert seen == sorted(seen)
+
+
+def test_ndjson_export_streams_one_log_per_line(client):
+    _seed(client)
+
+    resp = client.get(f"/usage/logs?{RANGE}&format=ndjson")
+    assert resp.mimetype == "application/x-ndjson"
+    rows = [json.loads(line) for line in resp.get_data(as_text=True).splitlines()]
+    assert len(rows) == 6
+    assert rows == client.get(f"/usage/logs?{RANGE}&limit=100").get_json()["logs"]
+
+
+def test_malformed_cursor_is_rejected(client):
+    resp = client.get(f"/usage/logs?{RANGE}&cursor=2025-05-01")
+    assert resp.status_code == 400
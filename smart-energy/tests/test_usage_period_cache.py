@@ -0,0 +1,38 @@
+# tests/test_usage_period_cache.py
+# 已結束期間的統計快取（usage_period_cache.py）
+
+from datetime import date
+
+from conftest import add_usage
+
+
+def _counts(client):
+    stats = client.get("/usage/cache/stats").get_json()
+    return stats["entries"], stats["hits"], stats["misses"]
+
+
+def test_closed_month_is_cached_until_written(client):
+    add_usage(client, 1, "2025-01-10", 10)
+    _, hits, misses = _counts(client)
+
+    assert client.get("/usage/monthly/2025/1").get_json()["total_kwh"] == 10
+    assert client.get("/usage/monthly/2025/1").get_json()["total_kwh"] == 10
+    assert _counts(client) == (1, hits + 1, misses + 1)
+
+    # 寫入該月份後快取失效，下一次重新計算
+    add_usage(client, 2, "2025-01-11", 5)
+    assert client.get("/usage/monthly/2025/1").get_json()["total_kwh"] == 15
+    assert client.get("/usage/yearly/2025").get_json()["total_kwh"] == 15
+    # 月摘要與年摘要各重新計算一次
+    assert _counts(client) == (2, hits + 1, misses + 3)
+
+
+def test_current_month_is_never_cached(client):
+    today = date.today()
+    add_usage(client, 1, str(today), 2)
+    before = _counts(client)
+
+    for _ in range(2):
+        assert client.get(f"/usage/monthly/{today.year}/{today.month}").get_json()["total_kwh"] == 2
+        client.get(f"/usage/compare?period_type=day&periods={today}")
+    assert _counts(client) == before
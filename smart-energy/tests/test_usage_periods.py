@@ -0,0 +1,39 @@
+# tests/test_usage_periods.py
+# 期間解析與 [start, end) 範圍條件（usage_periods.py）
+
+from datetime import date
+
+import pytest
+from models import db, PowerLog
+from usage_periods import resolve_period, resolve_date_range, month_to_date, in_period
+from conftest import add_usage
+
+
+@pytest.mark.parametrize("period_type, value, start, end", [
+    ("day", "2024-12-31", date(2024, 12, 31), date(2025, 1, 1)),
+    ("month", "2024-12", date(2024, 12, 1), date(2025, 1, 1)),
+    ("month", date(2024, 2, 29), date(2024, 2, 1), date(2024, 3, 1)),
+    ("year", "2024", date(2024, 1, 1), date(2025, 1, 1))
+])
+def test_periods_resolve_to_half_open_ranges(period_type, value, start, end):
+    period = resolve_period(period_type, value)
+    assert (period.start, period.end) == (start, end)
+
+
+def test_range_filters_include_boundary_days(app, client):
+    for day in ("2024-11-30", "2024-12-01", "2024-12-31", "2025-01-01"):
+        add_usage(client, 1, day, 1)
+
+    with app.app_context():
+        def count(period):
+            return db.session.query(PowerLog).filter(in_period(PowerLog.log_date, period)).count()
+
+        assert count(resolve_period("month", "2024-12")) == 2
+        assert count(resolve_date_range("2024-11-30", "2024-12-31")) == 3
+        assert count(month_to_date(date(2024, 12, 31), include_target_date=False)) == 1
+
+
+@pytest.mark.parametrize("period_type, value", [("month", "2024-13"), ("day", "2024/12/01"), ("week", "2024")])
+def test_invalid_periods_raise_value_error(period_type, value):
+    with pytest.raises(ValueError):
+        resolve_period(period_type, value)
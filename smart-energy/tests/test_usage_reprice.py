@@ -0,0 +1,44 @@
+# tests/test_usage_reprice.py
+# 補登 / 修改紀錄後的累進電費重新計價（usage_reprice.py）
+
+from datetime import date
+
+from models import db, PowerLog
+from usage_reprice import reprice_from, reprice_all
+from usage_rollup import rebuild_rollups
+from conftest import add_usage
+
+
+def _cost(app, device_id, day):
+    with app.app_context():
+        return float(PowerLog.query.filter_by(device_id=device_id, log_date=day).one().cost)
+
+
+def test_backdated_add_reprices_later_days_in_the_month(app, client, assert_consistent):
+    add_usage(client, 1, "2025-01-20", 100)
+    add_usage(client, 1, "2025-02-01", 100)
+    assert _cost(app, 1, "2025-01-20") == 178
+
+    result = add_usage(client, 2, "2025-01-05", 100)
+
+    assert result["debug_info"]["repriced_count"] == 1
+    # 1/20 改為從 100 度開始計價：20 度 × 1.78 + 80 度 × 2.26
+    assert _cost(app, 1, "2025-01-20") == 216.4
+    assert _cost(app, 1, "2025-02-01") == 178
+    assert_consistent()
+
+
+def test_reprice_from_includes_the_changed_day(app, client, assert_consistent):
+    add_usage(client, 1, "2025-01-05", 100)
+    add_usage(client, 2, "2025-01-05", 50)
+    with app.app_context():
+        PowerLog.query.filter_by(device_id=1).update({"energy_consumed": 10})
+        updated = reprice_from([date(2025, 1, 5)])
+        # 修改的紀錄本身與同日之後的紀錄都要重算
+        assert len(updated) == 2
+        assert reprice_all()["updated"] == 0
+        rebuild_rollups()
+        db.session.commit()
+    assert _cost(app, 1, "2025-01-05") == 17.8
+    assert _cost(app, 2, "2025-01-05") == 89
+    assert_consistent()
@@ -0,0 +1,78 @@
+# tests/test_usage_rollup.py
+# 日/月彙總表的增量維護與月帳本鎖定（usage_rollup.py）
+
+from datetime import date
+
+from models import db, PowerLog, UsageDailyRollup, UsageMonthlyRollup
+from usage_rollup import (
+    HOME_DEVICE_ID, _LOCKED_KEY, apply_usage_deltas, ledger_base_units, lock_month_ledgers, rebuild_rollups
+)
+from fixed_point import energy_units
+from conftest import add_usage, rollup_snapshot
+
+
+def test_writes_update_device_and_home_rollups(app, client, assert_consistent):
+    add_usage(client, 1, "2025-03-01", 10)
+    add_usage(client, 2, "2025-03-01", 5)
+    add_usage(client, 1, "2025-03-02", 2.5)
+
+    with app.app_context():
+        home_day = UsageDailyRollup.query.filter_by(device_id=HOME_DEVICE_ID, log_date=date(2025, 3, 1)).one()
+        assert float(home_day.energy_consumed) == 15
+        assert home_day.record_count == 2
+        device_month = UsageMonthlyRollup.query.filter_by(device_id=1, month_start=date(2025, 3, 1)).one()
+        assert float(device_month.energy_consumed) == 12.5
+        assert device_month.record_count == 2
+
+    monthly = client.get("/usage/monthly/2025/3").get_json()
+    assert monthly["total_kwh"] == 17.5
+    assert [d["record_count"] for d in monthly["daily_breakdown"]] == [2, 1]
+    bill = client.get("/usage/bill").get_json()
+    assert bill["total_kwh"] == 17.5
+    assert [m["month"] for m in bill["months"]] == ["2025-03"]
+    assert_consistent()
+
+
+def test_rebuild_picks_up_rows_written_outside_the_api(app, client):
+    add_usage(client, 1, "2025-03-01", 10)
+    with app.app_context():
+        db.session.add(PowerLog(device_id=2, log_date=date(2025, 4, 2), energy_consumed=4, cost=7.12))
+        db.session.commit()
+        stats = rebuild_rollups()
+        db.session.commit()
+        assert stats == {"daily_rows": 4, "monthly_rows": 4}
+        snapshot = rollup_snapshot()
+    assert (HOME_DEVICE_ID, date(2025, 4, 1), 4.0, 7.12, 1) in snapshot["monthly"]
+    assert client.get("/usage/yearly/2025").get_json()["total_kwh"] == 14
+
+
+def test_month_ledgers_are_created_locked_and_released(app):
+    with app.app_context():
+        ledgers = lock_month_ledgers([date(2025, 2, 1), date(2025, 1, 1)])
+        assert sorted(ledgers) == [date(2025, 1, 1), date(2025, 2, 1)]
+        assert db.session.info[_LOCKED_KEY] == {date(2025, 1, 1), date(2025, 2, 1)}
+        # 巢狀交易（savepoint）結束不釋放
+        with db.session.begin_nested():
+            pass
+        assert _LOCKED_KEY in db.session.info
+        db.session.commit()
+        assert _LOCKED_KEY not in db.session.info
+
+        # 尚未鎖定的月份在套用彙總變動時補鎖
+        apply_usage_deltas([(1, date(2025, 3, 4), 1, 1.78, 1)])
+        assert date(2025, 3, 1) in db.session.info[_LOCKED_KEY]
+        db.session.rollback()
+        assert _LOCKED_KEY not in db.session.info
+
+
+def test_ledger_base_excludes_later_days(app, client):
+    add_usage(client, 1, "2025-01-03", 10)
+    add_usage(client, 1, "2025-01-10", 20)
+    add_usage(client, 2, "2025-01-05", 5)
+
+    with app.app_context():
+        ledger = lock_month_ledgers([date(2025, 1, 1)])[date(2025, 1, 1)]
+        assert float(ledger.energy_consumed) == 35
+        assert ledger_base_units(ledger, date(2025, 1, 5)) == (energy_units(10), energy_units(5))
+        assert ledger_base_units(ledger, date(2025, 1, 31)) == (energy_units(35), 0)
+        db.session.rollback()
@@ -0,0 +1,211 @@
+# usage_anomaly.py
+# ==========================================
+# 設備用電異常偵測（/usage/anomalies、flask usage detect-anomalies）
+# - 一次查詢 power_logs，建立「設備 × 日期」的 NumPy 矩陣（沒有紀錄的日期為 NaN）
+# - 基準：評分區間之前 baseline_days 天，每個設備（可再依星期幾分組）的中位數與 MAD
+#   基準期間緊接在評分區間之前，因此會跟著季節移動
+# - 分數：robust z = 0.6745 × (用電 - 中位數) / MAD，|z| ≥ threshold 即視為異常
+#   （MAD 為 0 時改用平均絕對離差；離散程度設有下限，用電固定的設備也能偵測突增）
+# - 增量模式：沿用快取的基準，只對上次評分之後的新日期評分
+#
+# 注意：基準快取在行程記憶體中，重新啟動後第一次會重新計算
+# ==========================================
+
+from models import db, Device, PowerLog, not_deleted_device
+from datetime import timedelta
+import numpy as np
+import threading
+import warnings
+
+MAD_SCALE = 0.6745          # 讓 MAD 與常態分布的標準差一致
+MEAN_AD_SCALE = 1.2533      # 平均絕對離差 → 標準差
+MIN_BASELINE_SAMPLES = 3    # 每組基準至少需要的樣本數
+MIN_SIGMA_RATIO = 0.05      # 離散程度下限：中位數的 5%
+MIN_SIGMA_KWH = 0.01        # 離散程度下限（度）
+BASELINE_MAX_AGE_DAYS = 14  # 增量模式下，評分日期距基準結束超過幾天就重新計算
+
+_BASELINE_LOCK = threading.Lock()
+_BASELINE_CACHE = {}        # {(baseline_days, by_weekday): baseline dict}
+
+
+def _load_matrix(start, end):
+    """
+    一次查詢 [start, end] 的每日設備用電，建立 設備 × 日期 矩陣
+
+    Returns:
+        (device_ids, matrix)：matrix[i, j] = 設備 i 在 start + j 天的用電（無資料為 NaN）
+    """
+    n_days = (end - start).days + 1
+    rows = db.session.query(PowerLog.device_id, PowerLog.log_date, PowerLog.energy_consumed).filter(
+        PowerLog.log_date >= start,
+        PowerLog.log_date <= end,
+        not_deleted_device(PowerLog.device_id)
+    ).all()
+    if not rows:
+        return np.array([], dtype=np.int64), np.full((0, n_days), np.nan)
+
+    device_col = np.array([r[0] for r in rows], dtype=np.int64)
+    day_col = np.array([(r[1] - start).days for r in rows], dtype=np.int64)
+    kwh_col = np.array([float(r[2] or 0) for r in rows], dtype=float)
+
+    device_ids, device_idx = np.unique(device_col, return_inverse=True)
+    matrix = np.full((len(device_ids), n_days), np.nan)
+    matrix[device_idx, day_col] = kwh_col
+    return device_ids, matrix
+
+
+def _day_groups(start, n_days, by_weekday):
+    """每一天所屬的基準分組（依星期幾時為 0-6，否則都是 0）"""
+    if not by_weekday:
+        return np.zeros(n_days, dtype=np.int64)
+    return (start.weekday() + np.arange(n_days)) % 7
+
+
+def _compute_baseline(device_ids, matrix, groups, n_groups):
+    """
+    以 NumPy 計算每個設備、每個分組的中位數與離散程度（樣本不足時為 NaN）
+
+    Returns:
+        (median, sigma)：sigma 為換算成標準差尺度的 MAD（MAD 為 0 時用平均絕對離差，並套用下限）
+    """
+    median = np.full((len(device_ids), n_groups), np.nan)
+    sigma = np.full((len(device_ids), n_groups), np.nan)
+    with warnings.catch_warnings():
+        # 全部是 NaN 的列會產生 RuntimeWarning，結果仍是 NaN
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        for group in range(n_groups):
+            sub = matrix[:, groups == group]
+            if sub.shape[1] == 0:
+                continue
+            enough = np.sum(~np.isnan(sub), axis=1) >= MIN_BASELINE_SAMPLES
+            group_median = np.nanmedian(sub, axis=1)
+            deviation = np.abs(sub - group_median[:, None])
+            group_mad = np.nanmedian(deviation, axis=1)
+            group_sigma = np.where(
+                group_mad > 0, group_mad / MAD_SCALE, np.nanmean(deviation, axis=1) * MEAN_AD_SCALE
+            )
+            group_sigma = np.maximum(group_sigma, np.maximum(np.abs(group_median) * MIN_SIGMA_RATIO, MIN_SIGMA_KWH))
+            median[:, group] = np.where(enough, group_median, np.nan)
+            sigma[:, group] = np.where(enough, group_sigma, np.nan)
+    return median, sigma
+
+
+def _build_baseline(baseline_end, baseline_days, by_weekday):
+    """計算 baseline_end（含）之前 baseline_days 天的基準"""
+    baseline_start = baseline_end - timedelta(days=baseline_days - 1)
+    device_ids, matrix = _load_matrix(baseline_start, baseline_end)
+    groups = _day_groups(baseline_start, matrix.shape[1], by_weekday)
+    median, sigma = _compute_baseline(device_ids, matrix, groups, 7 if by_weekday else 1)
+    return {
+        "baseline_start": baseline_start,
+        "baseline_end": baseline_end,
+        "by_weekday": by_weekday,
+        "device_ids": device_ids,
+        "median": median,
+        "sigma": sigma,
+        "last_scored": baseline_end
+    }
+
+
+def _score(baseline, start, end, threshold):
+    """
+    以基準為 [start, end] 的每個設備日評分
+
+    Returns:
+        (scored_count, anomalies)
+    """
+    if start > end:
+        return 0, []
+    device_ids, matrix = _load_matrix(start, end)
+    if len(device_ids) == 0:
+        return 0, []
+
+    # 將新矩陣的設備對齊到基準的設備（基準中沒有的設備無法評分）
+    positions = np.searchsorted(baseline["device_ids"], device_ids)
+    positions = np.clip(positions, 0, max(len(baseline["device_ids"]) - 1, 0))
+    known = (
+        baseline["device_ids"][positions] == device_ids
+        if len(baseline["device_ids"]) else np.zeros(len(device_ids), dtype=bool)
+    )
+    if not known.any():
+        return 0, []
+
+    groups = _day_groups(start, matrix.shape[1], baseline["by_weekday"])
+    median = baseline["median"][positions[known]][:, groups]
+    sigma = baseline["sigma"][positions[known]][:, groups]
+    values = matrix[known]
+    kept_ids = device_ids[known]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        scores = (values - median) / sigma
+    scorable = ~np.isnan(values) & ~np.isnan(median) & (sigma > 0)
+    flagged = scorable & (np.abs(scores) >= threshold)
+
+    anomalies = [
+        {
+            "device_id": int(kept_ids[i]),
+            "date": (start + timedelta(days=int(j))).strftime("%Y-%m-%d"),
+            "kwh": round(float(values[i, j]), 4),
+            "baseline_kwh": round(float(median[i, j]), 4),
+            "score": round(float(scores[i, j]), 2),
+            "direction": "high" if scores[i, j] > 0 else "low"
+        }
+        for i, j in zip(*np.nonzero(flagged))
+    ]
+    return int(scorable.sum()), anomalies
+
+
+def detect_anomalies(start, end, baseline_days=56, by_weekday=True, threshold=3.5, incremental=False):
+    """
+    偵測 [start, end] 的設備用電異常
+
+    Args:
+        start / end: 評分區間（含頭尾）
+        baseline_days: 基準天數（評分區間之前）
+        by_weekday: 是否依星期幾分別計算基準
+        threshold: |robust z| 門檻
+        incremental: 沿用快取的基準，只評分上次評分之後到 end 的日期
+
+    Returns:
+        dict: 回應內容（不含 ok）
+    """
+    key = (baseline_days, by_weekday)
+    with _BASELINE_LOCK:
+        baseline = _BASELINE_CACHE.get(key)
+        reuse = (
+            incremental and baseline is not None
+            and (end - baseline["baseline_end"]).days <= BASELINE_MAX_AGE_DAYS
+        )
+        if reuse:
+            start = baseline["last_scored"] + timedelta(days=1)
+        else:
+            baseline = _build_baseline(start - timedelta(days=1), baseline_days, by_weekday)
+
+        scored_count, anomalies = _score(baseline, start, end, threshold)
+        baseline["last_scored"] = max(baseline["last_scored"], end)
+        _BASELINE_CACHE[key] = baseline
+
+    names = dict(
+        db.session.query(Device.device_id, Device.device_name).filter(
+            Device.device_id.in_({a["device_id"] for a in anomalies})
+        ).all()
+    ) if anomalies else {}
+    for anomaly in anomalies:
+        anomaly["device_name"] = names.get(anomaly["device_id"], f"Device {anomaly['device_id']}")
+    anomalies.sort(key=lambda a: -abs(a["score"]))
+
+    return {
+        "start": start.strftime("%Y-%m-%d"),
+        "end": end.strftime("%Y-%m-%d"),
+        "incremental": reuse,
+        "baseline": {
+            "start": baseline["baseline_start"].strftime("%Y-%m-%d"),
+            "end": baseline["baseline_end"].strftime("%Y-%m-%d"),
+            "by_weekday": by_weekday,
+            "method": "median/MAD"
+        },
+        "threshold": threshold,
+        "scored_count": scored_count,
+        "anomaly_count": len(anomalies),
+        "anomalies": anomalies
+    }
@@ -0,0 +1,81 @@
+# usage_dedupe.py
+# ==========================================
+# 用電寫入的 idempotency_key 去重
+# - 裝置閘道逾時重送時帶相同 idempotency_key，直接回傳第一次的結果
+# - 結果存在 usage_idempotency_keys 表，超過 TTL 的紀錄視為不存在
+# - purge_expired() 清除過期紀錄（flask usage purge-idempotency）
+#
+# 注意：本模組的函式都「不會 commit」，與 power_logs 寫入放在同一交易
+# ==========================================
+
+from flask import current_app
+from models import db, UsageIdempotencyKey
+from datetime import datetime, timedelta
+import json
+
+MAX_KEY_LENGTH = 128
+
+
+def validate_key(key):
+    """檢查 idempotency_key 格式（None 表示未提供），不合法時丟出 ValueError"""
+    if key is None:
+        return None
+    if not isinstance(key, str) or not key or len(key) > MAX_KEY_LENGTH:
+        raise ValueError(f"idempotency_key 必須是 1-{MAX_KEY_LENGTH} 字元的字串")
+    return key
+
+
+def _cutoff():
+    """早於此時間建立的紀錄視為過期"""
+    hours = current_app.config.get("USAGE_IDEMPOTENCY_TTL_HOURS", 24)
+    return datetime.now() - timedelta(hours=hours)
+
+
+def find_replays(keys):
+    """
+    一次查出已處理過（且未過期）的 idempotency_key
+
+    Returns:
+        dict: {idempotency_key: 原始結果 dict}
+    """
+    keys = {k for k in keys if k}
+    if not keys:
+        return {}
+    rows = UsageIdempotencyKey.query.filter(
+        UsageIdempotencyKey.idempotency_key.in_(keys),
+        UsageIdempotencyKey.created_at >= _cutoff()
+    ).all()
+    return {row.idempotency_key: json.loads(row.result) for row in rows}
+
+
+def remember_results(items):
+    """
+    記錄 idempotency_key 的處理結果（不 commit）
+
+    Args:
+        items: 可迭代的 (idempotency_key, log_id, result dict)
+    """
+    rows = [
+        {
+            "idempotency_key": key,
+            "log_id": log_id,
+            "result": json.dumps(result, ensure_ascii=False),
+            "created_at": datetime.now()
+        }
+        for key, log_id, result in items if key
+    ]
+    if not rows:
+        return
+    # 同 key 的過期紀錄先刪除，避免違反唯一索引
+    UsageIdempotencyKey.query.filter(
+        UsageIdempotencyKey.idempotency_key.in_([r["idempotency_key"] for r in rows]),
+        UsageIdempotencyKey.created_at < _cutoff()
+    ).delete(synchronize_session=False)
+    db.session.execute(UsageIdempotencyKey.__table__.insert(), rows)
+
+
+def purge_expired():
+    """刪除所有過期的去重紀錄（不 commit），回傳刪除筆數"""
+    return UsageIdempotencyKey.query.filter(
+        UsageIdempotencyKey.created_at < _cutoff()
+    ).delete(synchronize_session=False)
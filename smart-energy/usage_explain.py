@@ -0,0 +1,120 @@
+# usage_explain.py
+# ==========================================
+# 用電查詢的執行計畫檢查（flask usage explain）
+# - 對各端點使用的代表性查詢執行 EXPLAIN，確認是以索引存取（range / ref），
+#   而不是整表掃描
+# - 支援 SQLite（EXPLAIN QUERY PLAN）與 MySQL（EXPLAIN）
+#
+# 注意：MySQL 在資料量很小時可能直接選擇整表掃描，請在有實際資料量的資料庫上執行
+# ==========================================
+
+from models import db, PowerLog, UsageDailyRollup, UsageMonthlyRollup, not_deleted_device
+from datetime import date
+from sqlalchemy import func, or_
+from usage_rollup import HOME_DEVICE_ID
+from usage_periods import resolve_period, resolve_date_range, month_to_date, in_period
+
+# MySQL EXPLAIN 中代表整表 / 整個索引掃描的存取類型
+_MYSQL_FULL_SCAN_TYPES = ("ALL", "index")
+
+
+def _bind_params(compiled):
+    """取得編譯後的參數（日期轉成字串，兩種資料庫都能直接比較）"""
+    def convert(value):
+        return value.isoformat() if isinstance(value, date) else value
+
+    if compiled.positional:
+        return tuple(convert(compiled.params[name]) for name in compiled.positiontup)
+    return {name: convert(value) for name, value in compiled.params.items()}
+
+
+def explain(query):
+    """
+    對查詢執行 EXPLAIN
+
+    Args:
+        query: ORM Query 或 Select
+
+    Returns:
+        dict: {"plan": [執行計畫每一行], "uses_index": bool}
+    """
+    statement = getattr(query, "statement", query)
+    bind = db.session.get_bind()
+    dialect = bind.dialect.name
+    compiled = statement.compile(dialect=bind.dialect)
+    connection = db.session.connection()
+
+    if dialect == "sqlite":
+        rows = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}", _bind_params(compiled)).fetchall()
+        plan = [row[-1] for row in rows]
+        # SEARCH = 以索引定位；SCAN（即使 USING INDEX）= 逐筆掃描整個表或索引
+        uses_index = not any(
+            line.startswith("SCAN ") and "CONSTANT ROW" not in line for line in plan
+        )
+    elif dialect == "mysql":
+        rows = connection.exec_driver_sql(f"EXPLAIN {compiled}", _bind_params(compiled)).mappings().all()
+        plan = [f"{row['table']} type={row['type']} key={row['key']} rows={row['rows']}" for row in rows]
+        uses_index = all(row["type"] not in _MYSQL_FULL_SCAN_TYPES and row["key"] for row in rows)
+    else:
+        raise ValueError(f"不支援的資料庫: {dialect}")
+
+    return {"plan": plan, "uses_index": uses_index}
+
+
+def usage_plan_checks(sample_date=None):
+    """
+    各用電端點的代表性查詢
+
+    Returns:
+        list: [(名稱, query)]
+    """
+    from feature_daily_usage import _logs_keyset_query
+
+    sample_date = sample_date or date.today()
+    month = resolve_period("month", sample_date)
+    year = resolve_period("year", sample_date)
+    last_year = resolve_period("year", sample_date.year - 1)
+    week = resolve_date_range(date.fromordinal(sample_date.toordinal() - 6), sample_date)
+
+    return [
+        # /usage/daily、/usage/logs
+        ("logs date range", _logs_keyset_query(week.start, sample_date)),
+        ("logs keyset page", _logs_keyset_query(week.start, sample_date, (week.start, 0)).limit(100)),
+        # /usage/add 等寫入的月累積基準、重新計價
+        ("month-to-date sum", db.session.query(func.sum(PowerLog.energy_consumed)).filter(
+            in_period(PowerLog.log_date, month_to_date(sample_date, include_target_date=False)),
+            not_deleted_device(PowerLog.device_id)
+        )),
+        ("device month logs", db.session.query(PowerLog.log_id).filter(
+            PowerLog.device_id == 1,
+            in_period(PowerLog.log_date, month)
+        )),
+        # /usage/monthly
+        ("monthly summary", db.session.query(UsageDailyRollup.log_date, UsageDailyRollup.energy_consumed).filter(
+            UsageDailyRollup.device_id == HOME_DEVICE_ID,
+            in_period(UsageDailyRollup.log_date, month)
+        )),
+        # /usage/yearly
+        ("yearly summary", db.session.query(UsageMonthlyRollup.month_start, UsageMonthlyRollup.energy_consumed).filter(
+            UsageMonthlyRollup.device_id == HOME_DEVICE_ID,
+            in_period(UsageMonthlyRollup.month_start, year)
+        )),
+        # /usage/compare（多個年份）
+        ("compare years", db.session.query(UsageMonthlyRollup.month_start, UsageMonthlyRollup.energy_consumed).filter(
+            UsageMonthlyRollup.device_id == HOME_DEVICE_ID,
+            or_(in_period(UsageMonthlyRollup.month_start, last_year), in_period(UsageMonthlyRollup.month_start, year))
+        ))
+    ]
+
+
+def run_plan_checks(sample_date=None):
+    """
+    執行所有代表性查詢的 EXPLAIN
+
+    Returns:
+        list: [{"name", "uses_index", "plan"}]
+    """
+    return [
+        dict(explain(query), name=name)
+        for name, query in usage_plan_checks(sample_date)
+    ]
@@ -0,0 +1,180 @@
+# usage_forecast.py
+# ==========================================
+# 當月用電與電費預測（/usage/forecast）
+# - 資料來源為 usage_daily_rollup（不讀 power_logs）：
+#   一次 GROUP BY 取得每個設備「當月累積」與「近 N 天用電」，再讀全戶當月每日用電
+# - 每個設備的日平均 = 近 N 天用電 / N，預測月底度數 = 當月累積 + 日平均 × 剩餘天數
+#   全部以 NumPy 陣列一次計算，設備數量只影響陣列長度
+# - 以台電累進費率計算預測電費，並估計各級距上限被超過的日期
+# - 查詢結果依 (月份, 截止日, 天數) 快取，任何用電寫入（PERIOD_CACHE.generation 改變）後失效，
+#   儀表板輪詢時只需在記憶體中計算
+# ==========================================
+
+from models import db, Device, UsageDailyRollup
+from datetime import timedelta
+from sqlalchemy import func, case, and_
+from usage_rollup import HOME_DEVICE_ID
+from usage_period_cache import PERIOD_CACHE
+from fixed_point import ENERGY_SCALE, energy_units_sql
+from tariff import TAIPOWER_RATES, season_of, price_cumulative
+import numpy as np
+
+_SUMS_CACHE = {}          # {(month_label, mtd_end, lookback_days): (generation, sums)}
+_SUMS_CACHE_SIZE = 32
+
+
+def _load_device_sums(window_start, month, mtd_end):
+    """
+    一次查詢每個設備（含全戶）的近 N 天與當月累積用電
+
+    Returns:
+        (device_ids, window_units, mtd_units) 三個 ndarray
+    """
+    energy = energy_units_sql(UsageDailyRollup.energy_consumed)
+    rows = db.session.query(
+        UsageDailyRollup.device_id,
+        func.sum(case((UsageDailyRollup.log_date >= window_start, energy), else_=0)),
+        func.sum(case((and_(UsageDailyRollup.log_date >= month.start,
+                            UsageDailyRollup.log_date <= mtd_end), energy), else_=0))
+    ).filter(
+        UsageDailyRollup.log_date >= min(window_start, month.start),
+        UsageDailyRollup.log_date <= mtd_end
+    ).group_by(UsageDailyRollup.device_id).all()
+
+    device_ids = np.array([r[0] for r in rows], dtype=np.int64)
+    window_units = np.array([r[1] for r in rows], dtype=np.int64)
+    mtd_units = np.array([r[2] for r in rows], dtype=np.int64)
+    return device_ids, window_units, mtd_units
+
+
+def _load_home_days(month, mtd_end):
+    """全戶當月每日用電（依日期排序）"""
+    rows = db.session.query(UsageDailyRollup.log_date, energy_units_sql(UsageDailyRollup.energy_consumed)).filter(
+        UsageDailyRollup.device_id == HOME_DEVICE_ID,
+        UsageDailyRollup.log_date >= month.start,
+        UsageDailyRollup.log_date <= mtd_end
+    ).order_by(UsageDailyRollup.log_date).all()
+    return [r[0] for r in rows], np.array([r[1] for r in rows], dtype=np.int64)
+
+
+def _cached_sums(month, mtd_end, window_start, lookback_days):
+    """讀取（必要時查詢並快取）預測所需的彙總資料"""
+    key = (month.label, mtd_end, lookback_days)
+    generation = PERIOD_CACHE.generation
+    cached = _SUMS_CACHE.get(key)
+    if cached is not None and cached[0] == generation:
+        return cached[1]
+
+    sums = _load_device_sums(window_start, month, mtd_end) + _load_home_days(month, mtd_end)
+    # 查詢期間有新的寫入時不存入，避免快取舊資料
+    if PERIOD_CACHE.generation == generation:
+        if len(_SUMS_CACHE) >= _SUMS_CACHE_SIZE:
+            _SUMS_CACHE.clear()
+        _SUMS_CACHE[key] = (generation, sums)
+    return sums
+
+
+def forecast_month(month, as_of, lookback_days=28, device_limit=20):
+    """
+    預測某月份月底的用電量與電費
+
+    Args:
+        month: 月份 Period（見 usage_periods.py）
+        as_of: 資料截止日（通常是今天）
+        lookback_days: 計算日平均的天數
+        device_limit: 回傳預測用電最高的前幾個設備
+
+    Returns:
+        dict: 回應內容（不含 ok）
+    """
+    month_last_day = month.end - timedelta(days=1)
+    mtd_end = min(as_of, month_last_day)
+    first_remaining_day = max(as_of + timedelta(days=1), month.start)
+    days_remaining = max((month.end - first_remaining_day).days, 0)
+    # 日平均以截止日（已結束的月份為月底）往前 N 天計算
+    window_start = mtd_end - timedelta(days=lookback_days - 1)
+
+    device_ids, window_units, mtd_units, home_days, home_day_units = _cached_sums(
+        month, mtd_end, window_start, lookback_days
+    )
+
+    # 每個設備的日平均與預測（度）
+    daily_rate = window_units / ENERGY_SCALE / lookback_days
+    projected = mtd_units / ENERGY_SCALE + daily_rate * days_remaining
+
+    is_home = device_ids == HOME_DEVICE_ID
+    home_mtd = float(mtd_units[is_home].sum()) / ENERGY_SCALE
+    home_rate = float(daily_rate[is_home].sum())
+    home_projected = float(projected[is_home].sum())
+
+    season = season_of(month.start)
+    bills = price_cumulative(np.array([home_mtd, home_projected]), season)
+
+    # 各級距上限：已超過的從實際每日累積找出日期，未超過的依日平均推估
+    limits = np.array([limit for limit, _ in TAIPOWER_RATES[season][:-1]], dtype=float)
+    cumulative = np.cumsum(home_day_units) / ENERGY_SCALE
+    crossed_idx = np.searchsorted(cumulative, limits, side="right")
+    if home_rate > 0:
+        days_to_cross = np.floor((limits - home_mtd) / home_rate).astype(np.int64) + 1
+    else:
+        days_to_cross = np.full(len(limits), days_remaining + 1, dtype=np.int64)
+
+    tiers = []
+    for tier, (limit, (_, rate), idx, days) in enumerate(
+        zip(limits.tolist(), TAIPOWER_RATES[season], crossed_idx.tolist(), days_to_cross.tolist()), start=1
+    ):
+        crossed = idx < len(home_days)
+        projected_date = None
+        if not crossed and 1 <= days <= days_remaining:
+            projected_date = first_remaining_day + timedelta(days=days - 1)
+        tiers.append({
+            "tier": tier,
+            "upper_kwh": limit,
+            "rate": rate,
+            "crossed": crossed,
+            "crossed_on": home_days[idx].strftime("%Y-%m-%d") if crossed else None,
+            "projected_crossing": projected_date.strftime("%Y-%m-%d") if projected_date else None
+        })
+
+    # 預測用電最高的設備
+    device_mask = ~is_home
+    order = np.argsort(-projected[device_mask], kind="stable")[:device_limit]
+    top_ids = device_ids[device_mask][order]
+    top_rate = daily_rate[device_mask][order]
+    top_mtd = mtd_units[device_mask][order] / ENERGY_SCALE
+    top_projected = projected[device_mask][order]
+    names = dict(
+        db.session.query(Device.device_id, Device.device_name).filter(
+            Device.device_id.in_(top_ids.tolist())
+        ).all()
+    ) if len(top_ids) else {}
+
+    return {
+        "month": month.label,
+        "as_of": mtd_end.strftime("%Y-%m-%d") if mtd_end >= month.start else None,
+        "season": season,
+        "lookback_days": lookback_days,
+        "days_remaining": days_remaining,
+        "month_to_date": {
+            "kwh": round(home_mtd, 2),
+            "bill": round(float(bills[0]), 2)
+        },
+        "projected": {
+            "kwh": round(home_projected, 2),
+            "bill": round(float(bills[1]), 2),
+            "daily_rate_kwh": round(home_rate, 2)
+        },
+        "tiers": tiers,
+        "devices": [
+            {
+                "device_id": device_id,
+                "device_name": names.get(device_id, f"Device {device_id}"),
+                "month_to_date_kwh": round(mtd, 2),
+                "daily_rate_kwh": round(rate, 2),
+                "projected_kwh": round(proj, 2)
+            }
+            for device_id, mtd, rate, proj in zip(
+                top_ids.tolist(), top_mtd.tolist(), top_rate.tolist(), top_projected.tolist()
+            )
+        ]
+    }
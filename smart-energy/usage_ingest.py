@@ -0,0 +1,173 @@
+# usage_ingest.py
+# ==========================================
+# 用電紀錄的非同步寫入佇列（write-behind）
+# - API 驗證完資料後立即回傳 ingestion_id，資料放進有上限的記憶體佇列
+# - 背景執行緒每 N 毫秒或累積 N 筆，就把資料合併成一個交易寫入
+# - 提供佇列深度、寫入延遲等統計，以及每筆 ingestion_id 的處理結果
+#
+# 注意：佇列在行程記憶體中，行程結束時尚未寫入的資料會遺失
+# ==========================================
+
+from collections import OrderedDict
+from datetime import datetime
+from app_metrics import get_logger
+import queue
+import threading
+import time
+import uuid
+
+log = get_logger("usage_ingest")
+
+
+class IngestQueue:
+    """
+    有上限的寫入佇列 + 背景批次寫入執行緒
+
+    Args:
+        write_batch: 寫入函式，接收 entry 列表，回傳對應順序的結果 dict 列表
+                     （會在 app context 中呼叫）
+        max_size: 佇列上限，滿了之後 submit() 會丟出 queue.Full
+        flush_interval_ms: 最長等待多久就寫入一次
+        flush_max_records: 累積多少筆就立即寫入
+        result_cache_size: 保留多少筆 ingestion 結果供查詢
+    """
+
+    def __init__(self, write_batch, max_size=10000, flush_interval_ms=200,
+                 flush_max_records=500, result_cache_size=10000):
+        self._write_batch = write_batch
+        self._queue = queue.Queue(maxsize=max_size)
+        self.max_size = max_size
+        self.flush_interval_ms = flush_interval_ms
+        self.flush_max_records = flush_max_records
+        self._result_cache_size = result_cache_size
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._app = None
+
+        # 統計
+        self.accepted_count = 0
+        self.written_count = 0
+        self.failed_count = 0
+        self.flush_count = 0
+        self.last_flush_at = None
+        self.last_flush_size = 0
+        self.last_flush_lag_ms = None
+
+    # ------------------------------------------
+    # 對外介面
+    # ------------------------------------------
+
+    def start(self, app):
+        """啟動背景寫入執行緒（重複呼叫不會重複啟動）"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._app = app
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def submit(self, entry):
+        """
+        將一筆已驗證的資料放入佇列
+
+        Returns:
+            str: ingestion_id
+        Raises:
+            queue.Full: 佇列已滿
+        """
+        ingestion_id = uuid.uuid4().hex
+        item = {
+            "ingestion_id": ingestion_id,
+            "entry": entry,
+            "enqueued_at": time.monotonic()
+        }
+        self._queue.put_nowait(item)
+        with self._lock:
+            self.accepted_count += 1
+            self._remember(ingestion_id, {"status": "queued"})
+        return ingestion_id
+
+    def get_result(self, ingestion_id):
+        """取得某筆 ingestion 的處理狀態（不存在回傳 None）"""
+        with self._lock:
+            return self._results.get(ingestion_id)
+
+    def wait_until_empty(self):
+        """阻塞直到目前佇列中的資料都寫入完成"""
+        self._queue.join()
+
+    def stats(self):
+        """佇列深度與寫入延遲統計"""
+        with self._queue.mutex:
+            depth = len(self._queue.queue)
+            oldest = self._queue.queue[0]["enqueued_at"] if depth else None
+        with self._lock:
+            return {
+                "running": self._thread is not None and self._thread.is_alive(),
+                "queue_depth": depth,
+                "queue_max_size": self.max_size,
+                "oldest_pending_ms": round((time.monotonic() - oldest) * 1000, 1) if oldest else 0,
+                "flush_interval_ms": self.flush_interval_ms,
+                "flush_max_records": self.flush_max_records,
+                "accepted_count": self.accepted_count,
+                "written_count": self.written_count,
+                "failed_count": self.failed_count,
+                "flush_count": self.flush_count,
+                "last_flush_at": self.last_flush_at.strftime("%Y-%m-%d %H:%M:%S") if self.last_flush_at else None,
+                "last_flush_size": self.last_flush_size,
+                "last_flush_lag_ms": self.last_flush_lag_ms
+            }
+
+    # ------------------------------------------
+    # 背景執行緒
+    # ------------------------------------------
+
+    def _remember(self, ingestion_id, result):
+        """記錄處理結果（超過上限時丟掉最舊的，需持有 _lock）"""
+        self._results[ingestion_id] = result
+        self._results.move_to_end(ingestion_id)
+        while len(self._results) > self._result_cache_size:
+            self._results.popitem(last=False)
+
+    def _collect(self):
+        """等待第一筆資料，之後在時間或筆數上限內盡量多收集"""
+        items = [self._queue.get()]
+        deadline = time.monotonic() + self.flush_interval_ms / 1000
+        while len(items) < self.flush_max_records:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                items.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return items
+
+    def _run(self):
+        while True:
+            items = self._collect()
+            try:
+                with self._app.app_context():
+                    results = self._write_batch([item["entry"] for item in items])
+            except Exception as e:
+                log.exception("Flushing %d queued usage records failed", len(items))
+                results = [{"success": False, "error": str(e)} for _ in items]
+
+            now = time.monotonic()
+            with self._lock:
+                for item, result in zip(items, results):
+                    self._remember(item["ingestion_id"], dict(
+                        result, status="written" if result.get("success") else "failed"
+                    ))
+                    if result.get("success"):
+                        self.written_count += 1
+                    else:
+                        self.failed_count += 1
+                self.flush_count += 1
+                self.last_flush_at = datetime.now()
+                self.last_flush_size = len(items)
+                self.last_flush_lag_ms = round((now - items[0]["enqueued_at"]) * 1000, 1)
+
+            for _ in items:
+                self._queue.task_done()
@@ -0,0 +1,174 @@
+# usage_period_cache.py
+# ==========================================
+# 已結束期間的統計結果快取（/usage/monthly、/usage/yearly、/usage/compare）
+# - 以 (期間類型, 期間標籤) 為 key，例如 ("month", "2025-06")
+# - 只快取「已結束」的期間（今天之前的日、本月之前的月、今年之前的年），視為不變
+# - 寫入彙總表時（見 usage_rollup.apply_usage_deltas）記下受影響的日期，
+#   交易 commit 後讓涵蓋這些日期的快取失效；寫入當下也先失效一次
+# - 提供命中 / 未命中次數統計
+#
+# 注意：快取在行程記憶體中，多個 worker 行程之間不會互相通知失效
+# ==========================================
+
+from datetime import date
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+import threading
+
+# 期間類型：day / month / year 供 /compare 使用；monthly / yearly 為兩個摘要端點的完整結果
+DAY_TYPES = ("day",)
+MONTH_TYPES = ("month", "monthly")
+YEAR_TYPES = ("year", "yearly")
+
+_DIRTY_KEY = "usage_period_cache_dirty"
+
+
+def labels_for_date(target_date):
+    """取得涵蓋某日期的所有快取 key"""
+    day_label = target_date.strftime("%Y-%m-%d")
+    month_label = target_date.strftime("%Y-%m")
+    year_label = str(target_date.year)
+    return (
+        [(t, day_label) for t in DAY_TYPES]
+        + [(t, month_label) for t in MONTH_TYPES]
+        + [(t, year_label) for t in YEAR_TYPES]
+    )
+
+
+def is_closed(period_type, label, today=None):
+    """
+    判斷期間是否已結束
+
+    Args:
+        period_type: day / month / monthly / year / yearly
+        label: YYYY-MM-DD / YYYY-MM / YYYY
+    """
+    today = today or date.today()
+    if period_type in DAY_TYPES:
+        return label < today.strftime("%Y-%m-%d")
+    if period_type in MONTH_TYPES:
+        return label < today.strftime("%Y-%m")
+    if period_type in YEAR_TYPES:
+        return int(label) < today.year
+    return False
+
+
+class PeriodCache:
+    """已結束期間的統計結果快取（執行緒安全）"""
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._generation = 0     # 每次失效 +1，避免計算期間被失效的舊結果寫回快取
+
+    @property
+    def generation(self):
+        """每次有寫入（失效）就會改變，供其他依彙總表計算的快取判斷是否過期"""
+        return self._generation
+
+    def get_or_compute(self, period_type, label, compute):
+        """
+        已結束的期間先查快取，未命中時呼叫 compute() 並存入；
+        進行中的期間每次都重新計算（不計入命中統計）
+        """
+        if not is_closed(period_type, label):
+            return compute()
+
+        key = (period_type, label)
+        with self._lock:
+            if key in self._data:
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            generation = self._generation
+
+        value = compute()
+        with self._lock:
+            if generation == self._generation:
+                self._data[key] = value
+        return value
+
+    def get_many_or_compute(self, period_type, labels, compute_many):
+        """
+        多個期間一起查詢：已結束且已快取的直接回傳，其餘以 compute_many(labels)
+        一次計算（回傳 {label: value}），已結束的結果再存入快取
+
+        Returns:
+            dict: {label: value}
+        """
+        results = {}
+        missing = []
+        with self._lock:
+            generation = self._generation
+            for label in labels:
+                key = (period_type, label)
+                closed = is_closed(period_type, label)
+                if closed and key in self._data:
+                    self.hits += 1
+                    results[label] = self._data[key]
+                    continue
+                if closed:
+                    self.misses += 1
+                missing.append(label)
+
+        if missing:
+            computed = compute_many(missing)
+            results.update(computed)
+            with self._lock:
+                if generation == self._generation:
+                    for label in missing:
+                        if is_closed(period_type, label):
+                            self._data[(period_type, label)] = computed[label]
+        return results
+
+    def invalidate_dates(self, dates):
+        """讓涵蓋指定日期的快取失效"""
+        keys = {key for d in dates for key in labels_for_date(d)}
+        with self._lock:
+            self._generation += 1
+            for key in keys:
+                if self._data.pop(key, None) is not None:
+                    self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self.invalidations += len(self._data)
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+                "invalidations": self.invalidations
+            }
+
+
+PERIOD_CACHE = PeriodCache()
+
+
+def mark_dates_changed(session, dates):
+    """
+    記錄本交易中有變動的日期（由彙總表維護函式呼叫）
+
+    立即失效一次，commit 後再失效一次：避免其他請求在 commit 前讀到舊資料並重新存入快取。
+    """
+    dates = set(dates)
+    if not dates:
+        return
+    session.info.setdefault(_DIRTY_KEY, set()).update(dates)
+    PERIOD_CACHE.invalidate_dates(dates)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_after_commit(session):
+    dates = session.info.pop(_DIRTY_KEY, None)
+    if dates:
+        PERIOD_CACHE.invalidate_dates(dates)
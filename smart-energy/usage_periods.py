@@ -0,0 +1,99 @@
+# usage_periods.py
+# ==========================================
+# 期間解析：把「日 / 月 / 年」轉成日期範圍
+# - 所有期間一律轉成 [start, end) 的日期範圍，查詢時使用
+#   log_date >= start AND log_date < end，可直接走 log_date 索引
+#   （不在欄位上套 YEAR() / MONTH() / extract() 等函式）
+# - label 與 usage_period_cache 的快取 key 使用相同格式
+# ==========================================
+
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+from sqlalchemy import and_
+
+PERIOD_TYPES = ("day", "month", "year")
+
+# label: 期間標籤（YYYY-MM-DD / YYYY-MM / YYYY）
+# start / end: 日期範圍 [start, end)
+Period = namedtuple("Period", ["period_type", "label", "start", "end"])
+
+
+def resolve_period(period_type, value):
+    """
+    將期間字串轉成 Period
+
+    Args:
+        period_type: day / month / year
+        value: YYYY-MM-DD / YYYY-MM / YYYY（也接受 date 物件）
+
+    Raises:
+        ValueError: 類型不支援或格式錯誤
+    """
+    if period_type == "day":
+        if isinstance(value, date):
+            start = value
+        else:
+            try:
+                start = datetime.strptime(value, "%Y-%m-%d").date()
+            except (TypeError, ValueError):
+                raise ValueError(f"日期格式錯誤: {value}，應為 YYYY-MM-DD")
+        return Period("day", start.strftime("%Y-%m-%d"), start, start + timedelta(days=1))
+
+    if period_type == "month":
+        if isinstance(value, date):
+            year, month = value.year, value.month
+        else:
+            try:
+                parts = str(value).split("-")
+                year, month = int(parts[0]), int(parts[1])
+                start = date(year, month, 1)
+            except (IndexError, ValueError):
+                raise ValueError(f"月份格式錯誤: {value}，應為 YYYY-MM")
+        start = date(year, month, 1)
+        end = date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
+        return Period("month", f"{year}-{month:02d}", start, end)
+
+    if period_type == "year":
+        try:
+            year = value.year if isinstance(value, date) else int(value)
+            start = date(year, 1, 1)
+        except (TypeError, ValueError):
+            raise ValueError(f"年份格式錯誤: {value}，應為 YYYY")
+        return Period("year", str(year), start, date(year + 1, 1, 1))
+
+    raise ValueError(f"不支援的 period_type: {period_type}")
+
+
+def resolve_date_range(start_date, end_date):
+    """
+    將「含頭含尾」的日期區間轉成 Period（end 為 end_date 隔天）
+
+    Args:
+        start_date / end_date: date 或 YYYY-MM-DD
+    """
+    start = resolve_period("day", start_date).start
+    end = resolve_period("day", end_date).end
+    return Period("range", f"{start:%Y-%m-%d}~{end - timedelta(days=1):%Y-%m-%d}", start, end)
+
+
+def month_to_date(target_date, include_target_date=True):
+    """
+    取得「月初到 target_date」的 Period（include_target_date=False 時不含當天）
+    """
+    month = resolve_period("month", target_date)
+    end = target_date + timedelta(days=1) if include_target_date else target_date
+    return Period("range", f"{month.start:%Y-%m-%d}~{end - timedelta(days=1):%Y-%m-%d}", month.start, end)
+
+
+def in_period(column, period):
+    """產生 column >= start AND column < end 的條件（可使用日期索引）"""
+    return and_(column >= period.start, column < period.end)
+
+
+def label_of(period_type, target_date):
+    """取得日期所屬期間的標籤"""
+    if period_type == "day":
+        return target_date.strftime("%Y-%m-%d")
+    if period_type == "month":
+        return target_date.strftime("%Y-%m")
+    return str(target_date.year)
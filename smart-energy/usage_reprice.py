@@ -0,0 +1,139 @@
+# usage_reprice.py
+# ==========================================
+# 累進電費重新計價
+# power_logs 的 cost / electricity_rate 是以「寫入當下的當月累積度數」計算。
+# 補登較早日期、刪除或修改紀錄後，同月之後的紀錄都會失準。
+# 本模組只重算受影響的「當月後段」：
+# - 基準 = 當月在變動日期（含）之前的累積度數（一次 SUM）
+# - 之後的紀錄依 (log_date, log_id) 排序，以 NumPy 累加後一次計價
+# - 只更新 cost 有變動的列，並同步彙總表的電費
+# - 已軟刪除（等待背景清除）設備的紀錄不計入累積度數，也不重新計價
+#
+# 注意：本模組的函式都「不會 commit」，由呼叫端決定交易邊界
+# ==========================================
+
+from models import db, PowerLog, not_deleted_device
+from datetime import date, timedelta
+from sqlalchemy import func, bindparam
+from usage_rollup import apply_usage_deltas, month_end_of
+from fixed_point import ENERGY_SCALE, energy_units_sql, energy_value, cost_units
+from tariff import marginal_cost, season_of
+import numpy as np
+
+
+def _reprice_range(month_start, first_date):
+    """
+    重新計價某月份中 first_date（含）之後的紀錄
+
+    Returns:
+        dict: {log_id: {"cost", "electricity_rate"}}（只含有變動的紀錄）
+    """
+    month_end = month_end_of(month_start)
+    if first_date >= month_end:
+        return {}
+
+    base = db.session.query(func.sum(energy_units_sql(PowerLog.energy_consumed))).filter(
+        PowerLog.log_date >= month_start,
+        PowerLog.log_date < first_date,
+        not_deleted_device(PowerLog.device_id)
+    ).scalar()
+
+    rows = db.session.query(
+        PowerLog.log_id, PowerLog.device_id, PowerLog.log_date,
+        energy_units_sql(PowerLog.energy_consumed).label("energy_units"), PowerLog.cost, PowerLog.electricity_rate
+    ).filter(
+        PowerLog.log_date >= first_date,
+        PowerLog.log_date < month_end,
+        not_deleted_device(PowerLog.device_id)
+    ).order_by(PowerLog.log_date, PowerLog.log_id).all()
+    if not rows:
+        return {}
+
+    # 同一天依 log_id（寫入順序）計價，與逐筆 /usage/add 的規則一致
+    energy = np.array([r.energy_units for r in rows], dtype=np.int64)
+    after = int(base or 0) + np.cumsum(energy)
+    before = after - energy
+    costs = marginal_cost(before / ENERGY_SCALE, after / ENERGY_SCALE, season_of(month_start))
+
+    updated = {}
+    rollup_deltas = []
+    for row, units, raw_cost in zip(rows, energy.tolist(), costs.tolist()):
+        cost = round(raw_cost, 2)
+        kwh = energy_value(units)
+        rate = round(cost / kwh, 2) if kwh > 0 else 0
+        if row.cost is not None and cost_units(row.cost) == cost_units(cost) \
+                and float(row.electricity_rate or 0) == rate:
+            continue
+        updated[row.log_id] = {"cost": cost, "electricity_rate": rate}
+        rollup_deltas.append((row.device_id, row.log_date, 0, (cost_units(cost) - cost_units(row.cost)) / 100, 0))
+
+    if updated:
+        table = PowerLog.__table__
+        db.session.execute(
+            table.update().where(table.c.log_id == bindparam("b_log_id")).values(
+                cost=bindparam("b_cost"), electricity_rate=bindparam("b_rate")
+            ),
+            [
+                {"b_log_id": log_id, "b_cost": u["cost"], "b_rate": u["electricity_rate"]}
+                for log_id, u in updated.items()
+            ]
+        )
+        apply_usage_deltas(rollup_deltas)
+    return updated
+
+
+def _earliest_per_month(dates):
+    """{月初: 該月最早的日期}"""
+    earliest = {}
+    for d in dates:
+        month_start = date(d.year, d.month, 1)
+        if month_start not in earliest or d < earliest[month_start]:
+            earliest[month_start] = d
+    return earliest
+
+
+def reprice_from(changed_dates):
+    """
+    刪除或修改紀錄後，重新計價各月份中「最早變動日期（含）之後」的紀錄
+
+    Args:
+        changed_dates: 有變動的日期（可重複、可跨月）
+
+    Returns:
+        dict: {log_id: {"cost", "electricity_rate"}}（只含有變動的紀錄）
+    """
+    updated = {}
+    for month_start, first_date in sorted(_earliest_per_month(changed_dates).items()):
+        updated.update(_reprice_range(month_start, first_date))
+    return updated
+
+
+def reprice_after(inserted_dates):
+    """
+    補登紀錄後，重新計價各月份中「最早補登日期之後」的紀錄
+
+    新紀錄在當日排在最後（log_id 最大），當日較早的紀錄不受影響，
+    因此只需從隔天開始重算。
+
+    Returns:
+        dict: {log_id: {"cost", "electricity_rate"}}（只含有變動的紀錄）
+    """
+    updated = {}
+    for month_start, last_date in sorted(_earliest_per_month(inserted_dates).items()):
+        updated.update(_reprice_range(month_start, last_date + timedelta(days=1)))
+    return updated
+
+
+def reprice_all():
+    """
+    重新計價所有月份（flask usage reprice）
+
+    Returns:
+        dict: 處理的月份數與更新筆數
+    """
+    month_starts = {
+        date(d.year, d.month, 1)
+        for (d,) in db.session.query(PowerLog.log_date).distinct()
+    }
+    updated = reprice_from(month_starts)
+    return {"months": len(month_starts), "updated": len(updated)}
@@ -0,0 +1,280 @@
+# usage_rollup.py
+# ==========================================
+# 用電彙總表維護（usage_daily_rollup / usage_monthly_rollup）
+# - 寫入 power_logs 時，在同一個交易內以「增量」方式更新彙總表
+# - 每筆變動會同時更新：設備日彙總、全戶日彙總、設備月彙總、全戶月彙總
+# - rebuild_rollups() 可從原始 power_logs 重新產生全部彙總資料
+# - 全戶月彙總列同時作為「月帳本」：寫入前以 SELECT ... FOR UPDATE 鎖定，
+#   同月的併發寫入會依序計價，不會以相同的累積度數重複套用低級距費率
+#   apply_usage_deltas() 會替本交易尚未鎖定的月份補鎖，彙總表不會在未持有帳本鎖時被修改
+#
+# 注意：本模組的函式都「不會 commit」，由呼叫端決定交易邊界
+# ==========================================
+
+from models import db, PowerLog, UsageDailyRollup, UsageMonthlyRollup, not_deleted_device
+from datetime import date
+from decimal import Decimal
+from sqlalchemy import event, func, or_, and_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from fixed_point import energy_units, energy_units_sql
+from usage_period_cache import PERIOD_CACHE, mark_dates_changed
+
+# 全戶合計使用的虛擬設備 ID
+HOME_DEVICE_ID = 0
+
+# session.info 中記錄本交易已鎖定月帳本的月份
+_LOCKED_KEY = "usage_locked_months"
+
+
+def month_start_of(target_date):
+    """取得日期所屬月份的 1 日"""
+    return date(target_date.year, target_date.month, 1)
+
+
+def month_end_of(target_date):
+    """取得日期所屬月份的下個月 1 日"""
+    if target_date.month == 12:
+        return date(target_date.year + 1, 1, 1)
+    return date(target_date.year, target_date.month + 1, 1)
+
+
+def _to_decimal(value):
+    """將數值轉成 Decimal（None 視為 0）"""
+    if value is None:
+        return Decimal("0")
+    if isinstance(value, Decimal):
+        return value
+    return Decimal(str(value))
+
+
+def _accumulate(daily, monthly, device_id, log_date, kwh, cost, count):
+    """將一筆變動累加到設備與全戶的日/月彙總暫存 dict"""
+    kwh = _to_decimal(kwh)
+    cost = _to_decimal(cost)
+    # 以 set 去重：device_id 為 HOME_DEVICE_ID 時只累加一次
+    device_ids = {device_id, HOME_DEVICE_ID}
+    for target, key_date in ((daily, log_date), (monthly, month_start_of(log_date))):
+        for key_device in device_ids:
+            acc = target.setdefault((key_device, key_date), [Decimal("0"), Decimal("0"), 0])
+            acc[0] += kwh
+            acc[1] += cost
+            acc[2] += count
+
+
+def apply_usage_deltas(deltas):
+    """
+    將多筆用電變動套用到彙總表（不 commit）
+
+    Args:
+        deltas: 可迭代的 (device_id, log_date, kwh_delta, cost_delta, count_delta)
+
+    同一個 key 的變動會先合併，每個 key 只讀寫一次彙總列。
+    呼叫端應先以 lock_month_ledgers() 依月份順序加鎖；本交易尚未鎖定的月份會在這裡補鎖。
+    """
+    daily = {}
+    monthly = {}
+    for device_id, log_date, kwh, cost, count in deltas:
+        _accumulate(daily, monthly, device_id, log_date, kwh, cost, count)
+
+    unlocked = {month_start for _, month_start in monthly} - db.session.info.get(_LOCKED_KEY, set())
+    if unlocked:
+        lock_month_ledgers(unlocked)
+
+    # 已結束期間的統計快取在 commit 後失效（見 usage_period_cache.py）
+    mark_dates_changed(db.session, {key_date for _, key_date in daily})
+
+    _merge_rows(UsageDailyRollup, UsageDailyRollup.log_date, "log_date", daily)
+    _merge_rows(UsageMonthlyRollup, UsageMonthlyRollup.month_start, "month_start", monthly)
+
+
+def _merge_rows(model, date_column, date_attr, changes):
+    """將合併後的變動寫入指定彙總表（讀取既有列 → 累加或新增）"""
+    if not changes:
+        return
+
+    keys = list(changes.keys())
+    device_ids = {k[0] for k in keys}
+    dates = {k[1] for k in keys}
+
+    # 一次讀出所有相關的既有列
+    existing = {
+        (row.device_id, getattr(row, date_attr)): row
+        for row in model.query.filter(
+            model.device_id.in_(device_ids),
+            date_column.in_(dates)
+        ).all()
+    }
+
+    new_rows = {}
+    for key, (kwh, cost, count) in changes.items():
+        row = existing.get(key)
+        if row is None:
+            new_rows[key] = (kwh, cost, count)
+            continue
+        row.energy_consumed = _to_decimal(row.energy_consumed) + kwh
+        row.cost = _to_decimal(row.cost) + cost
+        row.record_count = (row.record_count or 0) + count
+
+    # 新的彙總列以多列 INSERT 一次寫入
+    _bulk_insert(model, date_attr, new_rows)
+
+
+def lock_month_ledgers(month_starts):
+    """
+    鎖定（必要時先建立）指定月份的全戶月彙總列（不 commit）
+
+    依月份排序後加鎖，避免多個交易交錯鎖定造成死結。
+
+    Returns:
+        dict: {month_start: UsageMonthlyRollup}
+    """
+    month_starts = sorted(set(month_starts))
+    if not month_starts:
+        return {}
+
+    def _select():
+        return {
+            row.month_start: row
+            for row in UsageMonthlyRollup.query.filter(
+                UsageMonthlyRollup.device_id == HOME_DEVICE_ID,
+                UsageMonthlyRollup.month_start.in_(month_starts)
+            ).order_by(UsageMonthlyRollup.month_start).with_for_update().all()
+        }
+
+    ledgers = _select()
+    missing = [m for m in month_starts if m not in ledgers]
+    if missing:
+        for month_start in missing:
+            # 併發建立同一月份時，較晚的 INSERT 會違反唯一索引：只回滾該 savepoint
+            try:
+                with db.session.begin_nested():
+                    db.session.execute(UsageMonthlyRollup.__table__.insert(), {
+                        "device_id": HOME_DEVICE_ID,
+                        "month_start": month_start,
+                        "energy_consumed": 0,
+                        "cost": 0,
+                        "record_count": 0
+                    })
+            except IntegrityError:
+                pass
+        ledgers = _select()
+    db.session.info.setdefault(_LOCKED_KEY, set()).update(month_starts)
+    return ledgers
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _forget_locked_months(session, transaction):
+    # 最外層交易結束（commit / rollback / close）即釋放所有列鎖
+    if transaction.parent is None:
+        session.info.pop(_LOCKED_KEY, None)
+
+
+def load_home_day_units(month_starts):
+    """
+    從全戶日彙總讀出指定月份的每日用電量
+
+    Returns:
+        dict: {log_date: 當日全戶用電量（整數單位，見 fixed_point.py）}
+    """
+    month_starts = set(month_starts)
+    if not month_starts:
+        return {}
+    rows = db.session.query(UsageDailyRollup.log_date, energy_units_sql(UsageDailyRollup.energy_consumed)).filter(
+        UsageDailyRollup.device_id == HOME_DEVICE_ID,
+        or_(*[
+            and_(UsageDailyRollup.log_date >= m, UsageDailyRollup.log_date < month_end_of(m))
+            for m in month_starts
+        ])
+    ).all()
+    return dict(rows)
+
+
+def ledger_base_units(ledger, log_date):
+    """
+    以月帳本計算某日寫入的計價基準（整數單位）
+
+    帳本是整月累積量，扣掉 log_date 之後（補登時才會有）與當日的用量，
+    即為「當月截至前一天」的累積量。
+
+    Returns:
+        (month_base_units, today_units)
+    """
+    month_end = month_end_of(log_date)
+    rows = db.session.query(UsageDailyRollup.log_date, energy_units_sql(UsageDailyRollup.energy_consumed)).filter(
+        UsageDailyRollup.device_id == HOME_DEVICE_ID,
+        UsageDailyRollup.log_date >= log_date,
+        UsageDailyRollup.log_date < month_end
+    ).all()
+    today_units = sum(units for d, units in rows if d == log_date)
+    later_units = sum(units for d, units in rows if d != log_date)
+    total_units = energy_units(ledger.energy_consumed) if ledger is not None else 0
+    return total_units - later_units - today_units, today_units
+
+
+def record_log_added(log):
+    """新增一筆 PowerLog 後更新彙總表"""
+    apply_usage_deltas([(log.device_id, log.log_date, log.energy_consumed, log.cost, 1)])
+
+
+def remove_device_rollups(device_id):
+    """
+    刪除設備時，從全戶彙總中扣除該設備的用量並刪除該設備的彙總列（不 commit）
+    """
+    rows = UsageDailyRollup.query.filter_by(device_id=device_id).all()
+    apply_usage_deltas([
+        (HOME_DEVICE_ID, row.log_date, -_to_decimal(row.energy_consumed), -_to_decimal(row.cost), -row.record_count)
+        for row in rows
+    ])
+    UsageDailyRollup.query.filter_by(device_id=device_id).delete(synchronize_session=False)
+    UsageMonthlyRollup.query.filter_by(device_id=device_id).delete(synchronize_session=False)
+
+
+def rebuild_rollups(chunk_size=5000):
+    """
+    從 power_logs 重新產生所有彙總資料（不 commit）
+
+    Returns:
+        dict: 產生的日彙總列數與月彙總列數
+    """
+    UsageDailyRollup.query.delete(synchronize_session=False)
+    UsageMonthlyRollup.query.delete(synchronize_session=False)
+    PERIOD_CACHE.clear()
+
+    grouped = db.session.query(
+        PowerLog.device_id,
+        PowerLog.log_date,
+        func.sum(PowerLog.energy_consumed),
+        func.sum(PowerLog.cost),
+        func.count(PowerLog.log_id)
+    ).filter(
+        not_deleted_device(PowerLog.device_id)
+    ).group_by(PowerLog.device_id, PowerLog.log_date)
+
+    daily = {}
+    monthly = {}
+    for device_id, log_date, kwh, cost, count in grouped.yield_per(chunk_size):
+        _accumulate(daily, monthly, device_id, log_date, kwh, cost, count)
+
+    _bulk_insert(UsageDailyRollup, "log_date", daily, chunk_size)
+    _bulk_insert(UsageMonthlyRollup, "month_start", monthly, chunk_size)
+
+    return {"daily_rows": len(daily), "monthly_rows": len(monthly)}
+
+
+def _bulk_insert(model, date_attr, rows, chunk_size=5000):
+    """以多列 INSERT 分批寫入彙總列"""
+    batch = []
+    for (device_id, key_date), (kwh, cost, count) in rows.items():
+        batch.append({
+            "device_id": device_id,
+            date_attr: key_date,
+            "energy_consumed": kwh,
+            "cost": cost,
+            "record_count": count
+        })
+        if len(batch) >= chunk_size:
+            db.session.execute(model.__table__.insert(), batch)
+            batch = []
+    if batch:
+        db.session.execute(model.__table__.insert(), batch)